@@ -0,0 +1,216 @@
+'''
+Golden checks and microbenchmark of the post-processing of the chat answers.
+
+The previous implementations of LLMHelper (filter_sourcesLinks, extract_followupquestions,
+insert_citations_in_answer, get_links_filenames and the chain of SOURCES splits) are kept
+below as the reference. utilities.answers must give the same output
+- on hand written answers: citations, follow-up questions in every format, sources parts
+- on --fuzz random answers built from the fragments the patterns look for
+then both are timed on answers of growing length with a citation and a source every few
+sentences, and follow-up questions at the end.
+tests/test_answers.py runs the same checks with pytest.
+
+    python benchmarks/answer_postprocessing.py --fuzz 20000
+'''
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utilities.answers import extract_followup_questions, filter_source_links, insert_citations, parse_sources, process_answer, strip_sources
+
+def before_strip_sources(answer):
+    return answer.split('SOURCES:')[0].split('Sources:')[0].split('SOURCE:')[0].split('Source:')[0]
+
+def before_filter_sources_links(sources):
+    pattern = r'\[[^\]]*?/([^/\]]*?)\]'
+    match = re.search(pattern, sources)
+    while match:
+        withoutExtensions = match.group(1).split('.')[0]
+        sources = sources[:match.start()] + f'[{withoutExtensions}]' + sources[match.end():]
+        match = re.search(pattern, sources)
+    sources = '  \n ' + sources.replace('\n', '  \n ')
+    return sources
+
+def before_extract_followup_questions(answer):
+    followupTag = answer.find('Follow-up Questions')
+    followupQuestions = answer.find('<<')
+    followupTag = min(followupTag, followupQuestions) if followupTag != -1 and followupQuestions != -1 else max(followupTag, followupQuestions)
+    answer_without_followupquestions = answer[:followupTag] if followupTag != -1 else answer
+    followup_questions = answer[followupTag:].strip() if followupTag != -1 else ''
+    pattern = r'\<\<(.*?)\>\>'
+    match = re.search(pattern, followup_questions)
+    followup_questions_list = []
+    while match:
+        followup_questions_list.append(followup_questions[match.start()+2:match.end()-2])
+        followup_questions = followup_questions[match.end():]
+        match = re.search(pattern, followup_questions)
+    if followup_questions_list != '':
+        pattern = r'\d. (.*)'
+        match = re.search(pattern, followup_questions)
+        while match:
+            followup_questions_list.append(followup_questions[match.start()+3:match.end()])
+            followup_questions = followup_questions[match.end():]
+            match = re.search(pattern, followup_questions)
+    if followup_questions_list != '':
+        pattern = r'Follow-up Question: (.*)'
+        match = re.search(pattern, followup_questions)
+        while match:
+            followup_questions_list.append(followup_questions[match.start()+19:match.end()])
+            followup_questions = followup_questions[match.end():]
+            match = re.search(pattern, followup_questions)
+    followupTag = answer_without_followupquestions.lower().find('follow-up questions')
+    if followupTag != -1:
+        answer_without_followupquestions = answer_without_followupquestions[:followupTag]
+    followupTag = answer_without_followupquestions.lower().find('follow up questions')
+    if followupTag != -1:
+        answer_without_followupquestions = answer_without_followupquestions[:followupTag]
+    return answer_without_followupquestions, followup_questions_list
+
+def before_insert_citations(answer, filenameList):
+    filenameList_lowered = [x.lower() for x in filenameList]
+    matched_sources = []
+    pattern = r'\[\[(.*?)\]\]'
+    match = re.search(pattern, answer)
+    while match:
+        filename = match.group(1).split('.')[0]
+        if filename in filenameList:
+            if filename not in matched_sources:
+                matched_sources.append(filename.lower())
+            filenameIndex = filenameList.index(filename) + 1
+            answer = answer[:match.start()] + '$^{' + f'{filenameIndex}' + '}$' + answer[match.end():]
+        else:
+            answer = answer[:match.start()] + '$^{' + f'{filename.lower()}' + '}$' + answer[match.end():]
+        match = re.search(pattern, answer)
+    for id, filename in enumerate(filenameList_lowered):
+        reference = '$^{' + f'{id+1}' + '}$'
+        if reference in answer and not filename in matched_sources:
+            matched_sources.append(filename)
+    return answer, matched_sources, filenameList_lowered
+
+def before_get_links_filenames(answer, sources):
+    split_sources = sources.split('  \n ')
+    srcList = []
+    linkList = []
+    filenameList = []
+    for src in split_sources:
+        if src != '':
+            srcList.append(src)
+            link = src[1:].split('(')[1][:-1].split(')')[0]
+            linkList.append(link)
+            filename = src[1:].split(']')[0]
+            source_url = link.split('?')[0]
+            answer = answer.replace(source_url, filename)
+            filenameList.append(filename)
+    answer, matchedSourcesList, filenameList = before_insert_citations(answer, filenameList)
+    return answer, srcList, matchedSourcesList, linkList, filenameList
+
+def before_process_answer(answer, sources):
+    answer, followup_questions = before_extract_followup_questions(before_strip_sources(answer))
+    answer, srcList, matchedSourcesList, linkList, filenameList = before_get_links_filenames(answer, sources)
+    return answer, followup_questions, srcList, matchedSourcesList, linkList, filenameList
+
+def after_get_links_filenames(answer, sources):
+    answer, sources_list, links, filenames = parse_sources(answer, sources)
+    answer, matched_sources, filenames = insert_citations(answer, filenames)
+    return answer, sources_list, matched_sources, links, filenames
+
+SOURCES = "[https://blob/documents/converted/call1.txt](https://blob/documents/converted/call1.txt?sas)\n[https://blob/documents/converted/Call2.pdf.txt](https://blob/documents/converted/Call2.pdf.txt?sas)"
+
+GOLDEN_ANSWERS = [
+    "",
+    "The delivery was late [[call1.txt]].",
+    "The delivery was late [[call1.txt]] and refunded [[Call2.txt]] [[call3.txt]] [[call1]].",
+    "Late delivery [[CALL1.txt]]. SOURCES: call1.txt",
+    "Late delivery. Sources: [[call1.txt]]",
+    "Late. Source: a SOURCE: b SOURCES: c",
+    "Answer $^{1}$ already cited $^{2}$^{3}$ and $^{12}$.",
+    "Answer.\nFollow-up Questions:\n<<What was ordered?>>\n<<When was it shipped?>>",
+    "Answer <<Is it late?>> <<Refund?>>",
+    "Answer.\nFollow-up Questions:\n1. What was ordered?\n2. When was it shipped?",
+    "Answer.\nFollow-up Questions:\nFollow-up Question: What was ordered?\nFollow-up Question: When?",
+    "Answer.\nfollow up questions: none <<only one>>",
+    "Answer. Follow-up questions are below <<a>> 1. b\n2) c\nFollow-up Question: d",
+    "Nested [[a[[b]] x]] then [[call1.txt]].",
+    "Path https://blob/documents/converted/call1.txt was cited [[call1.txt]].",
+    "Unclosed [[call1.txt and <<question",
+    "Multiline [[call1\n.txt]] <<a\nb>>",
+]
+
+SOURCES_LIST = [
+    "",
+    "[call1.txt](https://blob/call1.txt)",
+    "[a/b/c.d.e](link)\n[x/y](z) [no slash](w) [[p/q]]",
+    "[a/b/c/](l)\n[/](m)\n[a/b/c.pdf](https://blob/a/b/c.pdf?sas)",
+]
+
+FRAGMENTS = ["[[", "]]", "<<", ">>", "[", "]", "/", ".", "\n", " ", "1. ", "2) ", "call1.txt", "Call2", "x",
+             "Follow-up Questions", "Follow-up Question: ", "follow up questions", "FOLLOW-UP QUESTIONS",
+             "SOURCES:", "Source:", "$^{1}$", "$^{2}", "}$", "https://blob/documents/converted/call1.txt"]
+
+def check(name, before, after, *args):
+    expected, actual = before(*args), after(*args)
+    assert expected == actual, f"{name}{args!r}:\n  before {expected!r}\n  after  {actual!r}"
+
+def check_all(answer, sources, filenames):
+    check("strip_sources", before_strip_sources, strip_sources, answer)
+    check("filter_source_links", before_filter_sources_links, filter_source_links, sources)
+    check("extract_followup_questions", before_extract_followup_questions, extract_followup_questions, answer)
+    check("insert_citations", before_insert_citations, insert_citations, answer, filenames)
+    filtered = before_filter_sources_links(sources)
+    try:
+        expected = before_get_links_filenames(answer, filtered)
+    except IndexError:
+        # Sources without a link, both fail the same way
+        expected = IndexError
+    if expected is not IndexError:
+        assert after_get_links_filenames(answer, filtered) == expected, f"get_links_filenames{(answer, filtered)!r}"
+        assert tuple(process_answer(answer, filtered)) == before_process_answer(answer, filtered), f"process_answer{(answer, filtered)!r}"
+
+def long_answer(sentences, seed=0):
+    generator = random.Random(seed)
+    parts = []
+    for i in range(sentences):
+        parts.append(f"The agent confirmed the order number {i} and the delivery date of the parcel.")
+        if i % 3 == 0:
+            parts.append(generator.choice(["[[call1.txt]]", "[[Call2.pdf]]", "[[unknown.txt]]"]))
+    parts.append("\nFollow-up Questions:\n<<What was ordered?>>\n<<When was it shipped?>>\n1. Was it refunded?\nSOURCES: call1.txt")
+    return " ".join(parts)
+
+def timed(function, *args, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fuzz', type=int, default=20000)
+    args = parser.parse_args()
+
+    filenames = ["call1", "Call2", "call1"]
+    for answer in GOLDEN_ANSWERS:
+        for sources in SOURCES_LIST + [SOURCES]:
+            check_all(answer, sources, filenames)
+    generator = random.Random(0)
+    for _ in range(args.fuzz):
+        answer = "".join(generator.choices(FRAGMENTS, k=generator.randint(0, 30)))
+        sources = "".join(generator.choices(FRAGMENTS + ["(", ")", "?"], k=generator.randint(0, 15)))
+        check_all(answer, sources, filenames)
+    print(f"golden: {len(GOLDEN_ANSWERS) * (len(SOURCES_LIST) + 1)} hand written and {args.fuzz} random answers give the same output")
+
+    sources = before_filter_sources_links(SOURCES)
+    for sentences in (30, 300, 3000):
+        answer = long_answer(sentences)
+        before = timed(before_process_answer, answer, sources)
+        after = timed(process_answer, answer, sources)
+        print(f"{len(answer):8d} characters: before {before * 1000:8.2f} ms  after {after * 1000:6.2f} ms  {before / after:6.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+'''
+Concurrency benchmark for the async Azure Cognitive Search query path.
+
+Starts a local fake search endpoint (index lookup + docs/search.post.search with a fixed
+latency) and runs --queries hybrid searches from a single worker: one after the other with
+AzureSearch, then all at once with the AsyncAzureSearch that the retriever uses, which
+reuses one async client (and connection pool) for every query.
+
+Needs the same packages as the function app (azure-search-documents, aiohttp, langchain).
+
+    python benchmarks/async_search_concurrency.py --queries 200 --latency 0.05
+'''
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'vector database'))
+
+from search_database import AzureSearch
+
+INDEX_NAME = "bench"
+DIMENSIONS = 1536
+
+def start_fake_search_service(latency):
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, body):
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json; odata.metadata=none')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            # Index lookup done by get_search_client
+            self.send_json({"name": INDEX_NAME, "fields": [{"name": "id", "type": "Edm.String", "key": True}]})
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            time.sleep(latency)
+            self.send_json({"value": [
+                {"@search.score": 0.9, "id": str(i), "title": "call", "content": f"transcript chunk {i}", "metadata": json.dumps({"key": str(i)})}
+                for i in range(4)
+            ]})
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def embed(text):
+    return [0.01] * DIMENSIONS
+
+async def aembed(text):
+    return [0.01] * DIMENSIONS
+
+async def run_async(store, queries):
+    async_store = store.async_store
+    try:
+        return await asyncio.gather(*[async_store.ahybrid_search(query, k=4) for query in queries])
+    finally:
+        await async_store.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per search')
+    args = parser.parse_args()
+
+    server = start_fake_search_service(args.latency)
+    endpoint = f"http://127.0.0.1:{server.server_port}"
+    store = AzureSearch(endpoint, "fake-key", INDEX_NAME, embedding_function=embed, async_embedding_function=aembed)
+    queries = [f"how do I reset my password {i}" for i in range(args.queries)]
+
+    start = time.perf_counter()
+    for query in queries:
+        store.hybrid_search(query, k=4)
+    sync_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = asyncio.run(run_async(store, queries))
+    async_time = time.perf_counter() - start
+    server.shutdown()
+
+    assert all(len(docs) == 4 for docs in results)
+    print(f"sync : {args.queries} queries, {sync_time:.2f}s, {args.queries / sync_time:.0f} queries/s")
+    print(f"async: {args.queries} queries, {async_time:.2f}s, {args.queries / async_time:.0f} queries/s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+'''
+Bulk delete benchmark for AzureSearch against a local fake search service.
+
+The fake service keeps --documents ids in memory, answers the id-ordered listing queries
+(filter "id gt '<last id>'", top) and the index batches, with --latency seconds per request.
+The index is wiped twice:
+- serial: the ids are listed, then deleted one batch of 1000 after the other (the previous
+  delete_keys, without its off-by-one first batch)
+- bulk: AzureSearch.delete_by_filter(), listing streamed into concurrent delete batches
+
+Needs the same packages as the function app (azure-search-documents, langchain).
+
+    python benchmarks/azure_bulk_delete.py --documents 100000 --latency 0.2
+'''
+import argparse
+import bisect
+import json
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'vector database'))
+
+from search_database import AzureSearch
+
+INDEX_NAME = "bench"
+
+def start_fake_search_service(ids, latency):
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, body):
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json; odata.metadata=none')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            # Index lookup done by get_search_client
+            self.send_json({"name": INDEX_NAME, "fields": [{"name": "id", "type": "Edm.String", "key": True}]})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            time.sleep(latency)
+            if 'search.index' in self.path:
+                with lock:
+                    for action in body['value']:
+                        i = bisect.bisect_left(ids, action['id'])
+                        if i < len(ids) and ids[i] == action['id']:
+                            ids.pop(i)
+                self.send_json({"value": [{"key": action['id'], "status": True, "statusCode": 200} for action in body['value']]})
+                return
+            after = re.search(r"id gt '([^']*)'", body.get('filter') or '')
+            with lock:
+                start = bisect.bisect_right(ids, after.group(1)) if after else 0
+                page = ids[start:start + body.get('top', 50)]
+            self.send_json({"value": [{"@search.score": 1.0, "id": i} for i in page]})
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def serial_wipe(store):
+    ids = [row["id"] for page in store.iter_document_pages(fields=("id",)) for row in page]
+    for i in range(0, len(ids), 1000):
+        store.client.delete_documents(documents=[{"id": id} for id in ids[i:i + 1000]])
+    return len(ids)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--documents', type=int, default=100000)
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds per request')
+    args = parser.parse_args()
+
+    ids = []
+    server = start_fake_search_service(ids, args.latency)
+    store = AzureSearch(f"http://127.0.0.1:{server.server_port}", "fake-key", INDEX_NAME, embedding_function=None)
+    for name, wipe in (("serial", serial_wipe), ("bulk", lambda store: store.delete_by_filter())):
+        ids[:] = sorted(f"doc_{i:08d}" for i in range(args.documents))
+        start = time.perf_counter()
+        deleted = wipe(store)
+        elapsed = time.perf_counter() - start
+        assert not ids, f"{len(ids)} documents left"
+        print(f"{name:6}: {deleted} documents in {elapsed:.1f}s, {deleted / elapsed:,.0f} deletes/s")
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+'''
+Throughput benchmark of the batch prompt runner.
+
+Starts a local fake completion endpoint that answers after --latency seconds and throttles
+like an Azure OpenAI deployment: above --rpm requests per minute (counted over 10 second
+windows) it answers 429 with a Retry-After header. Then runs a prompt over --documents
+transcripts
+- sequential: one completion after the other, as process_all did, retrying after the
+  Retry-After on a 429 (the old loop had no retry and stopped at the first one)
+- batch: utilities.batch.BatchRunner with --workers in flight and a RateLimiter set to the
+  quota of the deployment (the limiter starts with 10 seconds of quota)
+- resumed: the batch interrupted after half of the documents, then run again skipping the
+  keys it completed, as LLMHelper.run_prompt_batch does with the job set kept in Redis
+
+    python benchmarks/batch_prompts.py --documents 400 --latency 0.5 --rpm 1200 --workers 16
+'''
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utilities.batch import BatchRunner, RateLimiter, is_throttled, retry_after
+
+def start_fake_completion_service(latency, requests_per_minute):
+    window = 10.0
+    lock = threading.Lock()
+    state = {"start": time.monotonic(), "count": 0, "throttled": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            with lock:
+                now = time.monotonic()
+                if now - state["start"] >= window:
+                    state["start"], state["count"] = now, 0
+                state["count"] += 1
+                throttled = state["count"] > requests_per_minute * window / 60
+                wait = window - (now - state["start"])
+                state["throttled"] += throttled
+            if throttled:
+                self.send_response(429)
+                self.send_header('Retry-After', f"{wait:.2f}")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            time.sleep(latency)
+            payload = json.dumps({"choices": [{"message": {"role": "assistant", "content": "The customer asks about a late delivery."}}]}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        # Room for every connection of the workers
+        request_queue_size = 128
+
+    server = Server(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+def make_completion(url):
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=64))
+    def complete(prompt):
+        response = session.post(url, json={"messages": [{"role": "user", "content": prompt}]})
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"]
+    return complete
+
+def sequential(complete, items):
+    results = {}
+    for key, prompt, _ in items:
+        while True:
+            try:
+                results[key] = complete(prompt)
+                break
+            except requests.HTTPError as e:
+                if not is_throttled(e):
+                    raise
+                time.sleep(retry_after(e) or 1.0)
+    return results
+
+def batch(complete, items, args, rate_limiter, stop_after=None):
+    runner = BatchRunner(complete, rate_limiter=rate_limiter, max_workers=args.workers, backoff=0.2)
+    results = {}
+    for key, response, _ in runner.run(items):
+        results[key] = response
+        if stop_after is not None and len(results) >= stop_after:
+            # Stands for a crash, the results written so far are kept
+            break
+    return results, runner
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--documents', type=int, default=400)
+    parser.add_argument('--latency', type=float, default=0.5, help='seconds per completion')
+    parser.add_argument('--rpm', type=int, default=1200, help='requests per minute of the deployment')
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--skip-sequential', action='store_true')
+    args = parser.parse_args()
+
+    server, state = start_fake_completion_service(args.latency, args.rpm)
+    complete = make_completion(f"http://127.0.0.1:{server.server_port}/openai/deployments/bench/chat/completions")
+    items = [(f"doc:{i}", f"Transcript {i}: the customer calls about an order.\nSummarize the call.\n\n", f"call{i}.txt") for i in range(args.documents)]
+    print(f"{args.documents} documents, {args.latency}s per completion, {args.rpm} requests per minute")
+
+    if not args.skip_sequential:
+        start = time.perf_counter()
+        results = sequential(complete, items)
+        elapsed = time.perf_counter() - start
+        print(f"sequential: {len(results)} completions in {elapsed:6.1f}s, {len(results) / elapsed:6.1f}/s")
+
+    # One limiter for the deployment, shared by the runs like the one LLMHelper keeps in the registry
+    rate_limiter = RateLimiter(requests_per_minute=args.rpm)
+    state["throttled"] = 0
+    start = time.perf_counter()
+    results, runner = batch(complete, items, args, rate_limiter)
+    elapsed = time.perf_counter() - start
+    print(f"batch     : {len(results)} completions in {elapsed:6.1f}s, {len(results) / elapsed:6.1f}/s, {state['throttled']} throttled, {runner.stats()}")
+
+    start = time.perf_counter()
+    first, _ = batch(complete, items, args, rate_limiter, stop_after=args.documents // 2)
+    resumed, runner = batch(complete, [item for item in items if item[0] not in first], args, rate_limiter)
+    elapsed = time.perf_counter() - start
+    assert set(first) | set(resumed) == {key for key, _, _ in items} and not set(first) & set(resumed)
+    print(f"resumed   : {len(first)} + {len(resumed)} completions in {elapsed:6.1f}s, none repeated")
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+'''
+Time-to-first-token benchmark of the streaming completion path.
+
+Starts a local fake Azure OpenAI endpoint that generates --tokens tokens, one every --delay
+seconds, and compares
+- a regular chat completion: the first token is only seen once the whole answer is returned
+- stream_completion (LLMHelper.get_completion(prompt, stream=True)): tokens are read as the
+  endpoint sends them
+Needs the openai package used by the function apps.
+
+    python benchmarks/completion_ttft.py --tokens 200 --delay 0.02
+'''
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utilities.streaming import stream_completion
+
+DEPLOYMENT = "bench-chat"
+
+def start_fake_openai_service(tokens, delay):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            words = [f"word{i} " for i in range(tokens)]
+            if not body.get('stream'):
+                time.sleep(delay * tokens)
+                payload = json.dumps({"id": "bench", "object": "chat.completion", "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "".join(words)}}]}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for word in words:
+                time.sleep(delay)
+                self.write_chunk({"id": "bench", "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]})
+            self.write_chunk("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def write_chunk(self, data):
+            event = f"data: {data if isinstance(data, str) else json.dumps(data)}\n\n".encode('utf-8')
+            self.wfile.write(f"{len(event):x}\r\n".encode('ascii') + event + b"\r\n")
+            self.wfile.flush()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def blocking(prompt):
+    start = time.perf_counter()
+    response = openai.ChatCompletion.create(engine=DEPLOYMENT, messages=[{"role": "user", "content": prompt}])
+    elapsed = time.perf_counter() - start
+    return elapsed, elapsed, len(response['choices'][0]['message']['content'].split())
+
+def streaming(prompt):
+    start = time.perf_counter()
+    first_token = None
+    count = 0
+    for _ in stream_completion(prompt, DEPLOYMENT, "Chat"):
+        if first_token is None:
+            first_token = time.perf_counter() - start
+        count += 1
+    return first_token, time.perf_counter() - start, count
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tokens', type=int, default=200)
+    parser.add_argument('--delay', type=float, default=0.02, help='seconds per generated token')
+    args = parser.parse_args()
+
+    server = start_fake_openai_service(args.tokens, args.delay)
+    openai.api_type = "azure"
+    openai.api_base = f"http://127.0.0.1:{server.server_port}"
+    openai.api_version = "2023-03-15-preview"
+    openai.api_key = "fake-key"
+
+    prompt = "Summarize the call in one paragraph."
+    for name, run in (("blocking", blocking), ("streaming", streaming)):
+        first_token, total, count = run(prompt)
+        print(f"{name:9}: first token {first_token * 1000:.0f} ms, complete {total * 1000:.0f} ms, {count} tokens")
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
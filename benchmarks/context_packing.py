@@ -0,0 +1,112 @@
+'''
+Prompt size benchmark of the context packing of the chat answers.
+
+Builds --calls synthetic transcripts of --words words, a --duplicates share of them uploaded
+twice with a few words changed (the same call in two files), and splits them into chunks of
+--chunk-size words overlapping by --chunk-overlap, like TokenTextSplitter with CHUNK_SIZE and
+CHUNK_OVERLAP. Every question retrieves the chunk it is about, its neighbours in the
+transcript, the same chunk of the duplicate file when there is one, and unrelated chunks up
+to --k. The report gives, without packing and with utilities.packing.ContextPacker (no budget,
+then --budget tokens)
+- the tokens of the {summaries} of the prompt (tiktoken when installed, ~4 characters per
+  token otherwise)
+- the share of the distinct words of the retrieved chunks still in the prompt
+- the p50 latency of the packing
+
+    python benchmarks/context_packing.py --calls 200 --k 6 --budget 2000
+'''
+import argparse
+import itertools
+import os
+import random
+import string
+import sys
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utilities.embeddings import count_tokens
+from utilities.packing import ContextPacker, format_summaries
+
+@dataclass
+class Chunk:
+    page_content: str
+    metadata: dict = field(default_factory=dict)
+
+def split(words, chunk_size, chunk_overlap):
+    step = chunk_size - chunk_overlap
+    return [" ".join(words[start:start + chunk_size]) for start in range(0, max(1, len(words) - chunk_overlap), step)]
+
+def make_transcripts(args, seed=0):
+    generator = random.Random(seed)
+    # Three letter words, about one token each, so a chunk of --chunk-size words is about --chunk-size tokens
+    vocabulary = ["".join(letters) for letters in itertools.product(string.ascii_lowercase, repeat=3)]
+    files = []
+    for call in range(args.calls):
+        words = generator.choices(vocabulary, k=args.words)
+        files.append((f"call{call}.txt", words, None))
+        if generator.random() < args.duplicates:
+            copy = list(words)
+            for i in generator.sample(range(len(copy)), len(copy) // 100):
+                copy[i] = generator.choice(vocabulary)
+            files.append((f"call{call}-copy.txt", copy, len(files) - 1))
+    chunks = {}
+    for filename, words, _ in files:
+        chunks[filename] = [Chunk(text, {"source": filename, "chunk": i}) for i, text in enumerate(split(words, args.chunk_size, args.chunk_overlap))]
+    copies = {files[original][0]: filename for filename, _, original in files if original is not None}
+    return chunks, copies
+
+def make_questions(chunks, copies, args, seed=1):
+    generator = random.Random(seed)
+    filenames = [filename for filename in chunks if not filename.endswith("-copy.txt")]
+    questions = []
+    for _ in range(args.questions):
+        filename = generator.choice(filenames)
+        i = generator.randrange(len(chunks[filename]))
+        retrieved = [chunks[filename][i]]
+        if filename in copies:
+            retrieved.append(chunks[copies[filename]][i])
+        retrieved += [chunks[filename][j] for j in (i - 1, i + 1) if 0 <= j < len(chunks[filename])]
+        while len(retrieved) < args.k:
+            other = chunks[generator.choice(filenames)]
+            retrieved.append(generator.choice(other))
+        questions.append(retrieved[:args.k])
+    return questions
+
+def evaluate(name, questions, packer=None):
+    tokens, coverage, latencies = [], [], []
+    for documents in questions:
+        words = set(" ".join(document.page_content for document in documents).split())
+        if packer is not None:
+            start = time.perf_counter()
+            documents, _ = packer.pack(documents)
+            latencies.append(time.perf_counter() - start)
+        tokens.append(count_tokens(format_summaries(documents)))
+        coverage.append(len(set(" ".join(document.page_content for document in documents).split()) & words) / len(words))
+    latency = f"p50 {np.percentile(latencies, 50) * 1000:6.2f} ms" if latencies else ""
+    print(f"{name:18} tokens {np.mean(tokens):7.0f} (max {np.max(tokens):5d})  content kept {np.mean(coverage):.3f}  {latency}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--words', type=int, default=3000)
+    parser.add_argument('--duplicates', type=float, default=0.3)
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--chunk-overlap', type=int, default=100)
+    parser.add_argument('--questions', type=int, default=500)
+    parser.add_argument('--k', type=int, default=6)
+    parser.add_argument('--budget', type=int, default=2000)
+    args = parser.parse_args()
+
+    chunks, copies = make_transcripts(args)
+    questions = make_questions(chunks, copies, args)
+    print(f"{sum(len(c) for c in chunks.values())} chunks, {len(copies)} duplicate files, {len(questions)} questions, k={args.k}")
+    evaluate("no packing", questions)
+    evaluate("packed", questions, ContextPacker(max_tokens=None))
+    evaluate(f"packed {args.budget}", questions, ContextPacker(max_tokens=args.budget))
+
+if __name__ == '__main__':
+    main()
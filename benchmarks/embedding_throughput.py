@@ -0,0 +1,92 @@
+'''
+Throughput benchmark for the batched embedding stage.
+
+Starts a local stub embedding server that answers like the embeddings endpoint (a list
+of inputs in, one vector per input out) with a fixed per-request latency, then embeds the
+same chunks one request per chunk (the old chunk_size=1 behaviour) and with
+BatchedEmbeddings, checking that the vectors come back in input order.
+
+    python benchmarks/embedding_throughput.py --chunks 2000 --latency 0.05
+'''
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utilities.embeddings import BatchedEmbeddings
+
+DIMENSIONS = 8
+
+'''
+deterministic fake vector for a text so the order of the results can be checked
+'''
+def fake_vector(text):
+    digest = hashlib.sha1(text.encode('utf-8')).digest()
+    return [b / 255 for b in digest[:DIMENSIONS]]
+
+def start_stub_server(latency):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            time.sleep(latency)
+            data = [{"index": i, "embedding": fake_vector(text)} for i, text in enumerate(body["input"])]
+            payload = json.dumps({"data": data}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def make_client(url):
+    def embed_batch(texts):
+        request = urllib.request.Request(url, data=json.dumps({"input": texts}).encode('utf-8'), headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request) as response:
+            data = json.loads(response.read())["data"]
+        return [d["embedding"] for d in sorted(data, key=lambda d: d["index"])]
+    return embed_batch
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunks', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per request')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--batch-tokens', type=int, default=8000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    args = parser.parse_args()
+
+    server = start_stub_server(args.latency)
+    embed_batch = make_client(f"http://127.0.0.1:{server.server_port}/embeddings")
+    chunks = [f"chunk {i} " + "call transcript text " * 60 for i in range(args.chunks)]
+
+    start = time.perf_counter()
+    serial = [embed_batch([chunk])[0] for chunk in chunks]
+    serial_time = time.perf_counter() - start
+
+    batched_embeddings = BatchedEmbeddings(embed_batch, max_batch_size=args.batch_size, max_batch_tokens=args.batch_tokens, max_concurrency=args.concurrency)
+    start = time.perf_counter()
+    batched = batched_embeddings.embed_documents(chunks)
+    batched_time = time.perf_counter() - start
+    server.shutdown()
+
+    assert batched == serial, "batched embeddings are not in input order"
+    requests = len(batched_embeddings.make_batches(chunks))
+    print(f"serial : {args.chunks} chunks, {args.chunks} requests, {serial_time:.2f}s, {args.chunks / serial_time:.0f} chunks/s")
+    print(f"batched: {args.chunks} chunks, {requests} requests, {batched_time:.2f}s, {args.chunks / batched_time:.0f} chunks/s")
+    print(f"speedup: {serial_time / batched_time:.1f}x")
+
+if __name__ == '__main__':
+    main()
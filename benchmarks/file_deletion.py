@@ -0,0 +1,86 @@
+'''
+Benchmark of the deletion of a file's embeddings in RedisExtended, at 1k, 10k and 100k files.
+
+For each corpus size the index is filled with --chunks-per-file chunks per file (keys built
+like LLMHelper.get_chunk_key, small fake vectors) and --deletes files are deleted with
+- scan: what deleting a file costs without an index of its chunks, a SCAN of every chunk
+  key reading its metadata to find the ones of the file, then the delete
+- indexed: RedisExtended.delete_file, one SMEMBERS of the file's set and one pipelined delete
+
+Needs a Redis Stack server (RediSearch) and the packages of the function apps. The database
+given by --redis-url is flushed.
+
+    python benchmarks/file_deletion.py --redis-url redis://localhost:6379/15
+'''
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'vector database'))
+
+from database_config import RedisExtended
+
+INDEX_NAME = "bench"
+
+def chunk_key(filename, content):
+    return f"doc:{INDEX_NAME}:{hashlib.sha1(filename.encode('utf-8')).hexdigest()}:{hashlib.sha1(content.encode('utf-8')).hexdigest()}"
+
+def fill(store, files, chunks_per_file, dims, batch_size=5000):
+    texts, metadatas, keys = [], [], []
+    for f in range(files):
+        filename = f"converted/call-{f}.txt"
+        for c in range(chunks_per_file):
+            content = f"chunk {c} of call {f}"
+            key = chunk_key(filename, content)
+            texts.append(content)
+            metadatas.append({"source": f"[{filename}]({filename})", "chunk": c, "key": key, "filename": filename})
+            keys.append(key)
+        if len(texts) >= batch_size or f == files - 1:
+            store.add_texts(texts, metadatas, embeddings=[[0.0] * dims] * len(texts), keys=keys)
+            texts, metadatas, keys = [], [], []
+
+def delete_by_scan(store, filename):
+    keys = [key for key in store.client.scan_iter(match=f"doc:{INDEX_NAME}:*", count=1000)]
+    pipeline = store.client.pipeline(transaction=False)
+    for key in keys:
+        pipeline.hget(key, "metadata")
+    to_delete = [key for key, metadata in zip(keys, pipeline.execute()) if metadata and json.loads(metadata).get("filename") == filename]
+    if to_delete:
+        store.delete_keys(to_delete)
+    return len(to_delete)
+
+def measure(delete, filenames):
+    start = time.perf_counter()
+    deleted = sum(delete(filename) for filename in filenames)
+    return (time.perf_counter() - start) / len(filenames), deleted
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--redis-url', default='redis://localhost:6379/15')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--chunks-per-file', type=int, default=3)
+    parser.add_argument('--deletes', type=int, default=10)
+    parser.add_argument('--dims', type=int, default=8)
+    args = parser.parse_args()
+
+    for files in args.sizes:
+        store = RedisExtended(redis_url=args.redis_url, index_name=INDEX_NAME, embedding_function=None)
+        store.client.flushdb()
+        store = RedisExtended(redis_url=args.redis_url, index_name=INDEX_NAME, embedding_function=None)
+        fill(store, files, args.chunks_per_file, args.dims)
+        store.index_file_keys()
+
+        step = max(1, files // (2 * args.deletes))
+        scan_files = [f"converted/call-{i * step}.txt" for i in range(args.deletes)]
+        indexed_files = [f"converted/call-{files - 1 - i * step}.txt" for i in range(args.deletes)]
+        scan_time, scan_deleted = measure(lambda filename: delete_by_scan(store, filename), scan_files)
+        indexed_time, indexed_deleted = measure(store.delete_file, indexed_files)
+        print(f"{files:>7} files: scan {scan_time * 1000:9.1f} ms/file ({scan_deleted} chunks), indexed {indexed_time * 1000:6.2f} ms/file ({indexed_deleted} chunks)")
+    store.client.flushdb()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+'''
+Startup benchmark for LLMHelper.
+
+- import: time to import utilities.helper and each of the ingestion-only dependencies, every
+  one in a fresh interpreter so nothing is already loaded
+- construction: LLMHelper() the way the function apps build it on every request or queue
+  message, once after clearing the client registry (cold start, every client is built and the
+  vector store probes its index), then --runs times with the registry warm
+- first access: time to build each lazily created client (form recognizer, blob storage,
+  translator, user agent), which a chat-only function app never pays
+
+Needs the function app settings (.env or environment) and access to the configured services.
+
+    python benchmarks/helper_startup.py --runs 20
+'''
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utilities import registry
+
+MODULES = ['utilities.helper', 'utilities.formrecognizer', 'utilities.azureblobstorage', 'utilities.translator', 'fake_useragent']
+LAZY_CLIENTS = ['pdf_parser', 'blob_client', 'translator', 'user_agent']
+
+def import_time(module):
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True)
+    return float(result.stdout) if result.returncode == 0 else None
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    for module in MODULES:
+        elapsed = import_time(module)
+        print(f"import {module:27}: " + (f"{elapsed * 1000:.1f} ms" if elapsed is not None else "failed"))
+
+    from utilities.helper import LLMHelper
+
+    cold = []
+    for _ in range(3):
+        registry.clear()
+        cold.append(timed(LLMHelper)[1])
+    warm = [timed(LLMHelper)[1] for _ in range(args.runs)]
+    print(f"cold LLMHelper(): mean {statistics.mean(cold) * 1000:.1f} ms, max {max(cold) * 1000:.1f} ms ({len(cold)} runs)")
+    print(f"warm LLMHelper(): mean {statistics.mean(warm) * 1000:.1f} ms, max {max(warm) * 1000:.1f} ms ({len(warm)} runs)")
+    print(f"speedup: {statistics.mean(cold) / statistics.mean(warm):.0f}x")
+
+    registry.clear()
+    llm_helper = LLMHelper()
+    for name in LAZY_CLIENTS:
+        _, elapsed = timed(lambda: getattr(llm_helper, name))
+        print(f"first access {name:12}: {elapsed * 1000:.1f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+'''
+Recall vs latency benchmark of the vector index profiles.
+
+Builds a synthetic clustered corpus of --documents normalized vectors and --queries queries,
+computes the exact top --k of every query by brute force, then for every index profile
+reports recall@k (share of the exact top k returned) and the p50/p99 query latency of
+- redis: a local Redis Stack index created by RedisExtended.create_index with the profile
+  (all the profiles index the same hashes)
+- azure: an in-memory stand-in of the Azure Cognitive Search index, hnswlib with the m /
+  efConstruction / efSearch of the profile (exact search for "flat"), when hnswlib is installed
+
+Needs the packages of the function apps. The Redis database given by --redis-url is flushed.
+
+    python benchmarks/index_profiles.py --documents 100000 --dims 256
+'''
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'vector database'))
+
+def make_corpus(documents, queries, dims, clusters=100, seed=0):
+    random = np.random.default_rng(seed)
+    centers = random.normal(size=(clusters, dims))
+    def sample(n):
+        vectors = centers[random.integers(0, clusters, n)] + 0.5 * random.normal(size=(n, dims))
+        return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+    return sample(documents), sample(queries)
+
+def exact_top_k(corpus, queries, k):
+    scores = queries @ corpus.T
+    top = np.argpartition(-scores, k, axis=1)[:, :k]
+    return [set(row) for row in top]
+
+def report(store, profile, results, latencies, truth, k):
+    recall = np.mean([len(set(result) & expected) / k for result, expected in zip(results, truth)])
+    latencies = np.array(latencies) * 1000
+    print(f"{store:5} {profile:12} recall@{k} {recall:.3f}  p50 {np.percentile(latencies, 50):7.2f} ms  p99 {np.percentile(latencies, 99):7.2f} ms")
+
+def bench_redis(args, corpus, queries, truth):
+    os.environ["REDIS_VECTOR_DIMENSIONS"] = str(args.dims)
+    from redis.commands.search.query import Query
+    from database_config import INDEX_PROFILES, RedisExtended
+
+    store = RedisExtended(redis_url=args.redis_url, index_name="bench_balanced", embedding_function=None, index_profile="balanced")
+    store.client.flushdb()
+    pipeline = store.client.pipeline(transaction=False)
+    for i, vector in enumerate(corpus):
+        pipeline.hset(f"doc:bench:{i}", mapping={"content": "", "metadata": "{}", "content_vector": vector.tobytes()})
+        if i % 10000 == 9999:
+            pipeline.execute()
+    pipeline.execute()
+
+    for profile in INDEX_PROFILES:
+        store = RedisExtended(redis_url=args.redis_url, index_name=f"bench_{profile}", embedding_function=None, index_profile=profile)
+        while int(store.client.ft(store.index_name).info().get("indexing", 0)):
+            time.sleep(0.5)
+        query = Query(f"*=>[KNN {args.k} @content_vector $vector AS score]").sort_by("score").return_fields("score").paging(0, args.k).dialect(2)
+        results, latencies = [], []
+        for vector in queries:
+            start = time.perf_counter()
+            docs = store.client.ft(store.index_name).search(query, query_params={"vector": vector.tobytes()}).docs
+            latencies.append(time.perf_counter() - start)
+            results.append([int(doc.id.split(':')[-1]) for doc in docs])
+        report("redis", profile, results, latencies, truth, args.k)
+    store.client.flushdb()
+
+def bench_azure_standin(args, corpus, queries, truth):
+    from search_database import INDEX_PROFILES
+    try:
+        import hnswlib
+    except ImportError:
+        print("azure stand-in skipped: pip install hnswlib")
+        return
+    for profile, parameters in INDEX_PROFILES.items():
+        results, latencies = [], []
+        if parameters["kind"] == "hnsw":
+            index = hnswlib.Index(space='cosine', dim=args.dims)
+            index.init_index(max_elements=len(corpus), M=parameters["m"], ef_construction=parameters["efConstruction"])
+            index.add_items(corpus)
+            index.set_ef(max(parameters["efSearch"], args.k))
+            search = lambda vector: index.knn_query(vector, k=args.k)[0][0]
+        else:
+            search = lambda vector: np.argpartition(-(corpus @ vector), args.k)[:args.k]
+        for vector in queries:
+            start = time.perf_counter()
+            results.append(search(vector))
+            latencies.append(time.perf_counter() - start)
+        report("azure", profile, results, latencies, truth, args.k)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--redis-url', default='redis://localhost:6379/15')
+    parser.add_argument('--documents', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--dims', type=int, default=256)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--stores', nargs='+', default=['redis', 'azure'])
+    args = parser.parse_args()
+
+    corpus, queries = make_corpus(args.documents, args.queries, args.dims)
+    truth = exact_top_k(corpus, queries, args.k)
+    print(f"{args.documents} documents, {args.queries} queries, {args.dims} dimensions")
+    if 'redis' in args.stores:
+        bench_redis(args, corpus, queries, truth)
+    if 'azure' in args.stores:
+        bench_azure_standin(args, corpus, queries, truth)
+
+if __name__ == '__main__':
+    main()
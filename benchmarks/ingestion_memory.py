@@ -0,0 +1,104 @@
+'''
+Peak memory benchmark for the streaming ingestion pipeline.
+
+Writes a synthetic call transcript of --size-mb megabytes, serves it from a local HTTP
+server and measures the tracemalloc peak of
+- the materializing path: download the whole text, split it, embed every chunk, then upload
+- the streaming path: stream_url_text -> split_stream -> clean_chunks -> batched embed/upload
+  stages connected by bounded queues
+The embedder and the upload are local stubs, so only the pipeline itself is measured.
+
+    python benchmarks/ingestion_memory.py --size-mb 50
+'''
+import argparse
+import functools
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utilities.ingestion import batched, clean_chunks, split_stream, stream_url_text, threaded
+
+'''
+word based splitter with the same interface as the langchain splitters, used when langchain
+is not installed
+'''
+class WordTextSplitter:
+    def __init__(self, chunk_size=500, chunk_overlap=100):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def split_text(self, text):
+        words = text.split(' ')
+        step = self.chunk_size - self.chunk_overlap
+        return [' '.join(words[i:i + self.chunk_size]) for i in range(0, max(len(words) - self.chunk_overlap, 1), step)]
+
+def get_text_splitter():
+    try:
+        from langchain.text_splitter import TokenTextSplitter
+        return TokenTextSplitter(chunk_size=500, chunk_overlap=100)
+    except ImportError:
+        return WordTextSplitter()
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+def write_transcript(path, size_mb):
+    line = "Agent: thank you for calling, how can I help you today? User: my order has not arrived yet.\n"
+    with open(path, 'w', encoding='utf-8') as f:
+        for _ in range(size_mb * 1024 * 1024 // len(line)):
+            f.write(line)
+
+def fake_embed(texts, dims):
+    return [[float(len(text))] * dims for text in texts]
+
+def materialized(url, splitter, dims):
+    text = requests.get(url).text
+    chunks = list(clean_chunks(splitter.split_text(text)))
+    embeddings = fake_embed(chunks, dims)
+    return len(embeddings)
+
+def streaming(url, splitter, dims, batch_size=64):
+    chunks = threaded(clean_chunks(threaded(split_stream(stream_url_text(url), splitter), maxsize=64)), maxsize=64)
+    count = 0
+    for batch, embeddings in threaded(((batch, fake_embed(batch, dims)) for batch in batched(chunks, batch_size)), maxsize=2):
+        count += len(embeddings)
+    return count
+
+def measure(name, run):
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = run()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:13}: {count} chunks, {elapsed:.1f}s, peak {peak / 1024 / 1024:.1f} MB")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=50)
+    parser.add_argument('--dims', type=int, default=64)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_transcript(os.path.join(directory, 'transcript.txt'), args.size_mb)
+        server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(QuietHandler, directory=directory))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}/transcript.txt"
+        splitter = get_text_splitter()
+
+        print(f"transcript: {args.size_mb} MB")
+        measure("materialized", lambda: materialized(url, splitter, args.dims))
+        measure("streaming", lambda: streaming(url, splitter, args.dims))
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+'''
+Query latency benchmark of the in-process NumPy vector store against Redis.
+
+Builds a synthetic corpus of --documents normalized vectors and reports the p50/p99 latency of
+--queries top --k searches with
+- numpy: NumpyVectorStore.similarity_search_by_vector_with_score, one query at a time
+- numpy batched: NumpyVectorStore.similarity_search_by_vectors, --batch queries per call
+  (latency per query)
+- numpy mmap: the same single queries on a second store that loads the persisted files
+  memory-mapped
+- redis: the KNN query of a flat (exact) index of a local Redis Stack, network hop included
+
+Needs the packages of the function apps. The Redis database given by --redis-url is flushed.
+
+    python benchmarks/numpy_store_vs_redis.py --documents 20000 --dims 1536
+'''
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'vector database'))
+
+from numpy_database import NumpyVectorStore
+
+def make_corpus(documents, queries, dims, seed=0):
+    random = np.random.default_rng(seed)
+    def sample(n):
+        vectors = random.normal(size=(n, dims))
+        return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+    return sample(documents), sample(queries)
+
+def report(store, latencies):
+    latencies = np.array(latencies) * 1000
+    print(f"{store:14} p50 {np.percentile(latencies, 50):7.3f} ms  p99 {np.percentile(latencies, 99):7.3f} ms")
+
+def fill(store, corpus, batch_size=5000):
+    with store.batch():
+        for start in range(0, len(corpus), batch_size):
+            vectors = corpus[start:start + batch_size]
+            store.add_texts(
+                [f"chunk {start + i}" for i in range(len(vectors))],
+                [{"filename": f"file{(start + i) // 100}.pdf", "source": ""} for i in range(len(vectors))],
+                embeddings=vectors,
+                keys=[f"doc:bench:{start + i}" for i in range(len(vectors))],
+            )
+
+def bench_numpy(args, corpus, queries):
+    with tempfile.TemporaryDirectory() as path:
+        store = NumpyVectorStore(embedding_function=None, path=path)
+        fill(store, corpus)
+        stores = [("numpy", store), ("numpy mmap", NumpyVectorStore(embedding_function=None, path=path))]
+        for name, store in stores:
+            latencies = []
+            for vector in queries:
+                start = time.perf_counter()
+                store.similarity_search_by_vector_with_score(vector, k=args.k)
+                latencies.append(time.perf_counter() - start)
+            report(name, latencies)
+
+        store = stores[0][1]
+        latencies = []
+        for start in range(0, len(queries), args.batch):
+            batch = queries[start:start + args.batch]
+            begin = time.perf_counter()
+            store.similarity_search_by_vectors(batch, k=args.k)
+            latencies.extend([(time.perf_counter() - begin) / len(batch)] * len(batch))
+        report("numpy batched", latencies)
+
+def bench_redis(args, corpus, queries):
+    os.environ["REDIS_VECTOR_DIMENSIONS"] = str(args.dims)
+    from redis.commands.search.query import Query
+    from redis.exceptions import ResponseError
+    from database_config import RedisExtended
+
+    store = RedisExtended(redis_url=args.redis_url, index_name="bench_numpy", embedding_function=None, index_profile="flat")
+    store.client.flushdb()
+    try:
+        # FLUSHDB drops the index with the hashes on recent Redis Stack versions
+        store.create_index(profile="flat", dims=args.dims)
+    except ResponseError:
+        pass
+    pipeline = store.client.pipeline(transaction=False)
+    for i, vector in enumerate(corpus):
+        pipeline.hset(f"doc:bench:{i}", mapping={"content": f"chunk {i}", "metadata": "{}", "content_vector": vector.tobytes()})
+        if i % 5000 == 4999:
+            pipeline.execute()
+    pipeline.execute()
+    while int(store.client.ft(store.index_name).info().get("indexing", 0)):
+        time.sleep(0.5)
+
+    query = Query(f"*=>[KNN {args.k} @content_vector $vector AS score]").sort_by("score").return_fields("content", "metadata", "score").paging(0, args.k).dialect(2)
+    latencies = []
+    for vector in queries:
+        start = time.perf_counter()
+        store.client.ft(store.index_name).search(query, query_params={"vector": vector.tobytes()})
+        latencies.append(time.perf_counter() - start)
+    report("redis", latencies)
+    store.client.flushdb()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--redis-url', default='redis://localhost:6379/15')
+    parser.add_argument('--documents', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--dims', type=int, default=1536)
+    parser.add_argument('--k', type=int, default=4)
+    parser.add_argument('--batch', type=int, default=32)
+    parser.add_argument('--stores', nargs='+', default=['numpy', 'redis'])
+    args = parser.parse_args()
+
+    corpus, queries = make_corpus(args.documents, args.queries, args.dims)
+    print(f"{args.documents} documents, {args.queries} queries, {args.dims} dimensions, k={args.k}")
+    if 'numpy' in args.stores:
+        bench_numpy(args, corpus, queries)
+    if 'redis' in args.stores:
+        bench_redis(args, corpus, queries)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+'''
+Peak memory benchmark of the prompt results export.
+
+Generates --results synthetic prompt results of about --result-kb kilobytes each, served in
+pages of --page-size rows like the FT.AGGREGATE cursor of
+RedisExtended.iter_prompt_result_pages, and reports the time and tracemalloc peak of
+- dataframe: every result in one list, a DataFrame, the line break replace, the sort by id
+  and to_csv into one string, as process_all did (without the cap of 3155 results)
+- csv: utilities.export.write_csv of the pages to a file
+- parquet: utilities.export.write_parquet of the pages to a file (when pyarrow is installed)
+then checks that both CSV exports hold the same rows.
+
+    python benchmarks/prompt_export.py --results 20000 --result-kb 2
+'''
+import argparse
+import csv
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utilities.export import export_pages
+
+COLUMNS = ("id", "filename", "prompt", "result")
+LINE_BREAKS = str.maketrans({"\n": " ", "\r": " "})
+
+def make_result(i, size):
+    sentence = f"Call {i}: the customer asked about a late delivery.\nThe agent offered a refund.\r\n"
+    return (sentence * (size // len(sentence) + 1))[:size]
+
+def pages(count, size, page_size):
+    # Rows come sorted by id from Redis, the keys are zero padded so the string order is the numeric one
+    for start in range(0, count, page_size):
+        yield [
+            {"id": f"prompt:{i:08d}", "filename": f"call{i % 50}.txt", "prompt": "Summarize the call.", "result": make_result(i, size).translate(LINE_BREAKS)}
+            for i in range(start, min(start + page_size, count))
+        ]
+
+def dataframe_export(count, size):
+    results = [{"id": f"prompt:{i:08d}", "filename": f"call{i % 50}.txt", "prompt": "Summarize the call.", "result": make_result(i, size)} for i in range(count)]
+    return pd.DataFrame([{**result, "result": result["result"].replace('\n', ' ').replace('\r', ' ')} for result in results]).sort_values(by='id').to_csv(index=False)
+
+def measure(name, function):
+    tracemalloc.start()
+    start = time.perf_counter()
+    output = function()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:10} {elapsed:6.2f}s  peak {peak / 2 ** 20:8.1f} MB")
+    return output
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--results', type=int, default=20000)
+    parser.add_argument('--result-kb', type=float, default=2)
+    parser.add_argument('--page-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    size = int(args.result_kb * 1024)
+    print(f"{args.results} results of {size} characters, pages of {args.page_size}")
+    directory = tempfile.mkdtemp()
+    csv_path = os.path.join(directory, "results.csv")
+    text = measure("dataframe", lambda: dataframe_export(args.results, size))
+    measure("csv", lambda: export_pages(pages(args.results, size, args.page_size), csv_path, COLUMNS, format="csv"))
+    try:
+        import pyarrow
+        measure("parquet", lambda: export_pages(pages(args.results, size, args.page_size), os.path.join(directory, "results.parquet"), COLUMNS, format="parquet"))
+    except ImportError:
+        print("parquet    skipped, pyarrow is not installed")
+
+    with open(csv_path, newline='', encoding='utf-8') as file:
+        streamed = list(csv.reader(file))
+    assert streamed == list(csv.reader(io.StringIO(text))), "the streamed CSV differs from the DataFrame export"
+    print(f"both CSV exports hold the same {len(streamed) - 1} rows, {os.path.getsize(csv_path) / 2 ** 20:.1f} MB")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+'''
+Prompt result write benchmark for RedisExtended against a local Redis.
+
+Writes --results prompt results of --result-kb kilobytes, the way a batch job hands them
+over one at a time, with
+- per call: RedisExtended.add_prompt_result, one HSET round-trip per result
+- pipeline: a PromptResultWriter flushing pipelines of --batch-size results
+- transaction: the same writer sending each batch with the job entries as a MULTI/EXEC, as
+  LLMHelper.run_prompt_batch does
+and checks that every result and job entry was written. The gap grows with the round-trip
+time to the server.
+
+Needs a Redis Stack server (RediSearch) and the packages of the function apps. The database
+given by --redis-url is flushed.
+
+    python benchmarks/prompt_result_writes.py --results 20000 --batch-size 500
+'''
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'vector database'))
+
+from redis.exceptions import ResponseError
+
+from database_config import RedisExtended
+
+INDEX_NAME = "bench"
+
+def reset(store):
+    store.client.flushdb()
+    try:
+        store.create_prompt_index()
+    except ResponseError:
+        # FLUSHDB keeps the indexes
+        pass
+
+def measure(name, store, results, write):
+    reset(store)
+    start = time.perf_counter()
+    write()
+    elapsed = time.perf_counter() - start
+    written = sum(1 for _ in store.client.scan_iter(match="prompt:*", count=10000))
+    assert written == len(results), f"{name}: {written} results written out of {len(results)}"
+    print(f"{name:11}: {len(results)} results in {elapsed:6.2f}s, {len(results) / elapsed:9,.0f} results/s")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--redis-url', default='redis://localhost:6379/15')
+    parser.add_argument('--results', type=int, default=20000)
+    parser.add_argument('--result-kb', type=float, default=1)
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    store = RedisExtended(redis_url=args.redis_url, index_name=INDEX_NAME, embedding_function=None)
+    text = ("The customer called about a late delivery and was offered a refund. " * 100)[:int(args.result_kb * 1024)]
+    results = [(f"doc:{INDEX_NAME}:{i:08d}", text, f"call{i % 50}.txt", "Summarize the call.") for i in range(args.results)]
+    print(f"{args.results} results of {len(text)} characters")
+
+    def per_call():
+        for id, result, filename, prompt in results:
+            store.add_prompt_result(id, result, filename, prompt)
+
+    def buffered(transaction):
+        with store.prompt_result_writer(job="bench", max_batch_size=args.batch_size, transaction=transaction) as writer:
+            for id, result, filename, prompt in results:
+                writer.add(id, result, filename, prompt)
+        assert store.client.scard("promptjob:bench") == len(results)
+
+    measure("per call", store, results, per_call)
+    measure("pipeline", store, results, lambda: buffered(False))
+    measure("transaction", store, results, lambda: buffered(True))
+    store.client.flushdb()
+
+if __name__ == '__main__':
+    main()
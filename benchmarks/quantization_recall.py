@@ -0,0 +1,130 @@
+'''
+Memory per chunk and recall benchmark of the quantized vector storage.
+
+Builds a synthetic clustered corpus of --documents normalized vectors and --queries queries,
+computes the exact top --k of every query by brute force, then for every quantization reports
+recall@k (share of the exact top k returned), the p50 query latency and the memory per chunk
+- numpy: NumpyVectorStore persisted to a temporary directory, float32 / int8 / pq. The memory
+  per chunk is the size of the matrix the search scans (the float vectors, or the codes with
+  the quantizer amortized over the chunks), the float rows of the re-ranked candidates are
+  read from the memory-mapped file
+- redis: RedisExtended with a float32 or an int8 index, the memory per chunk is the growth of
+  used_memory (hashes and index) and the vector index size reported by FT.INFO, for a local
+  Redis with INT8 vector fields
+
+Needs the packages of the function apps. The Redis database given by --redis-url is flushed.
+
+    python benchmarks/quantization_recall.py --documents 20000 --dims 1536
+'''
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'vector database'))
+
+def make_corpus(documents, queries, dims, clusters=100, seed=0):
+    random = np.random.default_rng(seed)
+    centers = random.normal(size=(clusters, dims))
+    def sample(n):
+        vectors = centers[random.integers(0, clusters, n)] + 0.5 * random.normal(size=(n, dims))
+        return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+    return sample(documents), sample(queries)
+
+def exact_top_k(corpus, queries, k):
+    scores = queries @ corpus.T
+    top = np.argpartition(-scores, k, axis=1)[:, :k]
+    return [set(row) for row in top]
+
+def report(store, quantization, results, latencies, truth, k, bytes_per_chunk):
+    recall = np.mean([len(set(result) & expected) / k for result, expected in zip(results, truth)])
+    latency = np.percentile(np.array(latencies) * 1000, 50)
+    print(f"{store:5} {quantization:7} recall@{k} {recall:.3f}  p50 {latency:7.2f} ms  {bytes_per_chunk:8.0f} bytes/chunk")
+
+def search(store, queries, k):
+    results, latencies = [], []
+    for vector in queries:
+        start = time.perf_counter()
+        docs = store.similarity_search_by_vector_with_score(vector, k=k)
+        latencies.append(time.perf_counter() - start)
+        results.append([int(doc.page_content.split()[-1]) for doc, _ in docs])
+    return results, latencies
+
+def bench_numpy(args, corpus, queries, truth):
+    from numpy_database import NumpyVectorStore
+
+    for quantization in (None, "int8", "pq"):
+        with tempfile.TemporaryDirectory() as path:
+            store = NumpyVectorStore(embedding_function=None, path=path, quantization=quantization, rerank_factor=args.rerank_factor)
+            with store.batch():
+                for start in range(0, len(corpus), 5000):
+                    vectors = corpus[start:start + 5000]
+                    store.add_texts([f"chunk {start + i}" for i in range(len(vectors))], embeddings=vectors, keys=[f"doc:bench:{start + i}" for i in range(len(vectors))])
+                # Codes trained on the whole corpus, as after a full ingestion
+                store.train_quantizer()
+            if quantization:
+                searched = store._codes[:store._count].nbytes + sum(array.nbytes for array in store._quantizer.state().values())
+            else:
+                searched = store._vectors[:store._count].nbytes
+            results, latencies = search(store, queries, args.k)
+            report("numpy", quantization or "float32", results, latencies, truth, args.k, searched / len(corpus))
+
+def bench_redis(args, corpus, queries, truth):
+    os.environ["REDIS_VECTOR_DIMENSIONS"] = str(args.dims)
+    from redis.exceptions import ResponseError
+    from database_config import RedisExtended
+
+    vectors_by_query = {f"query {i}": vector for i, vector in enumerate(queries)}
+    for quantization in (None, "int8"):
+        store = RedisExtended(redis_url=args.redis_url, index_name=f"bench_{quantization or 'float32'}", embedding_function=vectors_by_query.__getitem__, index_profile="flat", quantization=quantization, rerank_factor=args.rerank_factor)
+        store.client.flushdb()
+        try:
+            # FLUSHDB drops the index with the hashes on recent Redis Stack versions
+            store.create_index(profile="flat", dims=args.dims)
+        except ResponseError:
+            pass
+        used_memory = store.client.info("memory")["used_memory"]
+        for start in range(0, len(corpus), 5000):
+            vectors = corpus[start:start + 5000]
+            store.add_texts([f"chunk {start + i}" for i in range(len(vectors))], embeddings=vectors, keys=[f"doc:{store.index_name}:{start + i}" for i in range(len(vectors))])
+        while int(store.client.ft(store.index_name).info().get("indexing", 0)):
+            time.sleep(0.5)
+        used_memory = store.client.info("memory")["used_memory"] - used_memory
+        index_size = float(store.client.ft(store.index_name).info().get("vector_index_sz_mb", 0)) * 1024 * 1024
+
+        results, latencies = [], []
+        for query in vectors_by_query:
+            start = time.perf_counter()
+            docs = store.similarity_search_with_score(query, k=args.k)
+            latencies.append(time.perf_counter() - start)
+            results.append([int(doc.page_content.split()[-1]) for doc, _ in docs])
+        report("redis", quantization or "float32", results, latencies, truth, args.k, used_memory / len(corpus))
+        print(f"{'':14}vector index {index_size / len(corpus):8.0f} bytes/chunk")
+        store.client.flushdb()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--redis-url', default='redis://localhost:6379/15')
+    parser.add_argument('--documents', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--dims', type=int, default=1536)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--rerank-factor', type=int, default=None, help='candidates per result, default of each quantizer when unset')
+    parser.add_argument('--stores', nargs='+', default=['numpy', 'redis'])
+    args = parser.parse_args()
+
+    corpus, queries = make_corpus(args.documents, args.queries, args.dims)
+    truth = exact_top_k(corpus, queries, args.k)
+    print(f"{args.documents} documents, {args.queries} queries, {args.dims} dimensions")
+    if 'numpy' in args.stores:
+        bench_numpy(args, corpus, queries, truth)
+    if 'redis' in args.stores:
+        bench_redis(args, corpus, queries, truth)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+'''
+Bulk delete benchmark for RedisExtended against a local Redis.
+
+Writes --keys chunk hashes and deletes them by pattern twice:
+- per key: KEYS for the pattern then one DEL round-trip per key (the previous implementation)
+- bulk: RedisExtended.delete_keys_pattern, a SCAN cursor and UNLINK pipelines of --batch-size keys
+While each delete runs, a second connection keeps reading a hash and the worst read latency
+is reported, to show how long the server is blocked.
+
+Needs a Redis Stack server (RediSearch) and the packages of the function apps. The database
+given by --redis-url is flushed.
+
+    python benchmarks/redis_bulk_delete.py --keys 200000 --batch-size 1000
+'''
+import argparse
+import os
+import sys
+import threading
+import time
+
+import redis
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'vector database'))
+
+from database_config import RedisExtended
+
+INDEX_NAME = "bench"
+
+def fill(client, keys, batch_size=10000):
+    pipeline = client.pipeline(transaction=False)
+    for i in range(keys):
+        pipeline.hset(f"doc:{INDEX_NAME}:{i:08d}", mapping={"content": f"chunk {i}", "metadata": "{}"})
+        if i % batch_size == batch_size - 1:
+            pipeline.execute()
+    pipeline.execute()
+
+def delete_per_key(client, pattern):
+    deleted = 0
+    for key in client.keys(pattern):
+        deleted += client.delete(key)
+    return deleted
+
+'''
+reads a hash in a loop on its own connection until stopped, keeps the worst latency
+'''
+class Reader(threading.Thread):
+    def __init__(self, redis_url):
+        super().__init__(daemon=True)
+        self.client = redis.from_url(redis_url)
+        self.client.hset("bench:probe", mapping={"value": "1"})
+        self.stop = threading.Event()
+        self.worst = 0.0
+
+    def run(self):
+        while not self.stop.is_set():
+            start = time.perf_counter()
+            self.client.hget("bench:probe", "value")
+            self.worst = max(self.worst, time.perf_counter() - start)
+
+def measure(name, redis_url, delete):
+    reader = Reader(redis_url)
+    reader.start()
+    start = time.perf_counter()
+    deleted = delete()
+    elapsed = time.perf_counter() - start
+    reader.stop.set()
+    reader.join()
+    print(f"{name:8}: {deleted} keys in {elapsed:.2f}s, {deleted / elapsed:,.0f} deletes/s, worst concurrent read {reader.worst * 1000:.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--redis-url', default='redis://localhost:6379/15')
+    parser.add_argument('--keys', type=int, default=200000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    store = RedisExtended(redis_url=args.redis_url, index_name=INDEX_NAME, embedding_function=None)
+    pattern = f"doc:{INDEX_NAME}:*"
+
+    store.client.flushdb()
+    fill(store.client, args.keys)
+    measure("per key", args.redis_url, lambda: delete_per_key(store.client, pattern))
+
+    fill(store.client, args.keys)
+    progress = lambda deleted: deleted % (args.batch_size * 50) == 0 and print(f"  {deleted} deleted", end="\r")
+    measure("bulk", args.redis_url, lambda: store.delete_keys_pattern(pattern, batch_size=args.batch_size, progress=progress))
+    store.client.flushdb()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+'''
+Offline quality and latency evaluation of the local reranking stage.
+
+Builds a synthetic knowledge base shaped like call transcripts: --topics topics, each with
+1 to 8 distinct facts, and every fact stored in 1 to 4 near duplicate chunks (the same answer
+repeated across calls). A question about a topic should retrieve its distinct facts. For
+every configuration the candidates are the top n chunks by cosine similarity, as returned
+by the vector store, and the report gives
+- fact recall: distinct facts of the topic in the k chunks / min(k, facts of the topic)
+- precision: share of the chunks sent to the LLM that belong to the topic
+- chunks and tokens: what the prompt carries on average
+- p50/p99 latency of the reranking stage alone
+Configurations: the plain top k, then oversample * k candidates reranked with
+utilities.reranking.LocalReranker by cosine only, with MMR, and with MMR and a score threshold.
+
+    python benchmarks/rerank_eval.py --topics 300 --k 4 --oversample 5
+'''
+import argparse
+import os
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utilities.reranking import LocalReranker
+
+Chunk = namedtuple('Chunk', ['page_content', 'topic', 'fact', 'tokens'])
+
+def make_knowledge_base(topics, dims, seed=0):
+    random = np.random.default_rng(seed)
+    chunks, vectors, queries = [], [], []
+    for topic in range(topics):
+        center = random.normal(size=dims)
+        for fact in range(random.integers(1, 9)):
+            fact_vector = center + 0.8 * random.normal(size=dims)
+            for copy in range(random.integers(1, 5)):
+                chunks.append(Chunk(f"topic {topic} fact {fact} copy {copy}", topic, fact, int(random.integers(150, 500))))
+                vectors.append(fact_vector + 0.1 * random.normal(size=dims))
+        queries.append((f"question about topic {topic}", topic, center + 0.5 * random.normal(size=dims)))
+    vectors = np.array(vectors, dtype=np.float32)
+    return chunks, vectors / np.linalg.norm(vectors, axis=1, keepdims=True), queries
+
+def evaluate(name, chunks, vectors, queries, facts_per_topic, k, candidates, reranker=None):
+    fact_recall, precision, sizes, tokens, latencies = [], [], [], [], []
+    for text, topic, query_vector in queries:
+        query_vector = query_vector / np.linalg.norm(query_vector)
+        scores = vectors @ query_vector
+        top = np.argsort(-scores)[:candidates]
+        documents = [chunks[i] for i in top]
+        if reranker is not None:
+            start = time.perf_counter()
+            documents = [document for document, _ in reranker.rerank(text, documents, k)]
+            latencies.append(time.perf_counter() - start)
+        else:
+            documents = documents[:k]
+        relevant = [document for document in documents if document.topic == topic]
+        fact_recall.append(len({document.fact for document in relevant}) / min(k, facts_per_topic[topic]))
+        precision.append(len(relevant) / len(documents) if documents else 1.0)
+        sizes.append(len(documents))
+        tokens.append(sum(document.tokens for document in documents))
+    latency = f"p50 {np.percentile(latencies, 50) * 1000:6.2f} ms  p99 {np.percentile(latencies, 99) * 1000:6.2f} ms" if latencies else ""
+    print(f"{name:24} fact recall {np.mean(fact_recall):.3f}  precision {np.mean(precision):.3f}  chunks {np.mean(sizes):4.2f}  tokens {np.mean(tokens):6.0f}  {latency}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--topics', type=int, default=300)
+    parser.add_argument('--dims', type=int, default=256)
+    parser.add_argument('--k', type=int, default=4)
+    parser.add_argument('--oversample', type=int, default=5)
+    parser.add_argument('--mmr-lambda', type=float, default=0.7)
+    parser.add_argument('--threshold', type=float, default=0.3)
+    args = parser.parse_args()
+
+    chunks, vectors, queries = make_knowledge_base(args.topics, args.dims)
+    facts_per_topic = {}
+    for chunk in chunks:
+        facts_per_topic[chunk.topic] = max(facts_per_topic.get(chunk.topic, 0), chunk.fact + 1)
+    # Stands for the embeddings cache, every chunk and question is already embedded
+    embeddings = {chunk.page_content: vector for chunk, vector in zip(chunks, vectors)}
+    embeddings.update({text: vector for text, _, vector in queries})
+    embed_query = embeddings.__getitem__
+    embed_documents = lambda texts: [embeddings[text] for text in texts]
+
+    print(f"{len(chunks)} chunks, {len(queries)} questions, k={args.k}, {args.oversample * args.k} candidates when oversampled")
+    candidates = args.k * args.oversample
+    evaluate("top k", chunks, vectors, queries, facts_per_topic, args.k, args.k)
+    evaluate("rerank cosine", chunks, vectors, queries, facts_per_topic, args.k, candidates, LocalReranker(embed_query, embed_documents, mmr_lambda=1))
+    evaluate("rerank mmr", chunks, vectors, queries, facts_per_topic, args.k, candidates, LocalReranker(embed_query, embed_documents, mmr_lambda=args.mmr_lambda))
+    evaluate("rerank mmr + threshold", chunks, vectors, queries, facts_per_topic, args.k, candidates, LocalReranker(embed_query, embed_documents, mmr_lambda=args.mmr_lambda, score_threshold=args.threshold))
+
+if __name__ == '__main__':
+    main()
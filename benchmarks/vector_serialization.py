@@ -0,0 +1,83 @@
+'''
+Microbenchmark of the vector serialization of the upload and query paths.
+
+For --vectors random embeddings of --dims dimensions, given as Python lists like the OpenAI
+responses, reports the time per vector and the payload bytes per chunk of
+- azure before: np.array(vector, dtype=np.float32).tolist() then the JSON encoding, plus the
+  json.dumps of the whole document the bulk indexer did to measure each batch
+- azure after: utilities.serialization.to_json_floats then the JSON encoding, the document
+  size is bounded without serializing the vector
+- redis before: np.array(vector).astype(np.float32).tobytes(), as the langchain query did
+- redis after: utilities.serialization.to_redis_bytes
+and the largest cosine error introduced by the rounded JSON values.
+
+    python benchmarks/vector_serialization.py --vectors 2000 --dims 1536
+'''
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utilities.serialization import JSON_VECTOR_DECIMALS, json_vector_size, to_json_floats, to_redis_bytes
+
+CONTENT = "Agent: thank you for calling, how can I help you today? User: my order has not arrived yet. " * 20
+
+def make_vectors(count, dims, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(count, dims))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32).tolist()
+
+def document(vector):
+    return {"@search.action": "upload", "id": "doc_key", "title": "call.pdf", "tag": "call.pdf", "content": CONTENT, "content_vector": vector, "metadata": "{}"}
+
+def azure_before(vector):
+    doc = document(np.array(vector, dtype=np.float32).tolist())
+    size = len(json.dumps(doc))
+    return json.dumps(doc), size
+
+def azure_after(vector):
+    doc = document(None)
+    del doc["content_vector"]
+    size = len(json.dumps(doc)) + len("content_vector") + 4 + json_vector_size(len(vector))
+    doc["content_vector"] = to_json_floats(vector)
+    return json.dumps(doc), size
+
+def redis_before(vector):
+    return np.array(vector).astype(dtype=np.float32).tobytes()
+
+def redis_after(vector):
+    return to_redis_bytes(vector)
+
+def measure(name, function, vectors, payload_size):
+    start = time.perf_counter()
+    payloads = [function(vector) for vector in vectors]
+    elapsed = time.perf_counter() - start
+    print(f"{name:13} {elapsed / len(vectors) * 1e6:8.1f} us/vector  {payload_size(payloads[0]):7d} bytes/chunk")
+    return payloads
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vectors', type=int, default=2000)
+    parser.add_argument('--dims', type=int, default=1536)
+    args = parser.parse_args()
+
+    vectors = make_vectors(args.vectors, args.dims)
+    print(f"{args.vectors} vectors, {args.dims} dimensions, {JSON_VECTOR_DECIMALS} JSON decimals")
+    measure("azure before", azure_before, vectors, lambda payload: len(payload[0]))
+    after = measure("azure after", azure_after, vectors, lambda payload: len(payload[0]))
+    measure("redis before", redis_before, vectors, len)
+    measure("redis after", redis_after, vectors, len)
+
+    # The size bound used for the batches must never be below the real payload
+    assert all(size >= len(payload) for payload, size in after)
+    exact = np.array(vectors, dtype=np.float64)
+    rounded = np.array([json.loads(payload)["content_vector"] for payload, _ in after])
+    cosines = (exact * rounded).sum(axis=1) / np.linalg.norm(exact, axis=1) / np.linalg.norm(rounded, axis=1)
+    print(f"largest cosine error of the rounded vectors {np.abs(1 - cosines).max():.2e}")
+
+if __name__ == '__main__':
+    main()
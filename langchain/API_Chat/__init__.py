@@ -1,6 +1,7 @@
 # Import necessary modules
 import azure.functions
 from dotenv import load_dotenv
+import json
 import os
 from utilities.helper import LLMHelper
 
@@ -36,4 +37,4 @@ def main(request: azure.functions.HttpRequest) -> str:
     }
 
     # Return the response data as a JSON string in the HTTP response
-    return azure.functions.HttpResponse(str(response_data), mimetype="application/json")
+    return azure.functions.HttpResponse(json.dumps(response_data), mimetype="application/json")
@@ -0,0 +1,117 @@
+'''
+Streaming counterpart of API_Chat, as an ASGI app served next to the function app.
+
+With the function.json programming model the Functions host only sends the body of API_Chat
+once the function returns. This app takes the same POST request and sends the answer as it is
+generated, from any ASGI server able to stream the body, e.g.
+
+    PYTHONPATH=. uvicorn app:app --app-dir langchain/API_Chat_Stream
+'''
+import asyncio
+import json
+import os
+
+_END = object()
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def ndjson_event(event, data):
+    return json.dumps({"event": event, "data": data}) + "\n"
+
+def create_helper(custom_prompt="", temperature=0.7):
+    from dotenv import load_dotenv
+    from utilities.helper import LLMHelper
+    load_dotenv()
+    return LLMHelper(custom_prompt=custom_prompt, temperature=temperature)
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            return body
+
+async def send_response(send, status, body, content_type="text/plain"):
+    await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", content_type.encode())]})
+    await send({"type": "http.response.body", "body": body.encode()})
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+'''
+returns the ASGI app. It answers the JSON body of API_Chat (question, history, custom_prompt,
+custom_temperature) with the events of LLMHelper.stream_semantic_answer: "sources" as soon as
+the documents are retrieved, "token" as the answer is generated and "done" with the complete
+response. The events are Server-Sent Events, or JSON lines when the request accepts
+application/x-ndjson. An exception after the first event is sent as an "error" event. The
+helper is built and the events are read in worker threads, so a slow model does not block the
+other requests. helper_factory builds the helper from the custom prompt and temperature
+'''
+def create_app(helper_factory=create_helper):
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await lifespan(receive, send)
+        if scope["type"] != "http":
+            return
+        if scope["method"] != "POST":
+            return await send_response(send, 405, "Only POST requests are accepted")
+
+        body = await read_body(receive)
+        if body is None:
+            return
+        try:
+            request_data = json.loads(body)
+        except ValueError:
+            return await send_response(send, 400, "Invalid JSON data in the request body")
+
+        question = request_data.get('question')
+        history = request_data.get('history', [])
+        custom_prompt = request_data.get('custom_prompt', "")
+        custom_temperature = float(request_data.get('custom_temperature', os.getenv("OPENAI_TEMPERATURE", 0.7)))
+
+        headers = dict(scope.get("headers", []))
+        ndjson = b"application/x-ndjson" in headers.get(b"accept", b"")
+        format_event, content_type = (ndjson_event, "application/x-ndjson") if ndjson else (sse_event, "text/event-stream")
+
+        loop = asyncio.get_running_loop()
+        helper = await loop.run_in_executor(None, lambda: helper_factory(custom_prompt=custom_prompt, temperature=custom_temperature))
+        events = helper.stream_semantic_answer(question, history)
+        try:
+            # The response only starts with the first event, so a failed retrieval is still a 500
+            try:
+                first = await loop.run_in_executor(None, next, events, _END)
+            except Exception as e:
+                return await send_response(send, 500, str(e))
+
+            await send({"type": "http.response.start", "status": 200, "headers": [
+                (b"content-type", content_type.encode()),
+                (b"cache-control", b"no-cache"),
+                # Proxies must not buffer the events
+                (b"x-accel-buffering", b"no"),
+            ]})
+            item = first
+            while item is not _END:
+                event, data = item
+                await send({"type": "http.response.body", "body": format_event(event, data).encode(), "more_body": True})
+                try:
+                    item = await loop.run_in_executor(None, next, events, _END)
+                except Exception as e:
+                    await send({"type": "http.response.body", "body": format_event("error", {"message": str(e)}).encode(), "more_body": True})
+                    break
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            await loop.run_in_executor(None, events.close)
+
+    return app
+
+app = create_app()
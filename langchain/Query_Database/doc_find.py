@@ -10,20 +10,6 @@ Function will delete embeddings associated with a specific file from a knowledge
 '''
 def delete_embeddings_of_file(file_to_delete):
 
-    '''
-    checks if the data files embeddings is in the session_state. if not it will retrieve all of the data
-    from the redis database (k = 1000 max)
-    '''
-    if 'data_files_embeddings' not in st.session_state:
-        st.session_state['data_files_embeddings'] = llm_helper.get_all_documents(k=1000)
-
-    '''
-    checks if the retrieved data is empty (no embeddings/documents) were there in the knowledgebase
-    this uses the first dimension of shape (if 0, then its empty)
-    '''
-    if st.session_state['data_files_embeddings'].shape[0] == 0:
-        return
-
     '''
     iterates over the list containing a single file extension (.txt)
     '''
@@ -34,31 +20,14 @@ def delete_embeddings_of_file(file_to_delete):
         file_to_delete = 'converted/' + file_to_delete + converted_file_extension
 
         '''
-        Extracts a list of keys for embeddings associated with specified file. It filters the data stored in the file based
-        on the file name and then extracts the key column 
+        deletes the embeddings of the file with one lookup of the per file index of the vector store
         '''
-        embeddings_to_delete = st.session_state['data_files_embeddings'][st.session_state['data_files_embeddings']['filename'] == file_to_delete]['key'].tolist()
-        embeddings_to_delete = list(map(lambda x: f"{x}", embeddings_to_delete))
-
-        '''
-        checks if there is embeddings to be deleted. deletes it and updates the session state
-        '''
-        if len(embeddings_to_delete) > 0:
-            llm_helper.vector_store.delete_keys(embeddings_to_delete)
-            # remove all embeddings lines for the filename from session state
-            st.session_state['data_files_embeddings'] = st.session_state['data_files_embeddings'].drop(st.session_state['data_files_embeddings'][st.session_state['data_files_embeddings']['filename'] == file_to_delete].index)
+        llm_helper.delete_file_embeddings(file_to_delete)
 
 '''
 deletes both the source file, converted file, and associated embeddings
 '''
 def delete_file_and_embeddings(filename=''):
-    '''
-    checks if the data_files_embeddings is in the session state. if this is not in the session state, it
-    will retrieve from redis (max = 1000 data)
-    '''
-    if 'data_files_embeddings' not in st.session_state:
-        st.session_state['data_files_embeddings'] = llm_helper.get_all_documents(k=1000)
-
     '''
     Checks the filename and sees if the argument is empty. If it is, then it should add it in session 
     state as a filename to delete
@@ -147,10 +116,10 @@ try:
     llm_helper = LLMHelper()
 
     '''
-    Initializes two entries to store info about the files in knowledge base and their associated embeddings
+    Initializes the info about the files in knowledge base, their embeddings are found through the
+    per file index of the vector store when they are deleted
     '''
     st.session_state['data_files'] = llm_helper.blob_client.get_all_files()
-    st.session_state['data_files_embeddings'] = llm_helper.get_all_documents(k=1000)
 
     '''
     if no files, show error message
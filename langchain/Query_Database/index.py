@@ -16,26 +16,23 @@ def delete_embedding():
 
 '''
 Delete file embeddings
-If the data embeddings in the session state is not empty. Determine the file to delete
-has any embeddings. Then, choose to delete the embeddings
+Deletes the embeddings of the selected file through the per file index of the vector
+store (no listing of the corpus), then removes them from the session state
 '''
 def delete_file_embeddings():
-    if st.session_state['data_embeddings'].shape[0] != 0:
-        file_to_delete = st.session_state['file_to_drop']
-        embeddings_to_delete = st.session_state['data_embeddings'][st.session_state['data_embeddings']['filename'] == file_to_delete]['key'].tolist()
-        embeddings_to_delete = list(map(lambda x: f"{x}", embeddings_to_delete))
-        if len(embeddings_to_delete) > 0:
-            llm_helper.vector_store.delete_keys(embeddings_to_delete)
-            st.session_state['data_embeddings'] = st.session_state['data_embeddings'].drop(st.session_state['data_embeddings'][st.session_state['data_embeddings']['filename'] == file_to_delete].index)
+    file_to_delete = st.session_state['file_to_drop']
+    if llm_helper.delete_file_embeddings(file_to_delete) > 0 and 'data_embeddings' in st.session_state:
+        st.session_state['data_embeddings'] = st.session_state['data_embeddings'].drop(st.session_state['data_embeddings'][st.session_state['data_embeddings']['filename'] == file_to_delete].index)
 
 '''
 Delete All
-Embeddings to delete where the list of embeddings are stated out in the session state. 
+Deletes every embedding of the vector store, not only the ones listed in the session state,
+then removes them from the session state
 '''
 def delete_all():
-    embeddings_to_delete = st.session_state['data_embeddings'].key.tolist()
-    embeddings_to_delete = list(map(lambda x: f"{x}", embeddings_to_delete))
-    llm_helper.vector_store.delete_keys(embeddings_to_delete)   
+    llm_helper.delete_all_embeddings()
+    if 'data_embeddings' in st.session_state:
+        del st.session_state['data_embeddings']
 
 
 
@@ -57,9 +54,9 @@ try:
     llm_helper = LLMHelper()
 
     '''
-    get all the documents from redis and put in session state
+    list the first 1000 chunks of the vector store (without their contents) and put in session state
     '''
-    st.session_state['data_embeddings'] = llm_helper.get_all_documents(k=1000)
+    st.session_state['data_embeddings'] = llm_helper.get_all_documents(k=1000, fields=('key', 'filename', 'source'))
 
     nb_embeddings = len(st.session_state['data_embeddings'])
     '''
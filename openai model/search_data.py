@@ -2,6 +2,7 @@ import streamlit as st
 import os
 import traceback
 from utilities.helper import LLMHelper
+from utilities.export import EXPORT_FORMATS
 
 '''
 get the prompt from the user and combines the text from the document and input 
@@ -18,19 +19,16 @@ def customcompletion():
     st.session_state['prompt_result']= response.encode().decode()
 
 '''
-this process function will take the input data based on the condition and selects 
-rows from the data frame where the filename column is located. 
-
-the vector store will retrieve the data for the filename and save it as csv
+this process function runs the prompt on the chunks of the selected documents, then
+the vector store exports the results as csv or parquet to the blob storage, where
+they are downloaded from
 '''
-def process_all(data):
-    llm_helper.vector_store.delete_prompt_results('prompt*')
-    data_to_process = data[data.filename.isin(st.session_state['selected_docs'])]
-    for doc in data_to_process.to_dict('records'):
-        prompt = f"{doc['content']}\n{st.session_state['input_prompt']}\n\n"
-        response = llm_helper.get_completion(prompt)
-        llm_helper.vector_store.add_prompt_result(doc['key'], response.encode().decode(), doc['filename'], st.session_state['input_prompt'])
-    st.session_state['data_processed'] = llm_helper.vector_store.get_prompt_results().to_csv(index=False)
+def process_all():
+    # the chunks of the selected documents run concurrently within the quotas of the deployment, a failed or interrupted
+    # run resumes where it stopped when it is executed again with the same prompt
+    st.session_state['batch_stats'] = llm_helper.run_prompt_batch(st.session_state['input_prompt'], st.session_state['selected_docs'])
+    # the results are written page by page to a file uploaded to the blob storage, the app serves a link to it instead of the file
+    st.session_state['data_processed'] = llm_helper.upload_prompt_results(format=st.session_state['export_format'])
 
 try:
     # Set page layout to wide screen and menu item
@@ -54,9 +52,9 @@ try:
     llm_helper = LLMHelper()
 
     '''
-    obtain all the documents from the database
+    obtain the first 1000 chunks of the database (without their contents), every rerun of the page lists them again
     '''
-    data = llm_helper.get_all_documents(k=1000)
+    data = llm_helper.get_all_documents(k=1000, fields=('key', 'filename'))
 
     '''
     length = 0, then no embeddings will be found
@@ -87,15 +85,21 @@ try:
         process docs and download results
         '''
         cols = st.columns([1,1,1,2])
+        with cols[0]:
+            st.selectbox("Results format", list(EXPORT_FORMATS), key="export_format")
         with cols[1]:
             st.multiselect("Select documents", sorted(set(data.filename.tolist())), key="selected_docs")
         with cols[2]:
             st.text("-")
-            st.button("Execute task on docs", on_click=process_all, args=(data,)) 
+            st.button("Execute task on docs", on_click=process_all) 
         with cols[3]:
             st.text("-")
-            download_data = st.session_state['data_processed'] if st.session_state['data_processed'] is not None else ""
-            st.download_button(label="Download results", data=download_data, file_name="results.csv", mime="text/csv", disabled=st.session_state['data_processed'] is None)
+            if st.session_state['data_processed'] is not None:
+                st.markdown(f"[Download results]({st.session_state['data_processed']})")
+            else:
+                st.download_button(label="Download results", data="", file_name="results.csv", mime="text/csv", disabled=True)
+            if st.session_state.get('batch_stats', {}).get('failed'):
+                st.warning(f"{st.session_state['batch_stats']['failed']} chunks failed, execute the task again to process them")
 
 except Exception as e:
     st.error(traceback.format_exc())
\ No newline at end of file
@@ -0,0 +1,43 @@
+"""Shared fixtures of the tests, run from the root of the repository with python -m pytest."""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'vector database'))
+
+# Database used by the Redis tests, it must be empty: it is flushed after every test
+REDIS_TEST_URL = os.getenv('REDIS_TEST_URL', 'redis://localhost:6379/15')
+
+'''
+client of the Redis test database, the tests using it are skipped when no server answers
+'''
+@pytest.fixture
+def redis_client():
+    redis = pytest.importorskip('redis')
+    client = redis.Redis.from_url(REDIS_TEST_URL)
+    try:
+        client.ping()
+    except redis.exceptions.ConnectionError:
+        pytest.skip(f"no Redis server at {REDIS_TEST_URL}")
+    if client.dbsize():
+        pytest.skip(f"the Redis test database {REDIS_TEST_URL} is not empty")
+    yield client
+    client.flushdb()
+    client.close()
+
+'''
+RedisExtended on the test database without its search indexes (built without __init__), for
+the methods that only use plain Redis commands
+'''
+@pytest.fixture
+def redis_store(redis_client):
+    pytest.importorskip('langchain')
+    from database_config import RedisExtended
+    store = RedisExtended.__new__(RedisExtended)
+    store.client = redis_client
+    store.index_name = "test"
+    store.quantization = None
+    return store
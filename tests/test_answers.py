@@ -0,0 +1,41 @@
+import random
+
+import pytest
+
+from benchmarks.answer_postprocessing import FRAGMENTS, GOLDEN_ANSWERS, SOURCES, SOURCES_LIST, check_all
+from utilities.answers import extract_followup_questions, filter_source_links, insert_citations, process_answer, strip_sources
+
+FILENAMES = ["call1", "Call2", "call1"]
+
+# The previous implementations of LLMHelper, kept in the benchmark, are the reference
+@pytest.mark.parametrize("sources", SOURCES_LIST + [SOURCES])
+@pytest.mark.parametrize("answer", GOLDEN_ANSWERS)
+def test_same_output_as_the_previous_implementation(answer, sources):
+    check_all(answer, sources, FILENAMES)
+
+def test_same_output_on_random_answers():
+    generator = random.Random(0)
+    for _ in range(2000):
+        answer = "".join(generator.choices(FRAGMENTS, k=generator.randint(0, 30)))
+        sources = "".join(generator.choices(FRAGMENTS + ["(", ")", "?"], k=generator.randint(0, 15)))
+        check_all(answer, sources, FILENAMES)
+
+def test_strip_sources_cuts_at_the_first_marker():
+    assert strip_sources("Late. Source: a SOURCE: b SOURCES: c") == "Late. "
+    assert strip_sources("No sources") == "No sources"
+
+def test_extract_followup_questions():
+    assert extract_followup_questions("Answer.\nFollow-up Questions:\n<<What was ordered?>>\n<<When?>>") == ("Answer.\n", ["What was ordered?", "When?"])
+    assert extract_followup_questions("Answer.\nFollow-up Questions:\n1. What was ordered?\n2. When was it shipped?") == ("Answer.\n", ["What was ordered?", "When was it shipped?"])
+
+def test_insert_citations_keeps_the_references_of_a_reloaded_answer():
+    assert insert_citations("Answer $^{2}$ [[call1.txt]]", ["call1", "Call2"]) == ("Answer $^{2}$ $^{1}$", ["call1", "call2"], ["call1", "call2"])
+
+def test_process_answer():
+    processed = process_answer("Late [[call1.txt]] and [[Call2.pdf]] [[x.txt]].\nFollow-up Questions:\n<<Refund?>>\nSOURCES: call1.txt", filter_source_links(SOURCES))
+    assert processed.answer == "Late $^{1}$ and $^{2}$ $^{x}$.\n"
+    assert processed.followup_questions == ["Refund?"]
+    assert processed.sources == ["[call1](https://blob/documents/converted/call1.txt?sas)", "[Call2](https://blob/documents/converted/Call2.pdf.txt?sas)"]
+    assert processed.matched_sources == ["call1", "call2"]
+    assert processed.links == ["https://blob/documents/converted/call1.txt?sas", "https://blob/documents/converted/Call2.pdf.txt?sas"]
+    assert processed.filenames == ["call1", "call2"]
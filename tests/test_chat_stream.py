@@ -0,0 +1,77 @@
+import asyncio
+import importlib.util
+import json
+import os
+
+from conftest import ROOT
+
+spec = importlib.util.spec_from_file_location("chat_stream", os.path.join(ROOT, "langchain", "API_Chat_Stream", "app.py"))
+chat_stream = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(chat_stream)
+
+class FakeHelper:
+    def __init__(self, custom_prompt="", temperature=0.7, fail_at=None):
+        self.custom_prompt = custom_prompt
+        self.temperature = temperature
+        self.fail_at = fail_at
+        self.closed = False
+
+    def stream_semantic_answer(self, question, chat_history):
+        try:
+            if self.fail_at == 0:
+                raise RuntimeError("search unavailable")
+            yield "sources", {"question": question, "context": {}, "sources": "call1.txt"}
+            for token in ["Late ", "delivery."]:
+                if self.fail_at == 1:
+                    raise RuntimeError("model unavailable")
+                yield "token", token
+            yield "done", {"question": question, "response": "Late delivery.", "context": {}, "sources": "call1.txt", "temperature": self.temperature}
+        finally:
+            self.closed = True
+
+def call(app, body, method="POST", accept=None):
+    messages = []
+    body = body if isinstance(body, bytes) else json.dumps(body).encode()
+    requests = [{"type": "http.request", "body": body[:5], "more_body": True}, {"type": "http.request", "body": body[5:]}]
+
+    async def receive():
+        return requests.pop(0)
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": method, "headers": [(b"accept", accept.encode())] if accept else []}
+    asyncio.run(app(scope, receive, send))
+    headers = dict(messages[0]["headers"])
+    return messages[0]["status"], headers[b"content-type"].decode(), b"".join(m.get("body", b"") for m in messages[1:]).decode()
+
+def test_streams_the_answer_as_server_sent_events():
+    helpers = []
+    app = chat_stream.create_app(lambda **kwargs: helpers.append(FakeHelper(**kwargs)) or helpers[-1])
+    status, content_type, body = call(app, {"question": "Why?", "custom_temperature": "0.2"})
+    assert (status, content_type) == (200, "text/event-stream")
+    events = [event.split("\n") for event in body.strip().split("\n\n")]
+    assert [event[0] for event in events] == ["event: sources", "event: token", "event: token", "event: done"]
+    assert json.loads(events[1][1][len("data: "):]) == "Late "
+    assert json.loads(events[3][1][len("data: "):])["temperature"] == 0.2
+    assert helpers[0].closed
+
+def test_streams_json_lines_when_accepted():
+    app = chat_stream.create_app(FakeHelper)
+    status, content_type, body = call(app, {"question": "Why?"}, accept="application/x-ndjson")
+    assert (status, content_type) == (200, "application/x-ndjson")
+    lines = [json.loads(line) for line in body.splitlines()]
+    assert [line["event"] for line in lines] == ["sources", "token", "token", "done"]
+    assert "".join(line["data"] for line in lines if line["event"] == "token") == lines[-1]["data"]["response"]
+
+def test_errors_before_and_after_the_first_event():
+    status, _, body = call(chat_stream.create_app(lambda **kwargs: FakeHelper(fail_at=0, **kwargs)), {"question": "Why?"})
+    assert (status, body) == (500, "search unavailable")
+    status, _, body = call(chat_stream.create_app(lambda **kwargs: FakeHelper(fail_at=1, **kwargs)), {"question": "Why?"}, accept="application/x-ndjson")
+    assert status == 200
+    assert [json.loads(line)["event"] for line in body.splitlines()] == ["sources", "error"]
+
+def test_rejects_invalid_requests():
+    app = chat_stream.create_app(FakeHelper)
+    assert call(app, b"not json")[0] == 400
+    assert call(app, b"", method="GET")[0] == 405
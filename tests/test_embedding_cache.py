@@ -0,0 +1,16 @@
+from utilities.embeddings import DEFAULT_REDIS_TTL, EmbeddingCache
+
+def test_redis_entries_expire_by_default(redis_client):
+    cache = EmbeddingCache("ada")
+    cache.set_redis_client(redis_client)
+    cache.set_many(["Late  delivery"], [[1.0, 2.0]])
+    assert 0 < redis_client.ttl(cache.key("Late delivery")) <= DEFAULT_REDIS_TTL
+    cache.clear()
+    assert cache.get_many(["Late delivery", "Refund"]) == [[1.0, 2.0], None]
+    assert cache.stats()["redis_hits"] == 1
+
+def test_redis_entries_without_ttl(redis_client):
+    cache = EmbeddingCache("ada", redis_ttl=None)
+    cache.set_redis_client(redis_client)
+    cache.set_many(["Refund"], [[3.0]])
+    assert redis_client.ttl(cache.key("Refund")) == -1
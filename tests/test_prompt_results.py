@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+def writer_of(store, **kwargs):
+    return store.prompt_result_writer(**{"max_interval": None, **kwargs})
+
+def test_writer_flushes_by_size(redis_store):
+    with writer_of(redis_store, max_batch_size=3) as writer:
+        for i in range(7):
+            writer.add(str(i), f"result {i}", "call1.txt", "summarize")
+        assert writer.stats() == {"results": 6, "flushes": 2, "buffered": 1}
+        assert not redis_store.client.exists("prompt:6")
+    assert writer.stats() == {"results": 7, "flushes": 3, "buffered": 0}
+    assert redis_store.client.hgetall("prompt:6") == {b"result": b"result 6", b"filename": b"call1.txt", b"prompt": b"summarize"}
+
+def test_writer_flushes_the_oldest_result_after_max_interval(redis_store):
+    with writer_of(redis_store, max_batch_size=100, max_interval=0.1) as writer:
+        writer.add("1", "result")
+        deadline = time.monotonic() + 2
+        while not redis_store.client.exists("prompt:1") and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert redis_store.client.exists("prompt:1")
+        assert writer.stats()["buffered"] == 0
+
+@pytest.mark.parametrize("transaction", [False, True])
+def test_writer_adds_the_ids_to_the_job(redis_store, transaction):
+    with writer_of(redis_store, job="job1", max_batch_size=2, transaction=transaction) as writer:
+        for i in range(3):
+            writer.add(str(i), "result")
+    assert redis_store.client.smembers("promptjob:job1") == {b"0", b"1", b"2"}
+
+def test_closed_writer_rejects_results(redis_store):
+    writer = writer_of(redis_store)
+    writer.close()
+    with pytest.raises(ValueError):
+        writer.add("1", "result")
+
+def test_failed_flush_keeps_the_results_buffered(redis_store):
+    class FailingClient:
+        def __init__(self, client):
+            self.client = client
+            self.failures = 1
+
+        def pipeline(self, **kwargs):
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError("connection lost")
+            return self.client.pipeline(**kwargs)
+
+    writer = writer_of(redis_store, max_batch_size=2)
+    writer.client = FailingClient(redis_store.client)
+    writer.add("1", "result")
+    with pytest.raises(ConnectionError):
+        writer.add("2", "result")
+    assert writer.stats()["buffered"] == 2
+    writer.close()
+    assert redis_store.client.exists("prompt:1", "prompt:2") == 2
+
+def test_add_prompt_results_returns_the_number_written(redis_store):
+    results = [(str(i), "result", "call1.txt", "summarize") for i in range(5)]
+    assert redis_store.add_prompt_results(results, job="job1") == 5
+    assert redis_store.client.scard("promptjob:job1") == 5
+
+def test_start_prompt_job_resumes_or_replaces_the_results(redis_store):
+    assert redis_store.start_prompt_job("job1") == set()
+    redis_store.add_prompt_results([("1", "result", "", ""), ("2", "result", "", "")], job="job1")
+    assert redis_store.start_prompt_job("job1") == {"1", "2"}
+    assert redis_store.start_prompt_job("job2") == set()
+    assert redis_store.client.keys("prompt*") == [b"promptjob:current"]
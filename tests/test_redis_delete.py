@@ -0,0 +1,91 @@
+import hashlib
+import json
+
+def chunk_key(filename, content):
+    return f"doc:test:{hashlib.sha1(filename.encode('utf-8')).hexdigest()}:{hashlib.sha1(content.encode('utf-8')).hexdigest()}"
+
+def add_chunks(store, filename, count):
+    keys = [chunk_key(filename, f"chunk {i}") for i in range(count)]
+    pipeline = store.client.pipeline(transaction=False)
+    for key in keys:
+        pipeline.hset(key, mapping={"content": key, "metadata": "{}"})
+        pipeline.sadd(store.get_file_index_key(key), key)
+    pipeline.execute()
+    return keys
+
+def test_delete_keys_unlinks_in_batches(redis_store):
+    keys = add_chunks(redis_store, "call1.txt", 25)
+    progress = []
+    assert redis_store.delete_keys(keys + ["doc:test:missing"], batch_size=10, progress=progress.append) == 25
+    assert progress == [10, 20, 25]
+    assert redis_store.client.exists(*keys) == 0
+
+def test_delete_keys_keeps_the_file_sets_up_to_date(redis_store):
+    keys = add_chunks(redis_store, "call1.txt", 5)
+    other_keys = add_chunks(redis_store, "call2.txt", 3)
+    redis_store.client.set("filekeys:test", "indexed")
+    redis_store.delete_keys(keys[:2], batch_size=1)
+    assert sorted(redis_store.get_file_keys("call1.txt")) == sorted(keys[2:])
+    assert sorted(redis_store.get_file_keys("call2.txt")) == sorted(other_keys)
+
+def test_delete_keys_pattern_scans_the_keyspace(redis_store):
+    add_chunks(redis_store, "call1.txt", 30)
+    redis_store.client.set("prompt:1", "kept")
+    assert redis_store.delete_keys_pattern("doc:test:*", batch_size=7) == 30
+    assert redis_store.client.keys("doc:test:*") == []
+    assert redis_store.client.get("prompt:1") == b"kept"
+
+def test_get_file_keys_indexes_the_chunks_stored_before_the_file_sets(redis_store):
+    keys = add_chunks(redis_store, "call1.txt", 4)
+    redis_store.client.delete(redis_store.get_file_index_key_of_filename("call1.txt"))
+    assert sorted(redis_store.get_file_keys("call1.txt")) == sorted(keys)
+    assert redis_store.client.get("filekeys:test") == b"indexed"
+
+def test_delete_file_removes_its_chunks_and_its_set(redis_store):
+    keys = add_chunks(redis_store, "call1.txt", 4)
+    other_keys = add_chunks(redis_store, "call2.txt", 2)
+    redis_store.client.set("filekeys:test", "indexed")
+    assert redis_store.delete_file("call1.txt") == 4
+    assert redis_store.client.exists(*keys) == 0
+    assert not redis_store.client.exists(redis_store.get_file_index_key_of_filename("call1.txt"))
+    assert redis_store.client.exists(*other_keys) == 2
+
+def add_legacy_chunks(store, filename, count):
+    # Keys written before the filename hash was part of the key: doc:{index}:{sha1(url_i)}
+    source_url = f"https://account.blob.core.windows.net/documents/{filename}"
+    keys = [f"doc:test:{hashlib.sha1(f'{source_url}_{i}'.encode('utf-8')).hexdigest()}" for i in range(count)]
+    pipeline = store.client.pipeline(transaction=False)
+    for i, key in enumerate(keys):
+        pipeline.hset(key, mapping={"content": key, "metadata": json.dumps({"source": source_url, "chunk": i, "key": key, "filename": filename})})
+    pipeline.execute()
+    return keys
+
+def test_get_file_keys_indexes_the_legacy_chunks_from_their_metadata(redis_store):
+    legacy_keys = add_legacy_chunks(redis_store, "call1.txt", 3)
+    other_keys = add_legacy_chunks(redis_store, "call2.txt", 2)
+    keys = add_chunks(redis_store, "call1.txt", 2)
+    redis_store.client.delete(redis_store.get_file_index_key_of_filename("call1.txt"))
+    assert redis_store.index_file_keys(batch_size=2) == 7
+    assert sorted(redis_store.get_file_keys("call1.txt")) == sorted(legacy_keys + keys)
+    assert sorted(redis_store.get_file_keys("call2.txt")) == sorted(other_keys)
+
+def test_delete_file_removes_the_legacy_chunks(redis_store):
+    legacy_keys = add_legacy_chunks(redis_store, "call1.txt", 3)
+    other_keys = add_legacy_chunks(redis_store, "call2.txt", 2)
+    redis_store.delete_keys(legacy_keys[:1])
+    assert redis_store.delete_file("call1.txt") == 2
+    assert redis_store.client.exists(*legacy_keys) == 0
+    assert redis_store.client.exists(*other_keys) == 2
+    redis_store.delete_keys(other_keys[:1])
+    assert redis_store.get_file_keys("call2.txt") == other_keys[1:]
+
+def test_delete_all_removes_every_chunk_and_the_file_sets(redis_store):
+    add_chunks(redis_store, "call1.txt", 1200)
+    add_legacy_chunks(redis_store, "call2.txt", 3)
+    redis_store.client.set("doc:other:1", "kept")
+    redis_store.client.set("filekeys:test", "indexed")
+    assert redis_store.delete_all(batch_size=500) == 1203
+    assert redis_store.client.keys("doc:test:*") == []
+    assert redis_store.client.keys("filekeys:test:*") == []
+    assert redis_store.client.get("doc:other:1") == b"kept"
+    assert redis_store.get_file_keys("call1.txt") == []
@@ -0,0 +1,151 @@
+"""Semantic cache of the answers generated for the questions asked to the chat."""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger()
+
+'''
+AnswerCache keeps the answers generated for recent questions, keyed on the embedding of the
+standalone (condensed) question. A lookup returns the answer of the most similar cached
+question when their cosine similarity is at least threshold and the entry was stored with
+the same scope (deployment, prompt, temperature...). Entries expire after ttl seconds, the
+least recently used ones are evicted beyond max_entries and the entries built from a file
+are dropped when that file is re-ingested or deleted
+'''
+class AnswerCache:
+    def __init__(self, threshold: float = 0.97, max_entries: int = 1000, ttl: Optional[int] = 3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._next_id = 0
+        # Matrix of the normalized question vectors, rebuilt after entries are added or removed
+        self._ids = None
+        self._matrix = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _index(self):
+        if self._matrix is None:
+            self._ids = list(self._entries)
+            self._matrix = np.stack([self._entries[entry_id]['vector'] for entry_id in self._ids]) if self._ids else None
+        return self._ids, self._matrix
+
+    def _remove(self, entry_id) -> bool:
+        if self._entries.pop(entry_id, None) is None:
+            return False
+        self._matrix = None
+        return True
+
+    def _expired(self, entry, now) -> bool:
+        return bool(self.ttl) and now - entry['created'] > self.ttl
+
+    def _find(self, vector, scope):
+        ids, matrix = self._index()
+        if matrix is None:
+            return None
+        scores = matrix @ vector
+        candidates = np.flatnonzero(scores >= self.threshold)
+        now = time.monotonic()
+        found = None
+        for i in candidates[np.argsort(-scores[candidates])]:
+            entry = self._entries[ids[i]]
+            if entry['scope'] != scope:
+                continue
+            if self._expired(entry, now):
+                self._remove(ids[i])
+                self.expirations += 1
+                continue
+            found = ids[i]
+            break
+        return found
+
+    '''
+    returns the value cached for the most similar question, or None. validate is called with
+    the files the entry was built from ({filename: fingerprint}) and returns False when one of
+    them changed since, in which case the entry is dropped and the lookup is a miss
+    '''
+    def lookup(self, embedding: List[float], scope: Hashable = None, validate: Callable[[Dict[str, Any]], bool] = None) -> Optional[Any]:
+        vector = self.normalize(embedding)
+        with self._lock:
+            entry_id = self._find(vector, scope)
+            entry = self._entries.get(entry_id) if entry_id is not None else None
+        if entry is not None and validate is not None:
+            try:
+                valid = validate(entry['files'])
+            except Exception as e:
+                logger.warning(f"Answer cache validation failed: {e}")
+                valid = False
+            if not valid:
+                with self._lock:
+                    self._remove(entry_id)
+                    self.stale += 1
+                entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry_id in self._entries:
+                self._entries.move_to_end(entry_id)
+            self.hits += 1
+            return entry['value']
+
+    '''
+    stores the value generated for a question. files maps the name of each file the answer
+    was built from to its fingerprint, used by invalidate_files and by lookup's validate
+    '''
+    def store(self, embedding: List[float], value: Any, scope: Hashable = None, files: Dict[str, Any] = None) -> None:
+        entry = {"vector": self.normalize(embedding), "value": value, "scope": scope, "files": dict(files or {}), "created": time.monotonic()}
+        with self._lock:
+            self._entries[self._next_id] = entry
+            self._next_id += 1
+            self._matrix = None
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    '''
+    drops the entries built from any of the files, returns how many were dropped
+    '''
+    def invalidate_files(self, filenames: List[str]) -> int:
+        filenames = set(filenames)
+        with self._lock:
+            entry_ids = [entry_id for entry_id, entry in self._entries.items() if filenames & entry['files'].keys()]
+            for entry_id in entry_ids:
+                self._remove(entry_id)
+            self.invalidations += len(entry_ids)
+        return len(entry_ids)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,141 @@
+"""Post-processing of the chat answers: sources, follow-up questions and citations."""
+import re
+from typing import List, NamedTuple, Tuple
+
+# Markers the model uses to append the sources to the answer, the answer ends at the first one
+SOURCES_MARKERS = ('SOURCES:', 'Sources:', 'SOURCE:', 'Source:')
+
+# Patterns are compiled once, every function below scans the text forward without rebuilding it per match
+SOURCES_PATTERN = re.compile('|'.join(map(re.escape, SOURCES_MARKERS)))
+SOURCE_LINK_PATTERN = re.compile(r'\[[^\]]*?/([^/\]]*?)\]')
+FOLLOWUP_PATTERN = re.compile(r'\<\<(.*?)\>\>')
+NUMBERED_FOLLOWUP_PATTERN = re.compile(r'\d. (.*)')
+FOLLOWUP_QUESTION_PATTERN = re.compile(r'Follow-up Question: (.*)')
+FOLLOWUP_HEADING_PATTERN = re.compile(r'follow[- ]up questions')
+CITATION_PATTERN = re.compile(r'\[\[(.*?)\]\]')
+# A lookahead, so references written back to back ('$^{1}$^{2}$') share their '$'
+REFERENCE_PATTERN = re.compile(r'\$(?=\^\{(\d+)\}\$)')
+SOURCES_SEPARATOR = '  \n '
+
+'''
+returns the answer up to the first sources marker
+'''
+def strip_sources(answer: str) -> str:
+    match = SOURCES_PATTERN.search(answer)
+    return answer[:match.start()] if match else answer
+
+'''
+replaces every '[anypath/anypath/somefilename.xxx](the_link)' of the sources by
+'[somefilename](the_link)' and puts each source on its own line
+'''
+def filter_source_links(sources: str) -> str:
+    sources = SOURCE_LINK_PATTERN.sub(lambda match: f'[{match.group(1).split(".")[0]}]', sources)
+    return SOURCES_SEPARATOR + sources.replace('\n', SOURCES_SEPARATOR)
+
+'''
+splits the follow-up questions off the answer. They start at the first 'Follow-up Questions'
+or '<<' and are read as <<question>>, then as numbered lines after the last of those, then as
+'Follow-up Question: ' lines after the last numbered one. Returns the answer without them
+(also cut at a 'follow-up questions' heading in any case) and the list of questions
+'''
+def extract_followup_questions(answer: str) -> Tuple[str, List[str]]:
+    tag, questions = answer.find('Follow-up Questions'), answer.find('<<')
+    tag = min(tag, questions) if tag != -1 and questions != -1 else max(tag, questions)
+    answer_without_followup_questions = answer[:tag] if tag != -1 else answer
+    followup_questions = answer[tag:].strip() if tag != -1 else ''
+
+    followup_questions_list = []
+    position = 0
+    # Characters cut from the start and the end of each match, the space after 'Follow-up Question:' is kept
+    for pattern, start, end in ((FOLLOWUP_PATTERN, 2, 2), (NUMBERED_FOLLOWUP_PATTERN, 3, 0), (FOLLOWUP_QUESTION_PATTERN, 19, 0)):
+        for match in pattern.finditer(followup_questions, position):
+            followup_questions_list.append(followup_questions[match.start() + start:match.end() - end])
+            position = match.end()
+
+    # Special case when 'Follow-up questions:' appears in the answer after the << (the LLM can also write 'follow up questions')
+    heading = FOLLOWUP_HEADING_PATTERN.search(answer_without_followup_questions.lower())
+    if heading:
+        answer_without_followup_questions = answer_without_followup_questions[:heading.start()]
+    return answer_without_followup_questions, followup_questions_list
+
+'''
+replaces the [[filename]] citations of the answer by '$^{n}$', n being the position of the
+file in filenames (its name in lower case when it is not one of them). Returns the answer,
+the cited files, including the ones of references already in the answer (a reloaded page),
+and the lower case filenames
+'''
+def insert_citations(answer: str, filenames: List[str]) -> Tuple[str, List[str], List[str]]:
+    filenames_lowered = [filename.lower() for filename in filenames]    # LLM can make case mistakes in returning the filename of the source
+    positions = {}
+    for i, filename in enumerate(filenames):
+        positions.setdefault(filename, i + 1)
+
+    matched_sources = []
+    parts = []
+    position = 0
+    match = CITATION_PATTERN.search(answer)
+    while match:
+        filename = match.group(1).split('.')[0] # remove any extension to the name of the source document
+        if filename in positions:
+            if filename not in matched_sources:
+                matched_sources.append(filename.lower())
+            replacement = '$^{' + f'{positions[filename]}' + '}$'
+        else:
+            replacement = '$^{' + f'{filename.lower()}' + '}$'
+        nested = replacement.find('[[')
+        if nested == -1:
+            parts.append(answer[position:match.start()])
+            parts.append(replacement)
+            position = match.end()
+            match = CITATION_PATTERN.search(answer, position)
+        else:
+            # A citation holding '[[': the next one opens inside its replacement, as when the answer was searched again from its start
+            parts.append(answer[position:match.start()])
+            parts.append(replacement[:nested])
+            answer, position = replacement[nested:] + answer[match.end():], 0
+            match = CITATION_PATTERN.search(answer)
+    parts.append(answer[position:])
+    answer = ''.join(parts)
+
+    # When page is reloaded search for references already added to the answer (e.g. '${(id+1)}')
+    references = set(REFERENCE_PATTERN.findall(answer))
+    for id, filename in enumerate(filenames_lowered):
+        if str(id + 1) in references and filename not in matched_sources:
+            matched_sources.append(filename)
+    return answer, matched_sources, filenames_lowered
+
+'''
+reads the sources formatted by filter_source_links ('  \n [filename1](link1)  \n [filename2](link2)')
+into their lines, links and filenames, and replaces the paths of the sources the LLM wrote
+in the answer by their filenames. Returns the answer, the sources, the links and the filenames
+'''
+def parse_sources(answer: str, sources: str) -> Tuple[str, List[str], List[str], List[str]]:
+    sources_list, links, filenames = [], [], []
+    for source in sources.split(SOURCES_SEPARATOR):
+        if source != '':
+            sources_list.append(source)
+            link = source[1:].split('(')[1][:-1].split(')')[0] # get the link
+            links.append(link)
+            filename = source[1:].split(']')[0] # retrieve the source filename
+            answer = answer.replace(link.split('?')[0], filename)  # if LLM added a path to the filename, remove it from the answer
+            filenames.append(filename)
+    return answer, sources_list, links, filenames
+
+class ProcessedAnswer(NamedTuple):
+    answer: str
+    followup_questions: List[str]
+    sources: List[str]
+    matched_sources: List[str]
+    links: List[str]
+    filenames: List[str]
+
+'''
+post-processes a raw answer of the LLM and the sources returned with it (as formatted by
+filter_source_links) in one call: the sources part of the answer and the follow-up
+questions are split off, then the citations are inserted
+'''
+def process_answer(answer: str, sources: str) -> ProcessedAnswer:
+    answer, followup_questions = extract_followup_questions(strip_sources(answer))
+    answer, sources_list, links, filenames = parse_sources(answer, sources)
+    answer, matched_sources, filenames = insert_citations(answer, filenames)
+    return ProcessedAnswer(answer, followup_questions, sources_list, matched_sources, links, filenames)
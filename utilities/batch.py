@@ -0,0 +1,163 @@
+"""Rate limited concurrent execution of a prompt over many documents."""
+import logging
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple
+
+from utilities.embeddings import count_tokens
+
+logger = logging.getLogger()
+
+'''
+RateLimiter keeps the requests and the tokens sent to a deployment under its per minute
+quotas with two token buckets. The buckets hold 10 seconds of quota, Azure OpenAI enforces
+the limits over short windows, so a batch starts without a burst the service would throttle.
+pause() stops every caller for the time a 429 response asked for
+'''
+class RateLimiter:
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None, window: float = 10.0):
+        self.request_rate = requests_per_minute / 60 if requests_per_minute else None
+        self.token_rate = tokens_per_minute / 60 if tokens_per_minute else None
+        self.request_capacity = max(1.0, self.request_rate * window) if self.request_rate else None
+        self.token_capacity = max(1.0, self.token_rate * window) if self.token_rate else None
+        self.requests = self.request_capacity or 0.0
+        self.tokens = self.token_capacity or 0.0
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self.updated
+        self.updated = now
+        if self.request_rate:
+            self.requests = min(self.request_capacity, self.requests + elapsed * self.request_rate)
+        if self.token_rate:
+            self.tokens = min(self.token_capacity, self.tokens + elapsed * self.token_rate)
+
+    '''
+    blocks until one request of the given number of tokens fits in both quotas. A request
+    larger than the token bucket waits for a full bucket
+    '''
+    def acquire(self, tokens: int = 0) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                tokens = min(tokens, self.token_capacity) if self.token_rate else 0
+                delay = self.paused_until - now
+                if delay <= 0:
+                    missing_requests = 1 - self.requests if self.request_rate else 0
+                    missing_tokens = tokens - self.tokens if self.token_rate else 0
+                    delay = max(missing_requests / self.request_rate if missing_requests > 0 else 0, missing_tokens / self.token_rate if missing_tokens > 0 else 0)
+                    if delay <= 0:
+                        if self.request_rate:
+                            self.requests -= 1
+                        if self.token_rate:
+                            self.tokens -= tokens
+                        return
+                self.waited += delay
+            time.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+'''
+returns True for the errors of a throttled request (HTTP 429), whichever client raised it
+'''
+def is_throttled(error: Exception) -> bool:
+    status = getattr(error, 'http_status', None) or getattr(error, 'status_code', None) or getattr(getattr(error, 'response', None), 'status_code', None)
+    return status == 429 or type(error).__name__ == 'RateLimitError'
+
+'''
+returns the seconds a throttled response asked to wait for (Retry-After header), if any
+'''
+def retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(error, 'headers', None) or getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        value = headers.get('Retry-After') or headers.get('retry-after')
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+'''
+BatchRunner runs complete(prompt) for every (key, prompt, payload) item with max_workers
+requests in flight, each one admitted by the rate limiter with the tokens of its prompt plus
+the expected completion tokens. Throttled requests are retried up to max_retries times after
+the Retry-After of the response or an exponential backoff with jitter, while the limiter
+holds back the other workers. Results are yielded in completion order as (key, response,
+payload); the items that still failed are kept in failed so a later run can resume them
+'''
+class BatchRunner:
+    def __init__(
+        self,
+        complete: Callable[[str], str],
+        rate_limiter: Optional[RateLimiter] = None,
+        max_workers: int = 8,
+        max_retries: int = 6,
+        backoff: float = 1.0,
+        completion_tokens: int = 256,
+    ):
+        self.complete = complete
+        self.rate_limiter = rate_limiter
+        self.max_workers = max(1, max_workers)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.completion_tokens = completion_tokens
+        self.failed = []
+        self.completed = 0
+        self.retried = 0
+        self._lock = threading.Lock()
+
+    def _run(self, prompt: str) -> str:
+        tokens = count_tokens(prompt) + self.completion_tokens
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(tokens)
+            try:
+                return self.complete(prompt)
+            except Exception as e:
+                if not is_throttled(e) or attempt == self.max_retries:
+                    raise
+                delay = retry_after(e) or self.backoff * 2 ** attempt * (0.5 + random.random())
+                with self._lock:
+                    self.retried += 1
+                if self.rate_limiter is not None:
+                    self.rate_limiter.pause(delay)
+                else:
+                    time.sleep(delay)
+
+    def run(self, items: Iterable[Tuple[str, str, Any]]) -> Iterator[Tuple[str, str, Any]]:
+        items = iter(items)
+        pending = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='batch') as executor:
+            while True:
+                # Twice as many items as workers are submitted, the rest of the items are read lazily
+                for key, prompt, payload in items:
+                    pending[executor.submit(self._run, prompt)] = (key, payload)
+                    if len(pending) >= 2 * self.max_workers:
+                        break
+                if not pending:
+                    return
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key, payload = pending.pop(future)
+                    try:
+                        response = future.result()
+                    except Exception as e:
+                        logger.warning(f"Prompt on {key} failed: {e}")
+                        self.failed.append((key, e))
+                        continue
+                    self.completed += 1
+                    yield key, response, payload
+
+    def stats(self) -> dict:
+        return {
+            "completed": self.completed,
+            "failed": len(self.failed),
+            "retried": self.retried,
+            "rate_limited_seconds": round(self.rate_limiter.waited, 1) if self.rate_limiter is not None else 0.0,
+        }
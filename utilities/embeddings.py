@@ -0,0 +1,289 @@
+"""Batched embedding helpers shared by the ingestion and query paths."""
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Awaitable, Callable, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger()
+
+# Entries of the Redis tier of the embedding cache expire a week after they are written
+DEFAULT_REDIS_TTL = 7 * 24 * 3600
+
+'''
+returns the tiktoken encoding used to count tokens. The encoding is cached so the
+BPE ranks are only loaded once per process. Returns None when tiktoken is not installed
+'''
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name: str = "cl100k_base"):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    return tiktoken.get_encoding(encoding_name)
+
+'''
+counts the tokens of a text with the cached encoding (falls back to ~4 characters per token)
+'''
+def count_tokens(text: str, encoding_name: str = "cl100k_base") -> int:
+    encoding = get_encoding(encoding_name)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+'''
+cuts a text to its first max_tokens tokens with the cached encoding (~4 characters per token
+without tiktoken)
+'''
+def truncate_tokens(text: str, max_tokens: int, encoding_name: str = "cl100k_base") -> str:
+    encoding = get_encoding(encoding_name)
+    if encoding is None:
+        return text[:max(0, max_tokens) * 4]
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max(0, max_tokens)])
+
+'''
+BatchedEmbeddings groups texts into requests bounded by a token budget and a maximum
+number of inputs, sends several requests in flight and returns the vectors in the same
+order as the input texts. embed_batch is any callable that embeds a list of texts in a
+single request (e.g. OpenAIEmbeddings.embed_documents with a matching chunk_size), and
+aembed_batch its optional native async counterpart used by aembed_query
+'''
+class BatchedEmbeddings:
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], List[List[float]]],
+        max_batch_size: int = 16,
+        max_batch_tokens: int = 8000,
+        max_concurrency: int = 4,
+        aembed_batch: Callable[[List[str]], Awaitable[List[List[float]]]] = None,
+    ):
+        self.embed_batch = embed_batch
+        self.aembed_batch = aembed_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_batch_tokens = max(1, max_batch_tokens)
+        self.max_concurrency = max(1, max_concurrency)
+
+    '''
+    splits the texts into batches of indexes. A batch is closed when adding the next text
+    would exceed either the token budget or the maximum number of inputs. A single text
+    larger than the budget is sent on its own
+    '''
+    def make_batches(self, texts: List[str]) -> List[List[int]]:
+        batches = []
+        batch, batch_tokens = [], 0
+        for i, text in enumerate(texts):
+            tokens = count_tokens(text)
+            if batch and (len(batch) == self.max_batch_size or batch_tokens + tokens > self.max_batch_tokens):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(i)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        texts = list(texts)
+        if not texts:
+            return []
+        batches = self.make_batches(texts)
+        embeddings = [None] * len(texts)
+
+        def run(batch):
+            vectors = self.embed_batch([texts[i] for i in batch])
+            if len(vectors) != len(batch):
+                raise ValueError(f"Expected {len(batch)} embeddings, got {len(vectors)}")
+            return batch, vectors
+
+        if len(batches) == 1 or self.max_concurrency == 1:
+            results = list(map(run, batches))
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+                results = list(executor.map(run, batches))
+        # Put every vector back at the position of its text
+        for batch, vectors in results:
+            for i, vector in zip(batch, vectors):
+                embeddings[i] = vector
+        logger.debug(f"Embedded {len(texts)} texts in {len(batches)} requests")
+        return embeddings
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_batch([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        if self.aembed_batch is None:
+            return await asyncio.to_thread(self.embed_query, text)
+        return (await self.aembed_batch([text]))[0]
+
+'''
+EmbeddingCache is a content addressed cache of embeddings keyed by the model deployment and
+the hash of the normalized text. The first tier is an in-process LRU bounded to max_entries
+vectors, the optional second tier is Redis (the RedisExtended client can be reused), where the
+entries expire after redis_ttl seconds. Vectors are kept as float32 so an entry costs 4 bytes
+per dimension in both tiers
+'''
+class EmbeddingCache:
+    def __init__(
+        self,
+        deployment: str,
+        max_entries: int = 10000,
+        redis_client=None,
+        redis_ttl: Optional[int] = DEFAULT_REDIS_TTL,
+        prefix: str = "embcache",
+    ):
+        self.deployment = deployment
+        self.max_entries = max_entries
+        self.redis_client = redis_client
+        self.redis_ttl = redis_ttl
+        self.prefix = prefix
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    '''
+    sets the Redis tier. With no redis_ttl its entries are only bounded by the eviction of the
+    server, a warning is logged when its maxmemory-policy does not evict any key (allkeys-*)
+    '''
+    def set_redis_client(self, redis_client) -> None:
+        if redis_client is self.redis_client:
+            return
+        self.redis_client = redis_client
+        if redis_client is None or self.redis_ttl is not None:
+            return
+        try:
+            policy = next(iter(redis_client.config_get("maxmemory-policy").values()), None)
+        except Exception as e:
+            logger.warning(f"Embedding cache entries have no TTL and the maxmemory-policy of Redis could not be checked: {e}")
+            return
+        policy = policy.decode('utf-8') if isinstance(policy, bytes) else policy
+        if not (policy or "").startswith("allkeys-"):
+            logger.warning(f"Embedding cache entries have no TTL and the Redis maxmemory-policy is {policy}, they are never evicted")
+
+    '''
+    collapses the whitespace so the same text with different spacing or line endings
+    hits the same entry
+    '''
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.split())
+
+    def key(self, text: str) -> str:
+        digest = hashlib.sha256(self.normalize(text).encode('utf-8')).hexdigest()
+        return f"{self.prefix}:{self.deployment}:{digest}"
+
+    def _put_local(self, key, vector):
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    '''
+    returns the cached vector of each text (None for the misses). The local tier is
+    checked first and the remaining keys are fetched from Redis with a single MGET
+    '''
+    def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        keys = [self.key(text) for text in texts]
+        vectors = [None] * len(keys)
+        remote = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    vectors[i] = vector
+                    self.hits += 1
+                else:
+                    remote.append(i)
+        if remote and self.redis_client is not None:
+            try:
+                values = self.redis_client.mget([keys[i] for i in remote])
+            except Exception as e:
+                logger.warning(f"Embedding cache Redis lookup failed: {e}")
+                values = [None] * len(remote)
+            still_missing = []
+            for i, value in zip(remote, values):
+                if value is None:
+                    still_missing.append(i)
+                    continue
+                vectors[i] = np.frombuffer(value, dtype=np.float32)
+                self._put_local(keys[i], vectors[i])
+            with self._lock:
+                self.redis_hits += len(remote) - len(still_missing)
+            remote = still_missing
+        with self._lock:
+            self.misses += len(remote)
+        return [vector.tolist() if vector is not None else None for vector in vectors]
+
+    def set_many(self, texts: List[str], vectors: List[List[float]]) -> None:
+        pipeline = self.redis_client.pipeline(transaction=False) if self.redis_client is not None else None
+        for text, vector in zip(texts, vectors):
+            key = self.key(text)
+            vector = np.array(vector, dtype=np.float32)
+            self._put_local(key, vector)
+            if pipeline is not None:
+                pipeline.set(key, vector.tobytes(), ex=self.redis_ttl)
+        if pipeline is not None:
+            try:
+                pipeline.execute()
+            except Exception as e:
+                logger.warning(f"Embedding cache Redis write failed: {e}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.redis_hits) / lookups if lookups else 0.0,
+        }
+
+'''
+CachedEmbeddings puts an EmbeddingCache in front of an embedder (e.g. BatchedEmbeddings).
+Only the texts missing from the cache are sent to the embedder, once per distinct text
+'''
+class CachedEmbeddings:
+    def __init__(self, embeddings, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        texts = list(texts)
+        embeddings = self.cache.get_many(texts)
+        missing = {}
+        for i, vector in enumerate(embeddings):
+            if vector is None:
+                missing.setdefault(self.cache.key(texts[i]), []).append(i)
+        if missing:
+            unique_texts = [texts[indexes[0]] for indexes in missing.values()]
+            vectors = self.embeddings.embed_documents(unique_texts)
+            self.cache.set_many(unique_texts, vectors)
+            for indexes, vector in zip(missing.values(), vectors):
+                for i in indexes:
+                    embeddings[i] = vector
+        return embeddings
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vector = self.cache.get_many([text])[0]
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            self.cache.set_many([text], [vector])
+        return vector
@@ -0,0 +1,56 @@
+"""Incremental CSV and Parquet export of paged rows."""
+import csv
+from typing import IO, Iterable, List, Sequence
+
+# Mime types of the download of each format
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+'''
+writes pages of rows (lists of dicts) to a text file as CSV, the header first then each page
+as it comes, so only one page is ever held in memory. Returns the number of rows written
+'''
+def write_csv(pages: Iterable[List[dict]], file: IO[str], columns: Sequence[str]) -> int:
+    writer = csv.DictWriter(file, fieldnames=list(columns), extrasaction='ignore')
+    writer.writeheader()
+    count = 0
+    for page in pages:
+        writer.writerows(page)
+        count += len(page)
+    return count
+
+'''
+writes pages of rows to a binary file as Parquet, one row group per page, with string
+columns. Needs pyarrow. Returns the number of rows written
+'''
+def write_parquet(pages: Iterable[List[dict]], file: IO[bytes], columns: Sequence[str]) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError(
+            "Could not import pyarrow python package. "
+            "Please install it with `pip install pyarrow`"
+        )
+    schema = pa.schema([(column, pa.string()) for column in columns])
+    count = 0
+    with pq.ParquetWriter(file, schema) as writer:
+        for page in pages:
+            writer.write_table(pa.Table.from_pylist(page, schema=schema))
+            count += len(page)
+    return count
+
+'''
+exports the pages to the file at path in the given format (csv or parquet), returns the
+number of rows written
+'''
+def export_pages(pages: Iterable[List[dict]], path: str, columns: Sequence[str], format: str = "csv") -> int:
+    if format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {format}, expected one of {', '.join(EXPORT_FORMATS)}")
+    if format == "parquet":
+        with open(path, 'wb') as file:
+            return write_parquet(pages, file, columns)
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        return write_csv(pages, file, columns)
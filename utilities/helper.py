@@ -1,19 +1,16 @@
 #get_embeddings_model check for this
 import os
 import openai
-from dotenv import load_dotenv
 import logging
-import re
 import hashlib
+import tempfile
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 
 from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain.llms import AzureOpenAI
 from langchain.vectorstores.base import VectorStore
 from langchain.chains import ChatVectorDBChain
-from langchain.chains import ConversationalRetrievalChain
-from langchain.chains.qa_with_sources import load_qa_with_sources_chain
-from langchain.chains.llm import LLMChain
-from langchain.chains.chat_vector_db.prompts import CONDENSE_QUESTION_PROMPT
 from langchain.prompts import PromptTemplate
 from langchain.document_loaders.base import BaseLoader
 from langchain.document_loaders import WebBaseLoader
@@ -21,19 +18,38 @@ from langchain.text_splitter import TokenTextSplitter, TextSplitter
 from langchain.document_loaders.base import BaseLoader
 from langchain.document_loaders import TextLoader
 from langchain.chat_models import ChatOpenAI
+from langchain.docstore.document import Document
 from langchain.schema import AIMessage, HumanMessage, SystemMessage
 
-from utilities.formrecognizer import AzureFormRecognizerClient
-from utilities.azureblobstorage import AzureBlobStorageClient
-from utilities.translator import AzureTranslatorClient
 from utilities.customprompt import PROMPT
-from utilities.redis import RedisExtended
+from utilities.redis import PROMPT_RESULT_FIELDS, RedisExtended
 from utilities.azuresearch import AzureSearch
+from utilities.numpystore import NumpyVectorStore
+from utilities.answer_cache import AnswerCache
+from utilities.embeddings import DEFAULT_REDIS_TTL, BatchedEmbeddings, CachedEmbeddings, EmbeddingCache
+from utilities.answers import extract_followup_questions, filter_source_links, insert_citations, parse_sources, process_answer, strip_sources
+from utilities.streaming import AnswerStream, stream_completion
+from utilities.orchestration import CondensedQuestionCache, OrchestrationMetrics, RetrievalOrchestrator
+from utilities.reranking import LocalReranker, RerankingRetriever
+from utilities.packing import ContextPacker
+from utilities.batch import BatchRunner, RateLimiter
+from utilities.export import EXPORT_FORMATS, export_pages
+from utilities.ingestion import HALF_CHARACTER_PATTERN, batched, clean_chunks, split_stream, stream_url_text, threaded
+from utilities.registry import env_config, get_client, load_env_once
 
 import pandas as pd
 import urllib
+from typing import TYPE_CHECKING
 
-from fake_useragent import UserAgent
+if TYPE_CHECKING:
+    # The ingestion clients are only imported when first used, see the properties of LLMHelper
+    from fake_useragent import UserAgent
+    from utilities.formrecognizer import AzureFormRecognizerClient
+    from utilities.azureblobstorage import AzureBlobStorageClient
+    from utilities.translator import AzureTranslatorClient
+
+# Columns of the document listings
+DOCUMENT_FIELDS = ('key', 'filename', 'source', 'content', 'metadata')
 
 class LLMHelper:
     def __init__(self,
@@ -46,12 +62,12 @@ class LLMHelper:
         custom_prompt: str = "",
         vector_store: VectorStore = None,
         k: int = None,
-        pdf_parser: AzureFormRecognizerClient = None,
-        blob_client: AzureBlobStorageClient = None,
+        pdf_parser: 'AzureFormRecognizerClient' = None,
+        blob_client: 'AzureBlobStorageClient' = None,
         enable_translation: bool = False,
-        translator: AzureTranslatorClient = None):
+        translator: 'AzureTranslatorClient' = None):
 
-        load_dotenv()
+        load_env_once()
         openai.api_type = "azure"
         openai.api_base = os.getenv('OPENAI_API_BASE')
         openai.api_version = "2023-03-15-preview"
@@ -66,6 +82,8 @@ class LLMHelper:
         self.deployment_type: str = os.getenv("OPENAI_DEPLOYMENT_TYPE", "Text")
         self.temperature: float = float(os.getenv("OPENAI_TEMPERATURE", 0.7)) if temperature is None else temperature
         self.max_tokens: int = int(os.getenv("OPENAI_MAX_TOKENS", -1)) if max_tokens is None else max_tokens
+        # Context size of the model of the deployment, bounds the text completions streamed with max_tokens -1
+        self.context_size: int = int(os.getenv("OPENAI_CONTEXT_SIZE", 4097))
         self.prompt = PROMPT if custom_prompt == '' else PromptTemplate(template=custom_prompt, input_variables=["summaries", "question"])
         self.vector_store_type = os.getenv("VECTOR_STORE_TYPE")
 
@@ -74,6 +92,11 @@ class LLMHelper:
             self.vector_store_address: str = os.getenv('AZURE_SEARCH_SERVICE_NAME')
             self.vector_store_password: str = os.getenv('AZURE_SEARCH_ADMIN_KEY')
 
+        # In-process store, kept in memory or persisted (memory-mapped) under NUMPY_STORE_PATH
+        elif self.vector_store_type == "NumPy":
+            self.vector_store_address: str = os.getenv('NUMPY_STORE_PATH')
+            self.vector_store_password: str = None
+
         else:
             # Vector store settings
             self.vector_store_address: str = os.getenv('REDIS_ADDRESS', "localhost")
@@ -88,79 +111,207 @@ class LLMHelper:
 
         self.chunk_size = int(os.getenv('CHUNK_SIZE', 500))
         self.chunk_overlap = int(os.getenv('CHUNK_OVERLAP', 100))
+        self.incremental_ingestion: bool = os.getenv('INCREMENTAL_INGESTION', 'true').lower() == 'true'
+        self.streaming_ingestion: bool = os.getenv('STREAMING_INGESTION', 'true').lower() == 'true'
+        self.ingestion_queue_size = int(os.getenv('INGESTION_QUEUE_SIZE', 64))
         self.document_loaders: BaseLoader = WebBaseLoader if document_loaders is None else document_loaders
         self.text_splitter: TextSplitter = TokenTextSplitter(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap) if text_splitter is None else text_splitter
-        self.embeddings: OpenAIEmbeddings = OpenAIEmbeddings(model=self.model, chunk_size=1) if embeddings is None else embeddings
+        self.embeddings_batch_size = int(os.getenv('EMBEDDINGS_BATCH_SIZE', 16))
+        self.embeddings_batch_tokens = int(os.getenv('EMBEDDINGS_BATCH_TOKENS', 8000))
+        self.embeddings_max_concurrency = int(os.getenv('EMBEDDINGS_MAX_CONCURRENCY', 4))
+        # The clients are built once per worker process and configuration, and shared by every LLMHelper with the same settings
+        openai_config = (openai.api_base, openai.api_key)
+        embeddings_config = (self.model, self.embeddings_batch_size, *openai_config)
+        self.embeddings: OpenAIEmbeddings = get_client('embeddings', embeddings_config, lambda: OpenAIEmbeddings(model=self.model, chunk_size=self.embeddings_batch_size)) if embeddings is None else embeddings
+        # The clients built on given embeddings are not shared with the other helpers
+        shared_client = get_client if embeddings is None else (lambda name, config, factory: factory())
+        # Embeddings cache shared by the ingestion and the query paths, its Redis entries expire after EMBEDDINGS_CACHE_TTL seconds (0 keeps them until Redis evicts them)
+        embedding_cache_config = (*embeddings_config, self.embeddings_batch_tokens, self.embeddings_max_concurrency, *env_config('EMBEDDINGS_CACHE_SIZE', 'EMBEDDINGS_CACHE_TTL'))
+        build_batched_embeddings = lambda: CachedEmbeddings(
+            BatchedEmbeddings(self.embeddings.embed_documents, max_batch_size=self.embeddings_batch_size, max_batch_tokens=self.embeddings_batch_tokens, max_concurrency=self.embeddings_max_concurrency, aembed_batch=getattr(self.embeddings, 'aembed_documents', None)),
+            EmbeddingCache(self.model, max_entries=int(os.getenv('EMBEDDINGS_CACHE_SIZE', 10000)), redis_ttl=int(os.getenv('EMBEDDINGS_CACHE_TTL', DEFAULT_REDIS_TTL)) or None))
+        self.batched_embeddings = shared_client('batched_embeddings', embedding_cache_config, build_batched_embeddings)
+        self.embedding_cache: EmbeddingCache = self.batched_embeddings.cache
+        llm_config = (self.deployment_type, self.deployment_name, self.temperature, self.max_tokens, *openai_config)
         if self.deployment_type == "Chat":
-            self.llm: ChatOpenAI = ChatOpenAI(model_name=self.deployment_name, engine=self.deployment_name, temperature=self.temperature, max_tokens=self.max_tokens if self.max_tokens != -1 else None) if llm is None else llm
+            self.llm: ChatOpenAI = get_client('llm', llm_config, lambda: ChatOpenAI(model_name=self.deployment_name, engine=self.deployment_name, temperature=self.temperature, max_tokens=self.max_tokens if self.max_tokens != -1 else None)) if llm is None else llm
         else:
-            self.llm: AzureOpenAI = AzureOpenAI(deployment_name=self.deployment_name, temperature=self.temperature, max_tokens=self.max_tokens) if llm is None else llm
+            self.llm: AzureOpenAI = get_client('llm', llm_config, lambda: AzureOpenAI(deployment_name=self.deployment_name, temperature=self.temperature, max_tokens=self.max_tokens)) if llm is None else llm
+        vector_store_config = (self.vector_store_type, self.vector_store_address, self.vector_store_password, self.index_name, *embedding_cache_config)
         if self.vector_store_type == "AzureSearch":
-            self.vector_store: VectorStore = AzureSearch(azure_cognitive_search_name=self.vector_store_address, azure_cognitive_search_key=self.vector_store_password, index_name=self.index_name, embedding_function=self.embeddings.embed_query) if vector_store is None else vector_store
+            self.vector_store: VectorStore = shared_client('vector_store', vector_store_config, lambda: AzureSearch(azure_cognitive_search_name=self.vector_store_address, azure_cognitive_search_key=self.vector_store_password, index_name=self.index_name, embedding_function=self.batched_embeddings.embed_query, async_embedding_function=self.batched_embeddings.aembed_query)) if vector_store is None else vector_store
+        elif self.vector_store_type == "NumPy":
+            self.vector_store: NumpyVectorStore = shared_client('vector_store', vector_store_config, lambda: NumpyVectorStore(embedding_function=self.batched_embeddings.embed_query, path=self.vector_store_address)) if vector_store is None else vector_store
         else:
-            self.vector_store: RedisExtended = RedisExtended(redis_url=self.vector_store_full_address, index_name=self.index_name, embedding_function=self.embeddings.embed_query) if vector_store is None else vector_store   
+            self.vector_store: RedisExtended = shared_client('vector_store', (*vector_store_config, self.vector_store_full_address), lambda: RedisExtended(redis_url=self.vector_store_full_address, index_name=self.index_name, embedding_function=self.batched_embeddings.embed_query)) if vector_store is None else vector_store   
+            # Second cache tier on the same Redis connection
+            if os.getenv('EMBEDDINGS_CACHE_REDIS', 'true').lower() == 'true' and isinstance(self.vector_store, RedisExtended):
+                self.embedding_cache.set_redis_client(self.vector_store.client)
         self.k : int = 3 if k is None else k
 
-        self.pdf_parser : AzureFormRecognizerClient = AzureFormRecognizerClient() if pdf_parser is None else pdf_parser
-        self.blob_client: AzureBlobStorageClient = AzureBlobStorageClient() if blob_client is None else blob_client
-        self.enable_translation : bool = False if enable_translation is None else enable_translation
-        self.translator : AzureTranslatorClient = AzureTranslatorClient() if translator is None else translator
-
-        self.user_agent: UserAgent() = UserAgent()
-        self.user_agent.random
+        # Retrieval for the raw follow-up question starts while it is condensed when the history has at most this many turns (0 disables it)
+        self.speculative_retrieval_turns = int(os.getenv('SPECULATIVE_RETRIEVAL_TURNS', 2))
+        self.speculative_retrieval_threshold = float(os.getenv('SPECULATIVE_RETRIEVAL_THRESHOLD', 0.95))
+
+        # The retrieval asks the vector store for oversample * k chunks and reranks them locally (cosine similarity, score threshold, MMR) down to k
+        self.local_rerank: bool = os.getenv('LOCAL_RERANK', 'true').lower() == 'true'
+        self.search_type: str = os.getenv('SEARCH_TYPE', 'similarity')
+        self.rerank_oversample = int(os.getenv('RERANK_OVERSAMPLE', 5))
+        self.rerank_mmr_lambda = float(os.getenv('RERANK_MMR_LAMBDA', 0.7))
+        self.rerank_score_threshold = float(os.getenv('RERANK_SCORE_THRESHOLD')) if os.getenv('RERANK_SCORE_THRESHOLD') else None
+
+        # Token budget of the chunks in the answer prompt (0: no budget), chunks mostly contained in the ones already packed are dropped
+        self.context_max_tokens = int(os.getenv('CONTEXT_MAX_TOKENS', 2000))
+        self.context_duplicate_threshold = float(os.getenv('CONTEXT_DUPLICATE_THRESHOLD', 0.8))
+
+        # Prompts run on many documents: requests in flight and the per minute quotas of the deployment (not limited when unset)
+        self.batch_max_workers = int(os.getenv('BATCH_MAX_WORKERS', 8))
+        self.batch_max_retries = int(os.getenv('BATCH_MAX_RETRIES', 6))
+        self.requests_per_minute = float(os.getenv('OPENAI_REQUESTS_PER_MINUTE', 0)) or None
+        self.tokens_per_minute = float(os.getenv('OPENAI_TOKENS_PER_MINUTE', 0)) or None
+
+        # Answers of the recent questions, looked up by similarity of the condensed question
+        self.answer_cache_validate: bool = os.getenv('ANSWER_CACHE_VALIDATE', 'true').lower() == 'true'
+        if os.getenv('ANSWER_CACHE_ENABLED', 'true').lower() == 'true':
+            self.answer_cache: AnswerCache = get_client('answer_cache', env_config('ANSWER_CACHE_THRESHOLD', 'ANSWER_CACHE_SIZE', 'ANSWER_CACHE_TTL'), lambda: AnswerCache(
+                threshold=float(os.getenv('ANSWER_CACHE_THRESHOLD', 0.97)), max_entries=int(os.getenv('ANSWER_CACHE_SIZE', 1000)), ttl=int(os.getenv('ANSWER_CACHE_TTL', 3600)) or None))
+        else:
+            self.answer_cache = None
 
-    def add_embeddings_preprocess(self, source_url):
+        # Only needed to ingest documents, created on first access so chat requests do not pay for them
+        self._pdf_parser = pdf_parser
+        self._blob_client = blob_client
+        self.enable_translation : bool = False if enable_translation is None else enable_translation
+        self._translator = translator
+        self._user_agent = None
+
+    @property
+    def pdf_parser(self) -> 'AzureFormRecognizerClient':
+        if self._pdf_parser is None:
+            from utilities.formrecognizer import AzureFormRecognizerClient
+            self._pdf_parser = get_client('pdf_parser', env_config('FORM_RECOGNIZER_ENDPOINT', 'FORM_RECOGNIZER_KEY'), AzureFormRecognizerClient)
+        return self._pdf_parser
+
+    @property
+    def blob_client(self) -> 'AzureBlobStorageClient':
+        if self._blob_client is None:
+            from utilities.azureblobstorage import AzureBlobStorageClient
+            self._blob_client = get_client('blob_client', env_config('BLOB_ACCOUNT_NAME', 'BLOB_ACCOUNT_KEY', 'BLOB_CONTAINER_NAME'), AzureBlobStorageClient)
+        return self._blob_client
+
+    @property
+    def translator(self) -> 'AzureTranslatorClient':
+        if self._translator is None:
+            from utilities.translator import AzureTranslatorClient
+            self._translator = get_client('translator', env_config('TRANSLATE_ENDPOINT', 'TRANSLATE_KEY', 'TRANSLATE_REGION'), AzureTranslatorClient)
+        return self._translator
+
+    @property
+    def user_agent(self) -> 'UserAgent':
+        if self._user_agent is None:
+            from fake_useragent import UserAgent
+            self._user_agent = get_client('user_agent', (), UserAgent)
+            self._user_agent.random
+        return self._user_agent
+
+    def add_embeddings_preprocess(self, source_url, incremental: bool = None):
+        incremental = self.incremental_ingestion if incremental is None else incremental
         try:
-            documents = self.document_loaders(source_url).load()
-            
-            # Convert to UTF-8 encoding for non-ascii text
-            for(document) in documents:
-                try:
-                    if document.page_content.encode("iso-8859-1") == document.page_content.encode("latin-1"):
-                        document.page_content = document.page_content.encode("iso-8859-1").decode("utf-8", errors="ignore")
-                except:
-                    pass
-                
-            docs = self.text_splitter.split_documents(documents)
-            
-            # Remove half non-ascii character from start/end of doc content (langchain TokenTextSplitter may split a non-ascii character in half)
-            pattern = re.compile(r'[\x00-\x09\x0b\x0c\x0e-\x1f\x7f\u0080-\u00a0\u2000-\u3000\ufff0-\uffff]')  # do not remove \x0a (\n) nor \x0d (\r)
-            for(doc) in docs:
-                doc.page_content = re.sub(pattern, '', doc.page_content)
-                if doc.page_content == '':
-                    docs.remove(doc)
-            
-            keys = []
-            for i, doc in enumerate(docs):
-                # Create a unique key for the document
-                source_url = source_url.split('?')[0]
-                filename = "/".join(source_url.split('/')[4:])
-                hash_key = hashlib.sha1(f"{source_url}_{i}".encode('utf-8')).hexdigest()
-                hash_key = f"doc:{self.index_name}:{hash_key}"
-                keys.append(hash_key)
-                doc.metadata = {"source": f"[{source_url}]({source_url}_SAS_TOKEN_PLACEHOLDER_)" , "chunk": i, "key": hash_key, "filename": filename}
-            if self.vector_store_type == 'AzureSearch':
-                self.vector_store.add_documents(documents=docs, keys=keys)
-            else:
-                self.vector_store.add_documents(documents=docs, redis_url=self.vector_store_full_address,  index_name=self.index_name, keys=keys)
-            
+            load_url = source_url
+            source_url = source_url.split('?')[0]
+            filename = "/".join(source_url.split('/')[4:])
+
+            # Drop the chunks that are not in the file anymore (including the ones stored with the keys of
+            # the previous releases), and in incremental mode only upload the chunks that are not stored yet
+            existing_keys = set(self.vector_store.get_file_keys(filename))
+            keys = set()
+            report = {"filename": filename, "added": 0, "skipped": 0, "removed": 0}
+
+            # load -> split -> clean, every stage runs in its own thread behind a bounded queue
+            chunks = threaded(clean_chunks(threaded(self.load_chunks(load_url), maxsize=self.ingestion_queue_size)), maxsize=self.ingestion_queue_size)
+
+            def new_documents():
+                for i, chunk in enumerate(chunks):
+                    # Create a key from the file and the chunk content, so an unchanged chunk keeps its key wherever it moves in the file
+                    hash_key = self.get_chunk_key(filename, chunk)
+                    if hash_key in keys:
+                        continue
+                    keys.add(hash_key)
+                    if incremental and hash_key in existing_keys:
+                        report["skipped"] += 1
+                        continue
+                    yield Document(page_content=chunk, metadata={"source": f"[{source_url}]({source_url}_SAS_TOKEN_PLACEHOLDER_)" , "chunk": i, "key": hash_key, "filename": filename})
+
+            def embedded_batches():
+                # Embed the chunks in a few batched requests instead of one request per chunk
+                for batch in batched(new_documents(), self.embeddings_batch_size * self.embeddings_max_concurrency):
+                    yield batch, self.batched_embeddings.embed_documents([doc.page_content for doc in batch])
+
+            # -> embed -> upload, the next batch is embedded while the previous one is uploaded
+            # (a store with batch(), the NumPy one, is written to disk once for the whole file)
+            with getattr(self.vector_store, 'batch', contextlib.nullcontext)():
+                for new_docs, embeddings in threaded(embedded_batches(), maxsize=2):
+                    new_keys = [doc.metadata['key'] for doc in new_docs]
+                    if self.vector_store_type in ('AzureSearch', 'NumPy'):
+                        self.vector_store.add_documents(documents=new_docs, keys=new_keys, embeddings=embeddings)
+                    else:
+                        self.vector_store.add_documents(documents=new_docs, redis_url=self.vector_store_full_address,  index_name=self.index_name, keys=new_keys, embeddings=embeddings)
+                    report["added"] += len(new_docs)
+
+                stale_keys = list(existing_keys - keys)
+                if stale_keys:
+                    self.vector_store.delete_keys(stale_keys)
+            report["removed"] = len(stale_keys)
+            if self.answer_cache is not None and (report["added"] or report["removed"]):
+                self.answer_cache.invalidate_files([filename])
+
+            logging.info(f"Embeddings for {filename}: {report['added']} added, {report['skipped']} skipped, {report['removed']} removed")
+            return report
+
         except Exception as e:
             logging.error(f"Error adding embeddings for {source_url}: {e}")
             raise e
 
+    # yields the text chunks of a source, plain text is streamed from the url unless a custom document loader was given
+    def load_chunks(self, source_url):
+        if self.document_loaders is WebBaseLoader and self.streaming_ingestion:
+            segments = stream_url_text(source_url)
+            # Other content types (e.g. HTML) are loaded by WebBaseLoader, which extracts their text
+            if segments is not None:
+                yield from split_stream(segments, self.text_splitter)
+                return
+
+        documents = self.document_loaders(source_url).load()
+        # Convert to UTF-8 encoding for non-ascii text
+        for(document) in documents:
+            try:
+                if document.page_content.encode("iso-8859-1") == document.page_content.encode("latin-1"):
+                    document.page_content = document.page_content.encode("iso-8859-1").decode("utf-8", errors="ignore")
+            except:
+                pass
+        for doc in self.text_splitter.split_documents(documents):
+            yield doc.page_content
+
+    # chunk keys are doc:{index_name}:{sha1(filename)}:{sha1(content)}, RedisExtended relies on the file prefix to find the chunks of a file
+    def get_chunk_key(self, filename, content):
+        file_hash = hashlib.sha1(filename.encode('utf-8')).hexdigest()
+        content_hash = hashlib.sha1(content.encode('utf-8')).hexdigest()
+        return f"doc:{self.index_name}:{file_hash}:{content_hash}"
+
     def file_conversion_add_embeddings_preprocess(self, source_url, filename, enable_translation=False):
         # Extract the text from the file
         text = self.pdf_parser.analyze_read(source_url)
         # Translate if requested
-        converted_text = list(map(lambda x: self.translator.translate(x), text)) if self.enable_translation else text
+        converted_text = map(lambda x: self.translator.translate(x), text) if self.enable_translation else text
 
-        # Remove half non-ascii character from start/end of doc content (langchain TokenTextSplitter may split a non-ascii character in half)
-        pattern = re.compile(r'[\x00-\x09\x0b\x0c\x0e-\x1f\x7f\u0080-\u00a0\u2000-\u3000\ufff0-\uffff]')  # do not remove \x0a (\n) nor \x0d (\r)
-        converted_text = re.sub(pattern, '', "\n".join(converted_text))
+        # Remove half non-ascii character from start/end of doc content and stream the "\n" joined sections instead of building one string
+        def converted_sections():
+            for i, section in enumerate(converted_text):
+                yield (("\n" if i else "") + HALF_CHARACTER_PATTERN.sub('', section)).encode('utf-8')
 
         # Upload the text to Azure Blob Storage
         converted_filename = f"converted/{filename}.txt"
-        source_url = self.blob_client.upload_file(converted_text, f"converted/{filename}.txt", content_type='text/plain; charset=utf-8')
+        source_url = self.blob_client.upload_file(converted_sections(), f"converted/{filename}.txt", content_type='text/plain; charset=utf-8')
 
         print(f"Converted file uploaded to {source_url} with filename {filename}")
         # Update the metadata to indicate that the file has been converted
@@ -170,48 +321,194 @@ class LLMHelper:
 
         return converted_filename
 
-    def get_all_documents(self, k: int = None):
-        result = self.vector_store.similarity_search(query="*", k= k if k else self.k)
-        dataFrame = pd.DataFrame(list(map(lambda x: {
-                'key': x.metadata['key'],
-                'filename': x.metadata['filename'],
-                'source': urllib.parse.unquote(x.metadata['source']), 
-                'content': x.page_content, 
-                'metadata' : x.metadata,
-                }, result)))
-        if dataFrame.empty is False:
+    # deletes the embeddings of a file through the per file index of the vector store, returns the number of chunks deleted
+    def delete_file_embeddings(self, filename):
+        count = self.vector_store.delete_file(filename)
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate_files([filename])
+        return count
+
+    # deletes every chunk of the index (not only the listed ones), the cached answers are all built from them
+    def delete_all_embeddings(self):
+        count = self.vector_store.delete_all()
+        if self.answer_cache is not None:
+            self.answer_cache.clear()
+        return count
+
+    # pages of the stored chunks as DataFrames with only the requested columns, read lazily from the index
+    def iter_documents(self, fields=DOCUMENT_FIELDS, page_size: int = 1000, filenames=None):
+        for page in self.vector_store.iter_document_pages(fields=fields, page_size=page_size, filenames=filenames):
+            dataFrame = pd.DataFrame(page, columns=list(fields))
+            if 'source' in dataFrame:
+                dataFrame['source'] = dataFrame['source'].map(lambda x: urllib.parse.unquote(x) if x else x)
+            yield dataFrame
+
+    # runs a prompt on every chunk of the files with the batch runner, the results are written to Redis by a buffered writer, in
+    # transactions of flush_size results or every second. Running the same prompt on the same files again (e.g. after a crash) skips the chunks already done
+    def run_prompt_batch(self, prompt, filenames, flush_size: int = 100):
+        job = hashlib.sha1("\n".join([self.deployment_name, prompt, *sorted(filenames)]).encode('utf-8')).hexdigest()
+        completed = self.vector_store.start_prompt_job(job)
+
+        # The keys are resolved up front from the per file sets, the contents are read slice by slice as the runner submits them
+        keys = [(key, filename) for filename in filenames for key in sorted(self.vector_store.get_file_keys(filename)) if key not in completed]
+
+        def items():
+            for batch in batched(keys, 2 * self.batch_max_workers):
+                for (key, filename), content in zip(batch, self.vector_store.get_contents([key for key, _ in batch])):
+                    if content is not None:
+                        yield key, f"{content}\n{prompt}\n\n", filename
+
+        # One limiter per deployment, shared by every batch of the worker
+        rate_limiter = get_client(f'rate_limiter:{self.deployment_name}', (self.requests_per_minute, self.tokens_per_minute), lambda: RateLimiter(self.requests_per_minute, self.tokens_per_minute))
+        # The runner retries the throttled requests through the limiter, the client must not retry them on its own
+        llm = self.llm.copy(update={'max_retries': 0}) if hasattr(self.llm, 'max_retries') else self.llm
+        runner = BatchRunner(lambda prompt: self.get_completion(prompt, llm=llm), rate_limiter=rate_limiter, max_workers=self.batch_max_workers, max_retries=self.batch_max_retries, completion_tokens=self.max_tokens if self.max_tokens != -1 else 256)
+        with self.vector_store.prompt_result_writer(job=job, max_batch_size=flush_size, transaction=True) as writer:
+            for key, response, filename in runner.run(items()):
+                writer.add(key, response.encode().decode(), filename, prompt)
+        stats = {**runner.stats(), "skipped": len(completed)}
+        logging.info(f"Prompt batch {job}: {stats}")
+        return stats
+
+    # writes every prompt result to the file at path as csv or parquet, page by page in the order of their ids, returns the number of rows
+    def export_prompt_results(self, path, format="csv", page_size: int = 1000):
+        return export_pages(self.vector_store.iter_prompt_result_pages(page_size=page_size), path, PROMPT_RESULT_FIELDS, format=format)
+
+    # exports the prompt results to a temporary file and uploads it to the blob storage, returns its SAS url so the results are downloaded from the storage and never held in memory
+    def upload_prompt_results(self, format="csv", page_size: int = 1000):
+        fd, path = tempfile.mkstemp(suffix=f".{format}")
+        os.close(fd)
+        try:
+            self.export_prompt_results(path, format=format, page_size=page_size)
+            with open(path, 'rb') as data:
+                return self.blob_client.upload_file(data, f"prompt-results/{hashlib.sha1(os.urandom(16)).hexdigest()}.{format}", content_type=EXPORT_FORMATS[format])
+        finally:
+            os.remove(path)
+
+    # lists the stored chunks (at most k of them, self.k when k is None, all of them when k is -1), pass fields=('key', 'filename') when the contents are not needed
+    def get_all_documents(self, k: int = None, fields=DOCUMENT_FIELDS, filenames=None):
+        k = self.k if k is None else (None if k == -1 else k)
+        pages, count = [], 0
+        for page in self.iter_documents(fields=fields, page_size=min(k, 1000) if k else 1000, filenames=filenames):
+            pages.append(page if k is None else page.head(k - count))
+            count += len(pages[-1])
+            if k is not None and count >= k:
+                break
+        dataFrame = pd.concat(pages, ignore_index=True) if pages else pd.DataFrame(columns=list(fields))
+        if dataFrame.empty is False and 'filename' in dataFrame:
             dataFrame = dataFrame.sort_values(by='filename')
         return dataFrame
 
-    def get_semantic_answer_lang_chain(self, question, chat_history):
-        question_generator = LLMChain(llm=self.llm, prompt=CONDENSE_QUESTION_PROMPT, verbose=False)
-        doc_chain = load_qa_with_sources_chain(self.llm, chain_type="stuff", verbose=False, prompt=self.prompt)
-        chain = ConversationalRetrievalChain(
-            retriever=self.vector_store.as_retriever(),
-            question_generator=question_generator,
-            combine_docs_chain=doc_chain,
-            return_source_documents=True,
-            # top_k_docs_for_context= self.k
+    # fingerprint of the chunks stored for a file, changes whenever the file is re-ingested with a different content or deleted
+    def get_file_fingerprint(self, filename):
+        return hashlib.sha1("\n".join(sorted(self.vector_store.get_file_keys(filename))).encode('utf-8')).hexdigest()
+
+    def is_cached_answer_valid(self, files):
+        return all(self.get_file_fingerprint(filename) == fingerprint for filename, fingerprint in files.items())
+
+    def get_retriever(self):
+        if not self.local_rerank:
+            return self.vector_store.as_retriever(search_kwargs={"k": self.k})
+        reranker = LocalReranker(self.batched_embeddings.embed_query, self.batched_embeddings.embed_documents, mmr_lambda=self.rerank_mmr_lambda, score_threshold=self.rerank_score_threshold, get_vectors=getattr(self.vector_store, 'get_vectors', None))
+        return RerankingRetriever(self.vector_store, reranker, k=self.k, oversample=self.rerank_oversample, search_type=self.search_type)
+
+    def get_orchestrator(self):
+        return RetrievalOrchestrator(
+            self.llm, self.get_retriever(), self.prompt,
+            scope=self.deployment_name,
+            condensed_questions=get_client('condensed_questions', env_config('CONDENSED_QUESTIONS_CACHE_SIZE'), lambda: CondensedQuestionCache(int(os.getenv('CONDENSED_QUESTIONS_CACHE_SIZE', 1000)))),
+            metrics=get_client('orchestration_metrics', (), OrchestrationMetrics),
+            executor=get_client('retrieval_executor', (), lambda: ThreadPoolExecutor(max_workers=4, thread_name_prefix='retrieval')) if self.speculative_retrieval_turns > 0 else None,
+            embed_query=self.batched_embeddings.embed_query,
+            speculative_max_turns=self.speculative_retrieval_turns,
+            speculative_threshold=self.speculative_retrieval_threshold,
+            packer=ContextPacker(self.context_max_tokens or None, duplicate_threshold=self.context_duplicate_threshold),
         )
-        result = chain({"question": question, "chat_history": chat_history})
-        sources = "\n".join(set(map(lambda x: x.metadata["source"], result['source_documents'])))
+
+    # returns the cached {"answer", "source_documents"} of a standalone question (None on a miss) and the key to store it with
+    def lookup_answer(self, condensed_question):
+        if self.answer_cache is None:
+            return None, None
+        question_embedding = self.batched_embeddings.embed_query(condensed_question)
+        scope = (self.deployment_name, self.temperature, self.max_tokens, self.prompt.template, self.index_name)
+        result = self.answer_cache.lookup(question_embedding, scope, validate=self.is_cached_answer_valid if self.answer_cache_validate else None)
+        return result, (question_embedding, scope)
+
+    def store_answer(self, cache_key, result):
+        if self.answer_cache is None:
+            return
+        question_embedding, scope = cache_key
+        filenames = {doc.metadata['filename'] for doc in result['source_documents'] if 'filename' in doc.metadata}
+        files = {filename: self.get_file_fingerprint(filename) for filename in filenames} if self.answer_cache_validate else dict.fromkeys(filenames)
+        self.answer_cache.store(question_embedding, result, scope, files=files)
+
+    # returns the context (cleaned contents by source) and the sources of the documents an answer was built from
+    def format_sources(self, source_documents):
+        sources = "\n".join(set(map(lambda x: x.metadata["source"], source_documents)))
 
         container_sas = self.blob_client.get_container_sas()
 
         contextDict ={}
-        for res in result['source_documents']:
+        for res in source_documents:
             source_key = self.filter_sourcesLinks(res.metadata['source'].replace('_SAS_TOKEN_PLACEHOLDER_', container_sas)).replace('\n', '').replace(' ', '')
             if source_key not in contextDict:
                 contextDict[source_key] = []
             myPageContent = self.clean_encoding(res.page_content)
             contextDict[source_key].append(myPageContent)
-        
-        result['answer'] = result['answer'].split('SOURCES:')[0].split('Sources:')[0].split('SOURCE:')[0].split('Source:')[0]
-        result['answer'] = self.clean_encoding(result['answer'])
+
         sources = sources.replace('_SAS_TOKEN_PLACEHOLDER_', container_sas)
         sources = self.filter_sourcesLinks(sources)
+        return contextDict, sources
 
-        return question, result['answer'], contextDict, sources
+    def get_semantic_answer_lang_chain(self, question, chat_history):
+        with self.get_orchestrator().run() as run:
+            # Condense the question first (first turns are not condensed), the answer cache is keyed on the standalone question
+            condensed_question = run.condense(question, chat_history)
+
+            result, cache_key = self.lookup_answer(condensed_question)
+            if result is None:
+                source_documents = run.pack(run.retrieve(condensed_question))
+                result = {"answer": run.combine(source_documents, condensed_question), "source_documents": source_documents}
+                self.store_answer(cache_key, result)
+        logging.debug(f"Chat request: {run.llm_calls} LLM calls, {run.prompt_tokens} prompt tokens, {run.latency:.2f}s")
+
+        contextDict, sources = self.format_sources(result['source_documents'])
+        answer = self.clean_encoding(strip_sources(result['answer']))
+
+        return question, answer, contextDict, sources
+
+    retrieve_semantic_response = get_semantic_answer_lang_chain
+
+    '''
+    streams the answer of a chat request as (event, data) pairs: a "sources" event with the
+    context and the sources as soon as the documents are retrieved, then "token" events with
+    the answer as it is generated, then a "done" event with the complete answer
+    '''
+    def stream_semantic_answer(self, question, chat_history):
+        with self.get_orchestrator().run() as run:
+            condensed_question = run.condense(question, chat_history)
+
+            result, cache_key = self.lookup_answer(condensed_question)
+            source_documents = result['source_documents'] if result is not None else run.pack(run.retrieve(condensed_question))
+            contextDict, sources = self.format_sources(source_documents)
+            yield "sources", {"question": question, "context": contextDict, "sources": sources}
+
+            if result is not None:
+                answer = self.clean_encoding(AnswerStream([result['answer']]).answer)
+                yield "token", answer
+            else:
+                # Same prompt as the "stuff" chain of RetrievalOrchestrator.combine
+                answer_stream = AnswerStream(self.get_completion(run.format_prompt(source_documents, condensed_question), stream=True))
+                run.llm_calls += 1
+                for token in answer_stream:
+                    yield "token", self.clean_encoding(token)
+                self.store_answer(cache_key, {"answer": answer_stream.text, "source_documents": source_documents})
+                answer = self.clean_encoding(answer_stream.answer)
+        yield "done", {"question": question, "response": answer, "context": contextDict, "sources": sources}
+
+    # LLM calls per request and latency percentiles of the chat requests served by this worker
+    def get_orchestration_stats(self):
+        return get_client('orchestration_metrics', (), OrchestrationMetrics).stats()
 
     def get_embeddings_model(self):
         OPENAI_EMBEDDINGS_ENGINE_DOC = os.getenv('OPENAI_EMEBDDINGS_ENGINE', os.getenv('OPENAI_EMBEDDINGS_ENGINE_DOC', 'text-embedding-ada-002'))  
@@ -221,118 +518,37 @@ class LLMHelper:
             "query": OPENAI_EMBEDDINGS_ENGINE_QUERY
         }
 
-    def get_completion(self, prompt, **kwargs):
+    def get_completion(self, prompt, stream=False, llm=None, **kwargs):
+        # stream returns an iterator over the tokens as they are generated
+        if stream:
+            return stream_completion(prompt, self.deployment_name, self.deployment_type, temperature=self.temperature, max_tokens=self.max_tokens, context_size=self.context_size, **kwargs)
+        # llm replaces the client of the helper (e.g. a copy without retries for the batches)
+        llm = llm or self.llm
         if self.deployment_type == 'Chat':
-            return self.llm([HumanMessage(content=prompt)]).content
+            return llm([HumanMessage(content=prompt)]).content
         else:
-            return self.llm(prompt)
+            return llm(prompt)
 
     # remove paths from sources to only keep the filename
     def filter_sourcesLinks(self, sources):
-        # use regex to replace all occurences of '[anypath/anypath/somefilename.xxx](the_link)' to '[somefilename](thelink)' in sources
-        pattern = r'\[[^\]]*?/([^/\]]*?)\]'
-
-        match = re.search(pattern, sources)
-        while match:
-            withoutExtensions = match.group(1).split('.')[0] # remove any extension to the name of the source document
-            sources = sources[:match.start()] + f'[{withoutExtensions}]' + sources[match.end():]
-            match = re.search(pattern, sources)
-        
-        sources = '  \n ' + sources.replace('\n', '  \n ') # add a carriage return after each source
-
-        return sources
+        return filter_source_links(sources)
 
     def extract_followupquestions(self, answer):
-        followupTag = answer.find('Follow-up Questions')
-        followupQuestions = answer.find('<<')
-
-        # take min of followupTag and folloupQuestions if not -1 to avoid taking the followup questions if there is no followupTag
-        followupTag = min(followupTag, followupQuestions) if followupTag != -1 and followupQuestions != -1 else max(followupTag, followupQuestions)
-        answer_without_followupquestions = answer[:followupTag] if followupTag != -1 else answer
-        followup_questions = answer[followupTag:].strip() if followupTag != -1 else ''
-
-        # Extract the followup questions as a list
-        pattern = r'\<\<(.*?)\>\>'
-        match = re.search(pattern, followup_questions)
-        followup_questions_list = []
-        while match:
-            followup_questions_list.append(followup_questions[match.start()+2:match.end()-2])
-            followup_questions = followup_questions[match.end():]
-            match = re.search(pattern, followup_questions)
-        
-        if followup_questions_list != '':
-            # Extract follow up question 
-            pattern = r'\d. (.*)'
-            match = re.search(pattern, followup_questions)
-            while match:
-                followup_questions_list.append(followup_questions[match.start()+3:match.end()])
-                followup_questions = followup_questions[match.end():]
-                match = re.search(pattern, followup_questions)
-
-        if followup_questions_list != '':
-            pattern = r'Follow-up Question: (.*)'
-            match = re.search(pattern, followup_questions)
-            while match:
-                followup_questions_list.append(followup_questions[match.start()+19:match.end()])
-                followup_questions = followup_questions[match.end():]
-                match = re.search(pattern, followup_questions)
-        
-        # Special case when 'Follow-up questions:' appears in the answer after the <<
-        followupTag = answer_without_followupquestions.lower().find('follow-up questions')
-        if followupTag != -1:
-            answer_without_followupquestions = answer_without_followupquestions[:followupTag]
-        followupTag = answer_without_followupquestions.lower().find('follow up questions')  # LLM can make variations...
-        if followupTag != -1:
-            answer_without_followupquestions = answer_without_followupquestions[:followupTag]
-
-        return answer_without_followupquestions, followup_questions_list
+        return extract_followup_questions(answer)
 
     # insert citations in the answer - find filenames in the answer maching sources from the filenamelist and replace them with '${(id+1)}'
     def insert_citations_in_answer(self, answer, filenameList):
-
-        filenameList_lowered = [x.lower() for x in filenameList]    # LLM can make case mitakes in returing the filename of the source
-
-        matched_sources = []
-        pattern = r'\[\[(.*?)\]\]'
-        match = re.search(pattern, answer)
-        while match:
-            filename = match.group(1).split('.')[0] # remove any extension to the name of the source document
-            if filename in filenameList:
-                if filename not in matched_sources:
-                    matched_sources.append(filename.lower())
-                filenameIndex = filenameList.index(filename) + 1
-                answer = answer[:match.start()] + '$^{' + f'{filenameIndex}' + '}$' + answer[match.end():]
-            else:
-                answer = answer[:match.start()] + '$^{' + f'{filename.lower()}' + '}$' + answer[match.end():]
-            match = re.search(pattern, answer)
-
-        # When page is reloaded search for references already added to the answer (e.g. '${(id+1)}')
-        for id, filename in enumerate(filenameList_lowered):
-            reference = '$^{' + f'{id+1}' + '}$'
-            if reference in answer and not filename in matched_sources:
-                matched_sources.append(filename)
-
-        return answer, matched_sources, filenameList_lowered
+        return insert_citations(answer, filenameList)
 
     def get_links_filenames(self, answer, sources):
-        split_sources = sources.split('  \n ') # soures are expected to be of format '  \n  [filename1.ext](sourcelink1)  \n [filename2.ext](sourcelink2)  \n  [filename3.ext](sourcelink3)  \n '
-        srcList = []
-        linkList = []
-        filenameList = []
-        for src in split_sources:
-            if src != '':
-                srcList.append(src)
-                link = src[1:].split('(')[1][:-1].split(')')[0] # get the link
-                linkList.append(link)
-                filename = src[1:].split(']')[0] # retrieve the source filename.
-                source_url = link.split('?')[0]
-                answer = answer.replace(source_url, filename)  # if LLM added a path to the filename, remove it from the answer
-                filenameList.append(filename)
-
-        answer, matchedSourcesList, filenameList = self.insert_citations_in_answer(answer, filenameList) # Add (1), (2), (3) to the answer to indicate the source of the answer
-
+        answer, srcList, linkList, filenameList = parse_sources(answer, sources)
+        answer, matchedSourcesList, filenameList = insert_citations(answer, filenameList) # Add (1), (2), (3) to the answer to indicate the source of the answer
         return answer, srcList, matchedSourcesList, linkList, filenameList
 
+    # answer without its sources part and follow-up questions, with its citations, plus the follow-up questions and the sources, in one call
+    def post_process_answer(self, answer, sources):
+        return process_answer(answer, sources)
+
     def clean_encoding(self, text):
         try:
             encoding = 'ISO-8859-1'
@@ -0,0 +1,157 @@
+"""Generator based ingestion stages connected by bounded queues."""
+import codecs
+import logging
+import queue
+import re
+import threading
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import requests
+
+logger = logging.getLogger()
+
+# Remove half non-ascii character from start/end of doc content (langchain TokenTextSplitter may split a non-ascii character in half)
+HALF_CHARACTER_PATTERN = re.compile(r'[\x00-\x09\x0b\x0c\x0e-\x1f\x7f\u0080-\u00a0\u2000-\u3000\ufff0-\uffff]')  # do not remove \x0a (\n) nor \x0d (\r)
+
+_DONE = object()
+
+'''
+runs an iterable in a background thread and hands its items over through a bounded queue,
+so each stage of the pipeline works concurrently while at most maxsize items are buffered
+between two stages. Errors raised by the producer are re-raised in the consumer, and the
+producer stops when the consumer goes away
+'''
+def threaded(iterable: Iterable, maxsize: int = 8) -> Iterator:
+    items = queue.Queue(maxsize)
+    stop = threading.Event()
+    errors = []
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            put(_DONE)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                break
+            yield item
+        if errors:
+            raise errors[0]
+    finally:
+        stop.set()
+
+# Content types streamed from the url, other ones (e.g. HTML) go through the document loader that extracts their text
+STREAMED_CONTENT_TYPES = ("text/plain",)
+
+'''
+opens a url (e.g. a blob SAS url) and returns its text as decoded segments instead of loading
+the whole body, or None (without reading the body) when its content type is not one of
+content_types. Bytes are decoded incrementally with the charset of the response (UTF-8 by
+default), so a character split between two network chunks is not lost
+'''
+def stream_url_text(url: str, chunk_bytes: int = 1 << 16, content_types: Sequence[str] = STREAMED_CONTENT_TYPES) -> Optional[Iterator[str]]:
+    response = requests.get(url, stream=True)
+    try:
+        response.raise_for_status()
+        content_type, _, parameters = response.headers.get('Content-Type', '').partition(';')
+        if content_type.strip().lower() not in content_types:
+            response.close()
+            return None
+    except BaseException:
+        response.close()
+        raise
+    charset = re.search(r'charset=\s*"?([\w.:-]+)', parameters)
+    return _iter_response_text(response, chunk_bytes, charset.group(1) if charset else 'utf-8')
+
+def _iter_response_text(response, chunk_bytes: int, encoding: str) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder(encoding)(errors='ignore')
+    with response:
+        for data in response.iter_content(chunk_size=chunk_bytes):
+            text = decoder.decode(data)
+            if text:
+                yield text
+    text = decoder.decode(b'', final=True)
+    if text:
+        yield text
+
+'''
+splits a stream of text segments with a langchain TextSplitter without joining the whole
+document. The document is cut into windows of window_size characters, at the same offsets
+whatever the sizes of the segments the network delivered. The chunks that reach the end of
+a window (the last ones, which the window may have cut short) are not emitted: the text from
+the start of the first of them is carried over unsplit to the next window, so every window
+starts on a chunk boundary and the chunks are the ones of the document split at once
+'''
+def split_stream(segments: Iterable[str], text_splitter, window_size: int = 1 << 16) -> Iterator[str]:
+    carry = ""
+    buffer, size = [], 0
+    for segment in segments:
+        buffer.append(segment)
+        size += len(segment)
+        while size >= window_size:
+            pending = "".join(buffer)
+            buffer, size = [pending[window_size:]], size - window_size
+            text = carry + pending[:window_size]
+            chunks = text_splitter.split_text(text)
+            if not chunks:
+                carry = ""
+                continue
+            complete, carry = _unsplit_tail(text, chunks)
+            yield from chunks[:complete]
+    remainder = carry + "".join(buffer)
+    if remainder:
+        yield from text_splitter.split_text(remainder)
+
+'''
+returns the number of chunks that end before the end of text and the text from the start of
+the first chunk reaching it. The chunks reaching the end are the last ones, each one is the end
+of the text (of the text without its trailing whitespace for the splitters that strip their
+chunks). The last chunk is carried as is when the splitter rewrote it
+'''
+def _unsplit_tail(text: str, chunks: Sequence[str]) -> Tuple[int, str]:
+    # TokenTextSplitter may start a chunk with half a character, decoded as U+FFFD
+    cores = [chunk.lstrip('\ufffd') for chunk in chunks]
+    end = text if text.endswith(cores[-1]) else text.rstrip()
+    if not cores[-1] or not end.endswith(cores[-1]):
+        return len(chunks) - 1, chunks[-1]
+    first = len(chunks) - 1
+    while first > 0 and cores[first - 1] and end.endswith(cores[first - 1]):
+        first -= 1
+    return first, text[len(end) - len(cores[first]):]
+
+'''
+removes the half characters left by the splitter and drops the chunks that end up empty
+'''
+def clean_chunks(chunks: Iterable[str], pattern=HALF_CHARACTER_PATTERN) -> Iterator[str]:
+    for chunk in chunks:
+        chunk = pattern.sub('', chunk)
+        if chunk != '':
+            yield chunk
+
+def batched(iterable: Iterable, size: int) -> Iterator[List]:
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
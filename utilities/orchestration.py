@@ -0,0 +1,242 @@
+"""Condense -> retrieve -> combine orchestration of the chat requests."""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+import numpy as np
+from langchain.chains.chat_vector_db.prompts import CONDENSE_QUESTION_PROMPT
+from langchain.chains.conversational_retrieval.base import _get_chat_history
+from langchain.chains.llm import LLMChain
+from langchain.chains.qa_with_sources import load_qa_with_sources_chain
+from langchain.docstore.document import Document
+
+from utilities.embeddings import count_tokens
+from utilities.packing import ContextPacker, format_summaries
+
+logger = logging.getLogger()
+
+'''
+thread safe LRU map of the condensed questions, keyed on the conversation so far
+'''
+class CondensedQuestionCache:
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(scope: str, chat_history: str, question: str) -> str:
+        return hashlib.sha256("\x00".join((scope, chat_history, question)).encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+'''
+counters of the chat requests of a worker: LLM calls per request, how the condensation was
+avoided, the prompt tokens of the answers generated and the end-to-end latency percentiles
+over the last window requests
+'''
+class OrchestrationMetrics:
+    def __init__(self, window: int = 1000):
+        self.latencies = deque(maxlen=window)
+        self.llm_calls = deque(maxlen=window)
+        self.prompt_tokens = deque(maxlen=window)
+        self.requests = 0
+        self.condense_skipped = 0
+        self.condense_cache_hits = 0
+        self.speculative_hits = 0
+        self.speculative_misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, run: 'RetrievalRun') -> None:
+        with self._lock:
+            self.requests += 1
+            self.latencies.append(run.latency)
+            self.llm_calls.append(run.llm_calls)
+            if run.prompt_tokens is not None:
+                self.prompt_tokens.append(run.prompt_tokens)
+            self.condense_skipped += run.condense_skipped
+            self.condense_cache_hits += run.condense_cache_hit
+            if run.speculative_used is not None:
+                if run.speculative_used:
+                    self.speculative_hits += 1
+                else:
+                    self.speculative_misses += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = sorted(self.latencies)
+            llm_calls = list(self.llm_calls)
+            prompt_tokens = list(self.prompt_tokens)
+        percentile = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else 0.0
+        return {
+            "requests": self.requests,
+            "llm_calls_per_request": sum(llm_calls) / len(llm_calls) if llm_calls else 0.0,
+            "prompt_tokens_per_answer": sum(prompt_tokens) / len(prompt_tokens) if prompt_tokens else 0.0,
+            "prompt_tokens_max": max(prompt_tokens) if prompt_tokens else 0,
+            "condense_skipped": self.condense_skipped,
+            "condense_cache_hits": self.condense_cache_hits,
+            "speculative_hits": self.speculative_hits,
+            "speculative_misses": self.speculative_misses,
+            "latency_p50": percentile(0.5),
+            "latency_p95": percentile(0.95),
+            "latency_p99": percentile(0.99),
+            "latency_max": latencies[-1] if latencies else 0.0,
+        }
+
+'''
+RetrievalRun is the state of a single request, it counts the LLM calls made for it and the
+tokens of the answer prompt, and records itself in the metrics when the with block ends
+'''
+class RetrievalRun:
+    def __init__(self, orchestrator: 'RetrievalOrchestrator'):
+        self.orchestrator = orchestrator
+        self.llm_calls = 0
+        self.condense_skipped = False
+        self.condense_cache_hit = False
+        self.speculative_used = None
+        self.prompt_tokens = None
+        self.latency = 0.0
+        self._speculative: Optional[Future] = None
+        self._question = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.latency = time.perf_counter() - self._start
+        if self.orchestrator.metrics is not None:
+            self.orchestrator.metrics.record(self)
+        return False
+
+    '''
+    returns the standalone question. First turns are used as is, follow-up questions are
+    condensed with the LLM unless the same conversation was condensed before. When the
+    history is short, retrieval for the raw question starts in the background meanwhile
+    '''
+    def condense(self, question: str, chat_history) -> str:
+        orchestrator = self.orchestrator
+        chat_history_str = _get_chat_history(chat_history) if chat_history else ""
+        if not chat_history_str:
+            self.condense_skipped = True
+            return question
+
+        key = CondensedQuestionCache.key(orchestrator.scope, chat_history_str, question)
+        condensed = orchestrator.condensed_questions.get(key) if orchestrator.condensed_questions is not None else None
+        if condensed is not None:
+            self.condense_cache_hit = True
+            return condensed
+
+        if orchestrator.executor is not None and len(chat_history) <= orchestrator.speculative_max_turns:
+            self._question = question
+            self._speculative = orchestrator.executor.submit(orchestrator.retriever.get_relevant_documents, question)
+
+        condensed = orchestrator.question_generator.run(question=question, chat_history=chat_history_str).strip()
+        self.llm_calls += 1
+        if orchestrator.condensed_questions is not None:
+            orchestrator.condensed_questions.set(key, condensed)
+        return condensed
+
+    def _speculation_matches(self, question: str) -> bool:
+        if " ".join(question.lower().split()) == " ".join(self._question.lower().split()):
+            return True
+        embed_query = self.orchestrator.embed_query
+        if embed_query is None:
+            return False
+        a, b = np.asarray(embed_query(question), dtype=np.float32), np.asarray(embed_query(self._question), dtype=np.float32)
+        similarity = float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b) or 1.0))
+        return similarity >= self.orchestrator.speculative_threshold
+
+    '''
+    returns the documents of the standalone question, reusing the speculative retrieval when
+    the condensed question means the same as the raw one
+    '''
+    def retrieve(self, question: str) -> List[Document]:
+        speculative, self._speculative = self._speculative, None
+        if speculative is not None:
+            self.speculative_used = self._speculation_matches(question)
+            if self.speculative_used:
+                return speculative.result()
+            speculative.cancel()
+        return self.orchestrator.retriever.get_relevant_documents(question)
+
+    '''
+    keeps the retrieved documents that fit in the token budget of the packer, without their
+    overlaps and near duplicates
+    '''
+    def pack(self, documents: List[Document]) -> List[Document]:
+        if self.orchestrator.packer is None:
+            return documents
+        documents, _ = self.orchestrator.packer.pack(documents)
+        return documents
+
+    '''
+    returns the answer prompt of the "stuff" chain for the documents and records its tokens
+    '''
+    def format_prompt(self, documents: List[Document], question: str) -> str:
+        prompt = self.orchestrator.prompt.format(summaries=format_summaries(documents), question=question)
+        self.prompt_tokens = count_tokens(prompt)
+        return prompt
+
+    def combine(self, documents: List[Document], question: str) -> str:
+        self.format_prompt(documents, question)
+        self.llm_calls += 1
+        return self.orchestrator.combine_docs_chain({"input_documents": documents, "question": question}, return_only_outputs=True)['output_text']
+
+'''
+RetrievalOrchestrator replaces ConversationalRetrievalChain for the chat requests. It runs
+the condense, retrieve and combine steps separately so the caller can skip or reuse them
+(e.g. answer from a cache between condensation and retrieval)
+
+    with orchestrator.run() as run:
+        question = run.condense(question, chat_history)
+        documents = run.pack(run.retrieve(question))
+        answer = run.combine(documents, question)
+'''
+class RetrievalOrchestrator:
+    def __init__(
+        self,
+        llm,
+        retriever,
+        prompt,
+        condense_prompt=CONDENSE_QUESTION_PROMPT,
+        scope: str = "",
+        condensed_questions: CondensedQuestionCache = None,
+        metrics: OrchestrationMetrics = None,
+        executor: ThreadPoolExecutor = None,
+        embed_query: Callable[[str], List[float]] = None,
+        speculative_max_turns: int = 2,
+        speculative_threshold: float = 0.95,
+        packer: ContextPacker = None,
+    ):
+        self.retriever = retriever
+        self.prompt = prompt
+        self.question_generator = LLMChain(llm=llm, prompt=condense_prompt, verbose=False)
+        self.combine_docs_chain = load_qa_with_sources_chain(llm, chain_type="stuff", verbose=False, prompt=prompt)
+        self.scope = scope
+        self.condensed_questions = condensed_questions
+        self.metrics = metrics
+        self.executor = executor
+        self.embed_query = embed_query
+        self.speculative_max_turns = speculative_max_turns
+        self.speculative_threshold = speculative_threshold
+        self.packer = packer
+
+    def run(self) -> RetrievalRun:
+        return RetrievalRun(self)
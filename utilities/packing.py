@@ -0,0 +1,90 @@
+"""Token budgeted packing of the retrieved chunks into the "stuff" prompt."""
+import logging
+from typing import List, Optional, Sequence, Set, Tuple
+
+from utilities.embeddings import count_tokens, truncate_tokens
+
+logger = logging.getLogger()
+
+'''
+formats the documents like the "stuff" chain of load_qa_with_sources_chain fills the
+{summaries} of the prompt
+'''
+def format_summaries(documents: Sequence) -> str:
+    return "\n\n".join(format_document(document) for document in documents)
+
+def format_document(document) -> str:
+    return f"Content: {document.page_content}\nSource: {document.metadata.get('source', '')}"
+
+def _shingles(text: str, size: int = 3) -> Set[int]:
+    words = text.lower().split()
+    return {hash(tuple(words[i:i + size])) for i in range(max(1, len(words) - size + 1))}
+
+'''
+returns the number of characters at the start of text already at the end of previous (the
+overlap TokenTextSplitter leaves between consecutive chunks of a file), 0 when they do not
+overlap by at least probe characters
+'''
+def _overlap(previous: str, text: str, probe: int) -> int:
+    if len(text) < probe:
+        return 0
+    start = previous.find(text[:probe])
+    while start != -1:
+        if text.startswith(previous[start:]):
+            return len(previous) - start
+        start = previous.find(text[:probe], start + 1)
+    return 0
+
+'''
+ContextPacker picks the chunks sent to the LLM. The chunks come best first from the
+retriever; each one is
+- dropped when most of its word shingles are already in the packed chunks (containment of
+  duplicate_threshold or more, the same passage retrieved from two chunks or two files)
+- trimmed of the text it shares with the end or the start of a packed chunk (the CHUNK_OVERLAP
+  of consecutive chunks), so the overlap is only paid for once
+- packed while the formatted chunks fit in max_tokens (None: no budget), the chunks that do
+  not fit are skipped for the next smaller ones. A first chunk larger than the budget is cut
+pack() returns the packed chunks in the order of the retriever and their tokens
+'''
+class ContextPacker:
+    def __init__(self, max_tokens: Optional[int] = 2000, duplicate_threshold: float = 0.8, overlap_probe: int = 32):
+        self.max_tokens = max_tokens
+        self.duplicate_threshold = duplicate_threshold
+        self.overlap_probe = overlap_probe
+
+    def _trim(self, text: str, packed: List) -> str:
+        for document in packed:
+            overlap = _overlap(document.page_content, text, self.overlap_probe)
+            if overlap:
+                text = text[overlap:]
+            overlap = _overlap(text, document.page_content, self.overlap_probe)
+            if overlap:
+                text = text[:len(text) - overlap]
+        return text.strip()
+
+    def pack(self, documents: Sequence) -> Tuple[List, int]:
+        packed, seen, tokens = [], set(), 0
+        separator = count_tokens("\n\n")
+        for document in documents:
+            shingles = _shingles(document.page_content)
+            if len(shingles & seen) >= self.duplicate_threshold * len(shingles):
+                continue
+            text = self._trim(document.page_content, packed)
+            if not text:
+                continue
+            if text != document.page_content:
+                document = document.__class__(page_content=text, metadata=document.metadata)
+            size = count_tokens(format_document(document)) + (separator if packed else 0)
+            if self.max_tokens is not None and tokens + size > self.max_tokens:
+                if packed:
+                    continue
+                # Nothing fits yet, the best chunk is cut to the budget rather than sending no context
+                overhead = size - count_tokens(text)
+                document = document.__class__(page_content=truncate_tokens(text, self.max_tokens - overhead), metadata=document.metadata)
+                size = count_tokens(format_document(document))
+            packed.append(document)
+            seen |= shingles
+            tokens += size
+        if len(packed) < len(documents):
+            logger.debug(f"Packed {len(packed)} of {len(documents)} chunks in {tokens} tokens")
+        return packed, tokens
@@ -0,0 +1,182 @@
+"""Compressed vector codes searched before an exact re-rank of a few candidates."""
+import os
+from typing import Dict, Optional
+
+import numpy as np
+
+# Candidates kept per requested result for the exact re-rank of a quantized search, when set it
+# replaces the default of the quantizer
+RERANK_FACTOR = int(os.environ.get("VECTOR_RERANK_FACTOR", 0)) or None
+
+# Rows per block when the codes are decoded to compute similarities, bounds the temporary memory
+SCORE_BLOCK_ROWS = 4096
+
+'''
+ScalarQuantizer stores one uint8 per dimension (4x smaller than float32): every dimension is
+mapped linearly between the minimum and maximum seen in the training vectors. The dot product
+of a float query with a decoded vector is computed straight on the codes,
+q.x ~ q.min + (q * step).codes
+'''
+class ScalarQuantizer:
+    kind = "int8"
+    min_train_rows = 1
+    rerank_factor = 4
+
+    def __init__(self, dims: int, training_rows: int = 65536):
+        self.dims = dims
+        self.training_rows = training_rows
+        self.low: Optional[np.ndarray] = None
+        self.step: Optional[np.ndarray] = None
+
+    @property
+    def trained(self) -> bool:
+        return self.low is not None
+
+    @property
+    def code_size(self) -> int:
+        return self.dims
+
+    def train(self, vectors: np.ndarray, seed: int = 0) -> None:
+        if len(vectors) > self.training_rows:
+            vectors = vectors[np.sort(np.random.default_rng(seed).choice(len(vectors), self.training_rows, replace=False))]
+        low = vectors.min(axis=0).astype(np.float32)
+        high = vectors.max(axis=0).astype(np.float32)
+        self.low = low
+        self.step = np.where(high > low, (high - low) / 255, 1).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint((np.asarray(vectors, dtype=np.float32) - self.low) / self.step)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def similarities(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        offsets = queries @ self.low
+        scaled = queries * self.step
+        scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+            block = codes[start:start + SCORE_BLOCK_ROWS].astype(np.float32)
+            scores[:, start:start + len(block)] = scaled @ block.T + offsets[:, None]
+        return scores
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"low": self.low, "step": self.step}
+
+    def load(self, state: Dict[str, np.ndarray]) -> None:
+        self.low = np.asarray(state["low"], dtype=np.float32)
+        self.step = np.asarray(state["step"], dtype=np.float32)
+
+'''
+ProductQuantizer splits the vectors into subspaces and stores, for every subspace, the index
+of the nearest of 256 centroids learned by k-means: one byte per subspace, 1536 dimensions in
+96 bytes with the default 16 dimensions per subspace. A query is scored with a table of its
+dot products with every centroid (asymmetric distance), summed over the subspaces
+'''
+class ProductQuantizer:
+    kind = "pq"
+    centroids = 256
+    # The codes only roughly order the chunks, the exact re-rank needs a wide candidate set
+    rerank_factor = 20
+
+    def __init__(self, dims: int, subspace_dims: int = 16, iterations: int = 15, training_rows: int = 256 * 40):
+        if dims % subspace_dims:
+            raise ValueError(f"{dims} dimensions can not be split into subspaces of {subspace_dims}")
+        self.dims = dims
+        self.subspace_dims = subspace_dims
+        self.subspaces = dims // subspace_dims
+        self.iterations = iterations
+        self.training_rows = training_rows
+        self.codebook: Optional[np.ndarray] = None
+
+    @property
+    def min_train_rows(self) -> int:
+        return 4 * self.centroids
+
+    @property
+    def trained(self) -> bool:
+        return self.codebook is not None
+
+    @property
+    def code_size(self) -> int:
+        return self.subspaces
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        # (rows, dims) -> (subspaces, rows, subspace_dims)
+        return np.asarray(vectors, dtype=np.float32).reshape(len(vectors), self.subspaces, self.subspace_dims).transpose(1, 0, 2)
+
+    @staticmethod
+    def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        # argmin of |x - c|^2 = |x|^2 - 2 x.c + |c|^2, |x|^2 does not change the argmin
+        return np.argmin((centroids * centroids).sum(axis=1) - 2 * vectors @ centroids.T, axis=1)
+
+    def train(self, vectors: np.ndarray, seed: int = 0) -> None:
+        random = np.random.default_rng(seed)
+        if len(vectors) > self.training_rows:
+            vectors = vectors[np.sort(random.choice(len(vectors), self.training_rows, replace=False))]
+        subvectors = self._split(vectors)
+        codebook = np.empty((self.subspaces, self.centroids, self.subspace_dims), dtype=np.float32)
+        for j, points in enumerate(subvectors):
+            centroids = points[random.choice(len(points), self.centroids, replace=len(points) < self.centroids)].copy()
+            for _ in range(self.iterations):
+                assignment = self._nearest(points, centroids)
+                counts = np.bincount(assignment, minlength=self.centroids)
+                sums = np.stack([np.bincount(assignment, weights=points[:, d], minlength=self.centroids) for d in range(self.subspace_dims)], axis=1)
+                # Empty clusters keep their previous centroid
+                filled = counts > 0
+                centroids[filled] = sums[filled] / counts[filled, None]
+            codebook[j] = centroids
+        self.codebook = codebook
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.empty((len(vectors), self.subspaces), dtype=np.uint8)
+        for start in range(0, len(vectors), SCORE_BLOCK_ROWS):
+            subvectors = self._split(vectors[start:start + SCORE_BLOCK_ROWS])
+            for j, points in enumerate(subvectors):
+                codes[start:start + len(points), j] = self._nearest(points, self.codebook[j])
+        return codes
+
+    def similarities(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        # (queries, subspaces, 256): dot product of every query subvector with every centroid
+        tables = np.einsum('qjd,jcd->qjc', self._split(queries).transpose(1, 0, 2), self.codebook)
+        subspaces = np.arange(self.subspaces)
+        scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+            block = codes[start:start + SCORE_BLOCK_ROWS]
+            for i, table in enumerate(tables):
+                scores[i, start:start + len(block)] = table[subspaces, block].sum(axis=1)
+        return scores
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"codebook": self.codebook}
+
+    def load(self, state: Dict[str, np.ndarray]) -> None:
+        self.codebook = np.asarray(state["codebook"], dtype=np.float32)
+
+QUANTIZERS = {quantizer.kind: quantizer for quantizer in (ScalarQuantizer, ProductQuantizer)}
+
+'''
+returns a new quantizer of the given kind ("int8" or "pq"), None when kind is empty
+'''
+def get_quantizer(kind: Optional[str], dims: int):
+    if not kind:
+        return None
+    if kind not in QUANTIZERS:
+        raise ValueError(f"Unknown vector quantization {kind}, expected one of {', '.join(QUANTIZERS)}")
+    return QUANTIZERS[kind](dims)
+
+'''
+int8 codes of vectors for an index that compares them by cosine: every vector is scaled so
+its largest component is 127, the cosine is insensitive to that per vector scale
+'''
+def int8_cosine_codes(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    peaks = np.abs(vectors).max(axis=1, keepdims=True)
+    return np.rint(vectors * (127 / np.where(peaks == 0, 1, peaks))).astype(np.int8)
+
+'''
+orders candidate rows by their exact cosine similarity with a normalized query and keeps the
+best k. Returns the positions in candidates and the similarities
+'''
+def rerank(query: np.ndarray, candidate_vectors: np.ndarray, k: int):
+    norms = np.linalg.norm(candidate_vectors, axis=1)
+    similarities = (candidate_vectors @ query) / np.where(norms == 0, 1, norms)
+    order = np.argsort(-similarities)[:k]
+    return order, similarities[order]
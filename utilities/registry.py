@@ -0,0 +1,77 @@
+"""Process level registry of the clients shared by every LLMHelper of a worker."""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger()
+
+# Configurations of a name whose clients are kept, the least recently used one is dropped first
+MAX_CLIENTS_PER_NAME = 4
+
+_lock = threading.RLock()
+_clients = {}
+_building = {}
+_env_loaded = False
+
+'''
+loads the .env file once per process instead of on every invocation
+'''
+def load_env_once() -> None:
+    global _env_loaded
+    with _lock:
+        if not _env_loaded:
+            load_dotenv()
+            _env_loaded = True
+
+'''
+returns the current values of some environment variables, used as the configuration of
+clients that read their settings from the environment
+'''
+def env_config(*names: str) -> tuple:
+    return tuple(os.getenv(name) for name in names)
+
+'''
+returns the client registered under name for config (the values of the settings it is built
+with, never object ids that can be reused), building it with factory the first time. The
+last MAX_CLIENTS_PER_NAME configurations of a name are kept, so helpers with different
+settings (e.g. two temperatures) do not rebuild each other's clients. A client is built
+outside the registry lock, under a lock of its own name and configuration: concurrent
+invocations never build the same client twice and never wait for the other ones. The clients
+handed out must themselves be safe for concurrent use (the Azure SDK, Redis and OpenAI
+clients are)
+'''
+def get_client(name: str, config: Hashable, factory: Callable[[], Any]) -> Any:
+    key = (name, config)
+    with _lock:
+        clients = _clients.setdefault(name, OrderedDict())
+        if config in clients:
+            clients.move_to_end(config)
+            return clients[config]
+        build_lock = _building.setdefault(key, threading.Lock())
+    with build_lock:
+        with _lock:
+            clients = _clients.setdefault(name, OrderedDict())
+            if config in clients:
+                return clients[config]
+        if clients:
+            logger.info(f"Building {name} for a new configuration")
+        client = factory()
+        with _lock:
+            clients = _clients.setdefault(name, OrderedDict())
+            clients[config] = client
+            while len(clients) > MAX_CLIENTS_PER_NAME:
+                clients.popitem(last=False)
+            _building.pop(key, None)
+        return client
+
+'''
+forgets every registered client (or only the ones of the given names), they are rebuilt on next use
+'''
+def clear(*names: str) -> None:
+    with _lock:
+        for name in names or list(_clients):
+            _clients.pop(name, None)
@@ -0,0 +1,114 @@
+"""Local reranking of oversampled retrieval results before they reach the LLM."""
+import asyncio
+import logging
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger()
+
+'''
+greedy maximal marginal relevance: picks k rows one by one, each maximizing
+lambda * relevance - (1 - lambda) * its highest similarity with the rows already picked, so
+near duplicates of a picked chunk fall behind the chunks that add something new. vectors must
+be normalized. Returns the picked rows in order
+'''
+def maximal_marginal_relevance(relevance: np.ndarray, vectors: np.ndarray, k: int, mmr_lambda: float = 0.7) -> List[int]:
+    k = min(k, len(relevance))
+    if k == 0:
+        return []
+    if mmr_lambda >= 1:
+        return list(np.argsort(-relevance)[:k])
+    # Highest similarity of every candidate with the picked ones, one product per pick
+    redundancy = np.zeros(len(relevance), dtype=np.float32)
+    available = np.ones(len(relevance), dtype=bool)
+    picked = []
+    for _ in range(k):
+        scores = np.where(available, mmr_lambda * relevance - (1 - mmr_lambda) * redundancy, -np.inf)
+        row = int(np.argmax(scores))
+        picked.append(row)
+        available[row] = False
+        redundancy = np.maximum(redundancy, vectors @ vectors[row])
+    return picked
+
+'''
+LocalReranker orders candidate chunks by their cosine similarity with the question, computed
+in one product over their embeddings, drops the ones under score_threshold and keeps k with
+maximal marginal relevance. mmr_lambda=1 keeps the k most similar. The embeddings are read
+from the vector store with get_vectors (by the key in the metadata of the chunks), only the
+chunks it has no vector for are embedded again with embed_documents
+'''
+class LocalReranker:
+    def __init__(
+        self,
+        embed_query: Callable[[str], List[float]],
+        embed_documents: Callable[[List[str]], List[List[float]]],
+        mmr_lambda: float = 0.7,
+        score_threshold: Optional[float] = None,
+        get_vectors: Optional[Callable[[List[str]], List[Optional[List[float]]]]] = None,
+    ):
+        self.embed_query = embed_query
+        self.embed_documents = embed_documents
+        self.mmr_lambda = mmr_lambda
+        self.score_threshold = score_threshold
+        self.get_vectors = get_vectors
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    '''
+    returns at most k (document, cosine similarity) pairs, best first. Candidates with the same
+    content are only scored once
+    '''
+    def rerank(self, query: str, documents: Sequence, k: int) -> List[Tuple[object, float]]:
+        if not documents:
+            return []
+        unique = {}
+        for document in documents:
+            unique.setdefault(document.page_content, document)
+        documents = list(unique.values())
+        query_vector = self._normalize(np.asarray(self.embed_query(query), dtype=np.float32))
+        vectors = self._normalize(np.asarray(self._document_vectors(documents), dtype=np.float32))
+        relevance = vectors @ query_vector
+        if self.score_threshold is not None:
+            kept = np.flatnonzero(relevance >= self.score_threshold)
+            documents, vectors, relevance = [documents[i] for i in kept], vectors[kept], relevance[kept]
+        picked = maximal_marginal_relevance(relevance, vectors, k, self.mmr_lambda)
+        return [(documents[row], float(relevance[row])) for row in picked]
+
+    def _document_vectors(self, documents: Sequence) -> List:
+        vectors = [None] * len(documents)
+        keys = [document.metadata.get('key') for document in documents] if self.get_vectors is not None else []
+        if keys and all(keys):
+            try:
+                vectors = list(self.get_vectors(keys))
+            except Exception as e:
+                logger.warning(f"Reading the stored vectors failed, embedding the candidates: {e}")
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            for i, vector in zip(missing, self.embed_documents([documents[i].page_content for i in missing])):
+                vectors[i] = vector
+        return vectors
+
+'''
+RerankingRetriever asks the vector store for oversample * k candidates with its
+{search_type}_search method (similarity, hybrid or semantic_hybrid for AzureSearch) and hands
+the reranked k best to the chain. Stands in for the retriever of the store: the orchestrator
+only calls get_relevant_documents
+'''
+class RerankingRetriever:
+    def __init__(self, vector_store, reranker: LocalReranker, k: int = 4, oversample: int = 5, search_type: str = "similarity"):
+        self.vector_store = vector_store
+        self.reranker = reranker
+        self.k = k
+        self.oversample = max(1, oversample)
+        self.search = getattr(vector_store, f"{search_type}_search")
+
+    def get_relevant_documents(self, query: str) -> List:
+        candidates = self.search(query, k=self.k * self.oversample)
+        return [document for document, _ in self.reranker.rerank(query, candidates, self.k)]
+
+    async def aget_relevant_documents(self, query: str) -> List:
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_relevant_documents, query)
@@ -0,0 +1,43 @@
+"""Wire formats of the embedding vectors sent to the vector stores."""
+import os
+from typing import List, Sequence, Union
+
+import numpy as np
+
+Vector = Union[Sequence[float], np.ndarray]
+
+# Decimals kept in the JSON payloads, |error| <= 5e-7 per component for the default 6
+JSON_VECTOR_DECIMALS = int(os.environ.get("VECTOR_JSON_DECIMALS", 6))
+
+'''
+returns the vector as a float32 array, without a copy when it already is one
+'''
+def to_float32(vector: Vector) -> np.ndarray:
+    return np.asarray(vector, dtype=np.float32)
+
+'''
+binary little endian float32 encoding of a Redis hash field or query parameter, 4 bytes per
+dimension
+'''
+def to_redis_bytes(vector: Vector) -> bytes:
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+def from_redis_bytes(value: bytes) -> np.ndarray:
+    return np.frombuffer(value, dtype=np.float32)
+
+'''
+the vector as a list of floats for a JSON payload (Azure Cognitive Search documents and
+vector queries). The values are rounded to decimals so the JSON encoder writes them with a
+few digits instead of the 17 of a float32 widened to a float64 (0.0123456 instead of
+0.012345600128173828). The rounding is done in float64 on the whole vector at once
+'''
+def to_json_floats(vector: Vector, decimals: int = JSON_VECTOR_DECIMALS) -> List[float]:
+    return np.round(np.asarray(vector, dtype=np.float64), decimals).tolist()
+
+'''
+upper bound of the JSON bytes of a vector of dims components rounded to decimals: sign,
+"0." and the decimals of every component plus the ", " separators and the brackets. Values
+are below 1 for normalized embeddings
+'''
+def json_vector_size(dims: int, decimals: int = JSON_VECTOR_DECIMALS) -> int:
+    return dims * (decimals + 5) + 2
@@ -0,0 +1,72 @@
+"""Token streaming of the completions and of the chat answers."""
+from typing import Iterable, Iterator
+
+import openai
+
+from utilities.answers import SOURCES_MARKERS, strip_sources
+from utilities.embeddings import count_tokens
+
+'''
+streams the tokens of a completion from the Azure OpenAI deployment as they are generated,
+using the chat or the text completion API depending on the deployment type. max_tokens -1
+leaves the chat completions unbounded and gives the text completions what remains of the
+context_size tokens of the model after the prompt, as langchain's max_tokens_for_prompt
+'''
+def stream_completion(prompt: str, deployment_name: str, deployment_type: str = "Text", temperature: float = 0.7, max_tokens: int = -1, context_size: int = 4097, **kwargs) -> Iterator[str]:
+    max_tokens = max_tokens if max_tokens != -1 else None
+    if max_tokens is None and deployment_type != 'Chat':
+        max_tokens = max(1, context_size - count_tokens(prompt))
+    if deployment_type == 'Chat':
+        response = openai.ChatCompletion.create(engine=deployment_name, messages=[{"role": "user", "content": prompt}], temperature=temperature, max_tokens=max_tokens, stream=True, **kwargs)
+        for chunk in response:
+            if chunk['choices']:
+                token = chunk['choices'][0].get('delta', {}).get('content')
+                if token:
+                    yield token
+    else:
+        response = openai.Completion.create(engine=deployment_name, prompt=prompt, temperature=temperature, max_tokens=max_tokens, stream=True, **kwargs)
+        for chunk in response:
+            if chunk['choices']:
+                token = chunk['choices'][0].get('text')
+                if token:
+                    yield token
+
+'''
+AnswerStream forwards the tokens of an answer until the model starts listing its sources.
+The last few characters are held back until it is known they do not start a marker, only
+they are searched for the markers as the tokens come. The tokens are kept in a list, text
+joins them into the complete answer (with its sources part)
+'''
+class AnswerStream:
+    def __init__(self, tokens: Iterable[str], markers=SOURCES_MARKERS):
+        self.tokens = tokens
+        self.markers = markers
+        self.holdback = max(len(marker) for marker in markers) - 1
+        self.parts = []
+
+    def __iter__(self) -> Iterator[str]:
+        pending = ""
+        done = False
+        for token in self.tokens:
+            self.parts.append(token)
+            if done:
+                continue
+            pending += token
+            positions = [i for i in (pending.find(marker) for marker in self.markers) if i != -1]
+            if positions:
+                end, done = min(positions), True
+            else:
+                end = len(pending) - self.holdback
+            if end > 0:
+                yield pending[:end]
+                pending = pending[end:]
+        if not done and pending:
+            yield pending
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    @property
+    def answer(self) -> str:
+        return strip_sources(self.text)
@@ -1,10 +1,165 @@
+import atexit
+import hashlib
 import json
 import logging
+import os
+import threading
+import time
 import uuid
-from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Set, Tuple
+
+import numpy as np
+import pandas as pd
+from langchain.docstore.document import Document
+from langchain.vectorstores.redis import Redis
+from redis.commands.search.field import VectorField, TextField
+from redis.commands.search.aggregation import AggregateRequest, Asc
+from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+from redis.commands.search.query import Query
+
+from utilities.quantization import RERANK_FACTOR, int8_cosine_codes, rerank
+from utilities.serialization import from_redis_bytes, to_float32
 
 logger = logging.getLogger()
 
+# Keys unlinked per pipeline by the bulk deletes
+DELETE_BATCH_SIZE = int(os.environ.get("REDIS_DELETE_BATCH_SIZE", 1000))
+
+# Prompt results buffered by PromptResultWriter before a pipeline is sent, and the longest a result waits in the buffer
+PROMPT_FLUSH_SIZE = int(os.environ.get("REDIS_PROMPT_FLUSH_SIZE", 500))
+PROMPT_FLUSH_INTERVAL = float(os.environ.get("REDIS_PROMPT_FLUSH_INTERVAL", 1.0))
+
+VECTOR_DIMENSIONS = int(os.environ.get("REDIS_VECTOR_DIMENSIONS", 1536)) # Default to OpenAI's ada-002 embedding model vector size
+INDEX_INITIAL_CAP = int(os.environ.get("REDIS_INDEX_INITIAL_CAP", 10000))
+
+'''
+"int8" indexes int8 codes of the vectors (a quarter of the float32 index, needs a Redis
+version with INT8 vector fields) and keeps the float32 vectors in an unindexed hash field
+for the exact re-rank of the candidates. Chosen when the index is created, an existing index
+must be dropped and the documents ingested again to change it
+'''
+DEFAULT_QUANTIZATION = os.environ.get("REDIS_VECTOR_QUANTIZATION") or None
+QUANTIZATIONS = ("int8",)
+EXACT_VECTOR_FIELD = "content_vector_exact"
+
+# Columns of the prompt results, in the order of the exports
+PROMPT_RESULT_FIELDS = ("id", "filename", "prompt", "result")
+LINE_BREAKS = str.maketrans({"\n": " ", "\r": " "})
+
+'''
+named vector index profiles, selected per index when it is created (VECTOR_INDEX_PROFILE or
+the index_profile argument). HNSW trades recall for latency with M (links per node),
+EF_CONSTRUCTION (candidates kept while building) and EF_RUNTIME (candidates kept while
+searching); FLAT is an exact brute force search, the fastest choice for small corpora
+'''
+INDEX_PROFILES = {
+    "low-latency": {"algorithm": "HNSW", "M": 8, "EF_CONSTRUCTION": 100, "EF_RUNTIME": 20},
+    "balanced": {"algorithm": "HNSW", "M": 16, "EF_CONSTRUCTION": 200, "EF_RUNTIME": 64},
+    "high-recall": {"algorithm": "HNSW", "M": 32, "EF_CONSTRUCTION": 400, "EF_RUNTIME": 256},
+    "flat": {"algorithm": "FLAT", "BLOCK_SIZE": 1024},
+}
+DEFAULT_INDEX_PROFILE = os.environ.get("VECTOR_INDEX_PROFILE", "balanced")
+
+def get_index_profile(name: Optional[str] = None) -> dict:
+    name = name or DEFAULT_INDEX_PROFILE
+    if name not in INDEX_PROFILES:
+        raise ValueError(f"Unknown vector index profile {name}, expected one of {', '.join(INDEX_PROFILES)}")
+    return INDEX_PROFILES[name]
+
+'''
+Buffers prompt results and writes them with one pipeline per max_batch_size results, or
+once the oldest buffered result waited max_interval seconds (checked by a background thread,
+so slow completions are still written regularly; None flushes by size only). With a job, the
+ids are added to the set of the job in the same pipeline, and transaction=True sends them as
+a MULTI/EXEC so a result and its job entry are written together or not at all. A failed
+flush keeps the results buffered for the next one. close() writes what is left, also when
+the with block raised, and runs at interpreter shutdown for writers left open
+'''
+class PromptResultWriter:
+    def __init__(
+        self,
+        client,
+        job: Optional[str] = None,
+        max_batch_size: int = PROMPT_FLUSH_SIZE,
+        max_interval: Optional[float] = PROMPT_FLUSH_INTERVAL,
+        transaction: bool = False,
+    ):
+        self.client = client
+        self.job = job
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_interval = max_interval
+        self.transaction = transaction
+        self.buffer = []
+        self.buffered_since = None
+        self.results = 0
+        self.flushes = 0
+        self.closed = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        if max_interval:
+            self._thread = threading.Thread(target=self._flush_periodically, name='prompt-result-writer', daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, id: str, result: str, filename: str = "", prompt: str = "") -> None:
+        with self._lock:
+            if self.closed:
+                raise ValueError("PromptResultWriter is closed")
+            if not self.buffer:
+                self.buffered_since = time.monotonic()
+            self.buffer.append((id, result, filename, prompt))
+            if len(self.buffer) >= self.max_batch_size:
+                self._flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self.buffer:
+            return
+        pipeline = self.client.pipeline(transaction=self.transaction)
+        for id, result, filename, prompt in self.buffer:
+            pipeline.hset(f"prompt:{id}", mapping={"result": result, "filename": filename, "prompt": prompt})
+        if self.job:
+            pipeline.sadd(f"promptjob:{self.job}", *[id for id, _, _, _ in self.buffer])
+        pipeline.execute()
+        self.results += len(self.buffer)
+        self.flushes += 1
+        self.buffer = []
+        self.buffered_since = None
+
+    def _flush_periodically(self) -> None:
+        while not self._stop.wait(self.max_interval / 4):
+            with self._lock:
+                if self.buffered_since is None or time.monotonic() - self.buffered_since < self.max_interval:
+                    continue
+                try:
+                    self._flush()
+                except Exception as e:
+                    logger.warning(f"Flush of {len(self.buffer)} prompt results failed, retrying with the next one: {e}")
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        atexit.unregister(self.close)
+        with self._lock:
+            self.closed = True
+            self._flush()
+
+    def stats(self) -> dict:
+        return {"results": self.results, "flushes": self.flushes, "buffered": len(self.buffer)}
+
 '''
 RedisExtended inherits from the base class Redis. Extends and customizes the 
 functionality of the base redis class
@@ -19,6 +174,9 @@ class RedisExtended(Redis):
         redis_url: str,
         index_name: str,
         embedding_function: Callable,
+        index_profile: Optional[str] = None,
+        quantization: Optional[str] = None,
+        rerank_factor: Optional[int] = RERANK_FACTOR,
         **kwargs: Any,
     ):
         
@@ -26,6 +184,12 @@ class RedisExtended(Redis):
         constructor of the base class to initialize the common attributes 
         '''
         super().__init__(redis_url, index_name, embedding_function)
+        self.index_profile = index_profile
+        self.quantization = quantization or DEFAULT_QUANTIZATION
+        if self.quantization and self.quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown Redis vector quantization {self.quantization}, expected one of {', '.join(QUANTIZATIONS)}")
+        # int8 codes keep the order of the chunks nearly intact, a few candidates per result are enough
+        self.rerank_factor = rerank_factor or 4
         
         '''
         checks if certain redis prompt indexes and specified index name exists
@@ -44,6 +208,255 @@ class RedisExtended(Redis):
             # Create Redis Index
             self.create_index()
 
+    '''
+    adds the texts to the index. Precomputed embeddings can be passed so the chunks are
+    not embedded one by one, and the hashes are written through a pipeline in batches
+    '''
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        embeddings: Optional[List[List[float]]] = None,
+        keys: Optional[List[str]] = None,
+        batch_size: int = 1000,
+        **kwargs: Any,
+    ) -> List[str]:
+        ids = []
+        pipeline = self.client.pipeline(transaction=False)
+        for i, text in enumerate(texts):
+            # Use provided key otherwise use default key
+            key = keys[i] if keys else f"doc:{self.index_name}:{uuid.uuid4().hex}"
+            metadata = metadatas[i] if metadatas else {}
+            # Converted once, the float32 array gives both the hash field bytes and the int8 codes
+            embedding = to_float32(embeddings[i] if embeddings else self.embedding_function(text))
+            mapping = {
+                "content": text,
+                "content_vector": embedding.tobytes(),
+                "metadata": json.dumps(metadata)
+            }
+            if self.quantization:
+                mapping["content_vector"] = int8_cosine_codes(embedding).tobytes()
+                mapping[EXACT_VECTOR_FIELD] = embedding.tobytes()
+            pipeline.hset(key, mapping=mapping)
+            # Keep the per file index of the chunk keys up to date
+            file_index_key = self.get_file_index_key(key)
+            if file_index_key:
+                pipeline.sadd(file_index_key, key)
+            ids.append(key)
+            # Write data in batches
+            if len(ids) % batch_size == 0:
+                pipeline.execute()
+        pipeline.execute()
+        return ids
+
+    '''
+    searches the chunks closest to the query, the query vector is converted to float32 bytes
+    once. A quantized index returns rerank_factor * k candidates by the cosine of their int8
+    codes, whose float32 vectors are then read in one pipeline to keep the k closest by their
+    exact cosine. Scores are cosine distances
+    '''
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        embedding = to_float32(self.embedding_function(query))
+        if not self.quantization:
+            redis_query = Query(f"*=>[KNN {k} @content_vector $vector AS vector_score]").sort_by("vector_score").return_fields("metadata", "content", "vector_score").paging(0, k).dialect(2)
+            results = self.client.ft(self.index_name).search(redis_query, {"vector": embedding.tobytes()})
+            return [(Document(page_content=result.content, metadata=json.loads(result.metadata)), float(result.vector_score)) for result in results.docs]
+        candidates = k * self.rerank_factor
+        redis_query = Query(f"*=>[KNN {candidates} @content_vector $vector AS vector_score]").sort_by("vector_score").return_fields("vector_score").paging(0, candidates).dialect(2)
+        ids = [doc.id for doc in self.client.ft(self.index_name).search(redis_query, {"vector": int8_cosine_codes(embedding).tobytes()}).docs]
+        if not ids:
+            return []
+        pipeline = self.client.pipeline(transaction=False)
+        for id in ids:
+            pipeline.hmget(id, "content", "metadata", EXACT_VECTOR_FIELD)
+        rows = [row for row in pipeline.execute() if row[2] is not None]
+        if not rows:
+            return []
+        vectors = np.stack([from_redis_bytes(row[2]) for row in rows])
+        order, similarities = rerank(embedding / (np.linalg.norm(embedding) or 1), vectors, k)
+        return [
+            (Document(page_content=self._decode(rows[i][0]), metadata=json.loads(self._decode(rows[i][1]))), 1 - float(similarity))
+            for i, similarity in zip(order, similarities)
+        ]
+
+    '''
+    LLMHelper writes the chunk keys as doc:{index_name}:{sha1(filename)}:{sha1(content)}. The
+    keys of each file are also kept in a set, filekeys:{index_name}:{sha1(filename)}, so the
+    chunks of a file are found and deleted without scanning the whole keyspace. Returns None
+    for keys that do not belong to a file
+    '''
+    def get_file_index_key(self, key: str) -> Optional[str]:
+        prefix = f"doc:{self.index_name}:"
+        if not key.startswith(prefix):
+            return None
+        parts = key[len(prefix):].split(':')
+        return f"filekeys:{self.index_name}:{parts[0]}" if len(parts) == 2 else None
+
+    def get_file_index_key_of_filename(self, filename: str) -> str:
+        return f"filekeys:{self.index_name}:{hashlib.sha1(filename.encode('utf-8')).hexdigest()}"
+
+    '''
+    returns the per file set of each chunk key. The keys written before the filename hash was
+    part of the key (doc:{index}:{hash}) are mapped from the filename of their metadata, read
+    with one pipelined HMGET per key. Keys that do not belong to a file are left out
+    '''
+    def get_file_index_keys(self, keys: Sequence[str]) -> Dict[str, str]:
+        file_index_keys = {}
+        legacy_keys = []
+        for key in keys:
+            file_index_key = self.get_file_index_key(key)
+            if file_index_key:
+                file_index_keys[key] = file_index_key
+            elif key.startswith(f"doc:{self.index_name}:"):
+                legacy_keys.append(key)
+        if legacy_keys:
+            pipeline = self.client.pipeline(transaction=False)
+            for key in legacy_keys:
+                pipeline.hmget(key, "metadata")
+            for key, values in zip(legacy_keys, pipeline.execute()):
+                try:
+                    filename = json.loads(self._decode(values[0]) or "{}").get("filename")
+                except ValueError:
+                    filename = None
+                if filename:
+                    file_index_keys[key] = self.get_file_index_key_of_filename(filename)
+        return file_index_keys
+
+    '''
+    builds the per file sets from the chunks stored before they existed, with a single SCAN
+    of the keyspace. Marks the index as indexed so get_file_keys never falls back to a SCAN again
+    '''
+    def index_file_keys(self, batch_size: int = 1000) -> int:
+        count = 0
+        batch = []
+        for key in self.client.scan_iter(match=f"doc:{self.index_name}:*", count=batch_size):
+            batch.append(self._decode(key))
+            if len(batch) == batch_size:
+                count += self._index_file_keys_batch(batch)
+                batch = []
+        count += self._index_file_keys_batch(batch)
+        self.client.set(f"filekeys:{self.index_name}", "indexed")
+        return count
+
+    def _index_file_keys_batch(self, keys: List[str]) -> int:
+        file_index_keys = self.get_file_index_keys(keys)
+        if file_index_keys:
+            pipeline = self.client.pipeline(transaction=False)
+            for key, file_index_key in file_index_keys.items():
+                pipeline.sadd(file_index_key, key)
+            pipeline.execute()
+        return len(file_index_keys)
+
+    '''
+    returns the keys of the chunks stored for a file from its set (one SMEMBERS). Indexes
+    written before the per file sets existed are indexed on first use
+    '''
+    def get_file_keys(self, filename: str) -> List[str]:
+        if not self.client.exists(f"filekeys:{self.index_name}"):
+            self.index_file_keys()
+        return [self._decode(key) for key in self.client.smembers(self.get_file_index_key_of_filename(filename))]
+
+    '''
+    returns the content of each chunk key (None for the keys not stored anymore), read with
+    one pipelined HMGET per chunk
+    '''
+    def get_contents(self, keys: Sequence[str]) -> List[Optional[str]]:
+        pipeline = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.hmget(key, "content")
+        return [self._decode(values[0]) for values in pipeline.execute()]
+
+    '''
+    returns the float32 vector stored for each chunk key (None for the keys not stored), the
+    exact vectors of a quantized index, read with one pipelined HMGET per chunk
+    '''
+    def get_vectors(self, keys: Sequence[str]) -> List[Optional[np.ndarray]]:
+        field = EXACT_VECTOR_FIELD if self.quantization else "content_vector"
+        pipeline = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.hmget(key, field)
+        return [from_redis_bytes(values[0]) if values[0] is not None else None for values in pipeline.execute()]
+
+    '''
+    deletes every chunk of a file: one lookup of its set and one pipelined delete, returns the
+    number of chunks deleted
+    '''
+    def delete_file(self, filename: str) -> int:
+        keys = self.get_file_keys(filename)
+        if keys:
+            self.delete_keys(keys)
+        self.client.delete(self.get_file_index_key_of_filename(filename))
+        return len(keys)
+
+    '''
+    deletes every chunk of the index with a SCAN of its keys, then the per file sets, returns
+    the number of chunks deleted
+    '''
+    def delete_all(self, batch_size: int = DELETE_BATCH_SIZE, progress: Callable[[int], None] = None) -> int:
+        deleted = self.delete_keys_pattern(f"doc:{self.index_name}:*", batch_size=batch_size, progress=progress)
+        self.delete_keys_pattern(f"filekeys:{self.index_name}:*", batch_size=batch_size)
+        return deleted
+
+    '''
+    lists the chunks of the index page by page, with only the requested columns (key,
+    filename, source, content, metadata). Pages are read lazily through an FT.AGGREGATE
+    cursor, which unlike FT.SEARCH offsets is not capped by MAXSEARCHRESULTS and does not
+    rescan the skipped results, so listing the whole index keeps a single page in memory.
+    filenames lists only the chunks of these files: their keys are read from the per file
+    sets and their fields with one pipelined HMGET per page, without going through the index
+    '''
+    def iter_document_pages(self, fields: Sequence[str] = ("key", "filename"), page_size: int = 1000, filenames: Optional[Iterable[str]] = None) -> Iterator[List[dict]]:
+        if filenames is not None:
+            yield from self._iter_file_document_pages(fields, page_size, filenames)
+            return
+        load = ["@__key", "@metadata"] + (["@content"] if "content" in fields else [])
+        request = AggregateRequest("*").load(*load).cursor(count=page_size, max_idle=300)
+        search_index = self.client.ft(self.index_name)
+        result = search_index.aggregate(request)
+        while True:
+            rows = []
+            for row in result.rows:
+                values = {self._decode(row[i]): self._decode(row[i + 1]) for i in range(0, len(row), 2)}
+                rows.append(self._to_listing_row(values.get("__key"), values.get("metadata"), values.get("content"), fields))
+            if rows:
+                yield rows
+            if result.cursor is None or not result.cursor.cid:
+                return
+            result = search_index.aggregate(result.cursor)
+
+    def _iter_file_document_pages(self, fields: Sequence[str], page_size: int, filenames: Iterable[str]) -> Iterator[List[dict]]:
+        keys = [key for filename in dict.fromkeys(filenames) for key in sorted(self.get_file_keys(filename))]
+        load = ["metadata"] + (["content"] if "content" in fields else [])
+        for start in range(0, len(keys), page_size):
+            pipeline = self.client.pipeline(transaction=False)
+            for key in keys[start:start + page_size]:
+                pipeline.hmget(key, *load)
+            rows = []
+            for key, values in zip(keys[start:start + page_size], pipeline.execute()):
+                values = [self._decode(value) for value in values]
+                # A chunk deleted since its file set was read
+                if values[0] is None:
+                    continue
+                rows.append(self._to_listing_row(key, values[0], values[1] if len(values) > 1 else None, fields))
+            if rows:
+                yield rows
+
+    @staticmethod
+    def _to_listing_row(key: str, metadata: Optional[str], content: Optional[str], fields: Sequence[str]) -> dict:
+        metadata = json.loads(metadata or "{}")
+        document = {
+            "key": metadata.get("key", key),
+            "filename": metadata.get("filename"),
+            "source": metadata.get("source"),
+            "content": content,
+            "metadata": metadata,
+        }
+        return {field: document[field] for field in fields}
+
+    @staticmethod
+    def _decode(value):
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
     '''
     checks if the specified index exists in redis
     '''
@@ -56,28 +469,61 @@ class RedisExtended(Redis):
 
     '''
     Deletes the keys (data) from Redis either specified individually or based on 
-    some kind of a pattern
+    some kind of a pattern. Keys are removed with UNLINK (memory is reclaimed in the
+    background) in pipelines of batch_size keys, so a large delete never blocks the server
+    for long and queries keep being served between the batches. progress is called with the
+    number of keys deleted so far after each batch. Both return the number of keys deleted
     '''
-    def delete_keys(self, keys: List[str]) -> None:
+    def delete_keys(self, keys: Iterable[str], batch_size: int = DELETE_BATCH_SIZE, progress: Callable[[int], None] = None) -> int:
+        deleted = 0
+        batch = []
         for key in keys:
-            self.client.delete(key)
-    
-    def delete_keys_pattern(self, pattern: str) -> None:
-        keys = self.client.keys(pattern)
-        self.delete_keys(keys)
+            batch.append(self._decode(key))
+            if len(batch) >= batch_size:
+                deleted += self._unlink_batch(batch)
+                batch = []
+                if progress is not None:
+                    progress(deleted)
+        if batch:
+            deleted += self._unlink_batch(batch)
+            if progress is not None:
+                progress(deleted)
+        return deleted
+
+    def _unlink_batch(self, keys: List[str]) -> int:
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.unlink(*keys)
+        file_keys = {}
+        for key, file_index_key in self.get_file_index_keys(keys).items():
+            file_keys.setdefault(file_index_key, []).append(key)
+        for file_index_key, keys_of_file in file_keys.items():
+            pipeline.srem(file_index_key, *keys_of_file)
+        return pipeline.execute()[0]
 
     '''
-    creates index
+    the keys are found with a SCAN cursor instead of KEYS, which blocks the server while it
+    walks the whole keyspace
     '''
-    def create_index(self, prefix = "doc", distance_metric:str="COSINE"):
+    def delete_keys_pattern(self, pattern: str, batch_size: int = DELETE_BATCH_SIZE, progress: Callable[[int], None] = None) -> int:
+        deleted = self.delete_keys(self.client.scan_iter(match=pattern, count=batch_size), batch_size=batch_size, progress=progress)
+        logger.info(f"Deleted {deleted} keys matching {pattern}")
+        return deleted
+
+    '''
+    creates index, with the vector algorithm and parameters of an index profile
+    '''
+    def create_index(self, prefix = "doc", distance_metric:str="COSINE", profile: Optional[str] = None, dims: int = VECTOR_DIMENSIONS, initial_cap: int = INDEX_INITIAL_CAP):
         content = TextField(name="content")
         metadata = TextField(name="metadata")
+        attributes = dict(get_index_profile(profile or self.index_profile))
+        algorithm = attributes.pop("algorithm")
         content_vector = VectorField("content_vector",
-                    "HNSW", {
-                        "TYPE": "FLOAT32",
-                        "DIM": 1536,
+                    algorithm, {
+                        "TYPE": "INT8" if self.quantization else "FLOAT32",
+                        "DIM": dims,
                         "DISTANCE_METRIC": distance_metric,
-                        "INITIAL_CAP": 1000,
+                        "INITIAL_CAP": initial_cap,
+                        **attributes,
                     })
         # Create index
         self.client.ft(self.index_name).create_index(
@@ -109,22 +555,77 @@ class RedisExtended(Redis):
             }
         )
 
+    '''
+    returns a PromptResultWriter on the client of the store, use it as a context manager when
+    results are added one by one
+    '''
+    def prompt_result_writer(self, job: Optional[str] = None, **kwargs: Any) -> PromptResultWriter:
+        return PromptResultWriter(self.client, job=job, **kwargs)
+
+    '''
+    adds (id, result, filename, prompt) prompt results in pipelines of PROMPT_FLUSH_SIZE. With
+    a job, the ids are also added to the set of the ids the job completed, in the same pipelines
+    '''
+    def add_prompt_results(self, results: Iterable[Tuple[str, str, str, str]], job: Optional[str] = None) -> int:
+        with self.prompt_result_writer(job=job, max_interval=None) as writer:
+            for id, result, filename, prompt in results:
+                writer.add(id, result, filename, prompt)
+        return writer.results
+
+    '''
+    starts a prompt job and returns the ids it already completed, so a job interrupted by a
+    crash resumes where it stopped. Starting a job other than the current one deletes the
+    results of the previous one
+    '''
+    def start_prompt_job(self, job: str) -> Set[str]:
+        if self._decode(self.client.get("promptjob:current")) != job:
+            # prompt* also matches the promptjob: keys of the previous job
+            self.delete_prompt_results('prompt*')
+            self.client.set("promptjob:current", job)
+        return {self._decode(id) for id in self.client.smembers(f"promptjob:{job}")}
+
+    '''
+    lists the prompt results page by page through an FT.AGGREGATE cursor, like
+    iter_document_pages, as dicts of PROMPT_RESULT_FIELDS. Redis sorts them by id (MAX is set
+    to the number of results, the sort is otherwise cut at 10), so exporting every result
+    keeps a single page in memory. Line breaks of the results are replaced by spaces
+    '''
+    def iter_prompt_result_pages(self, prompt_index_name="prompt-index", page_size: int = 1000) -> Iterator[List[dict]]:
+        search_index = self.client.ft(prompt_index_name)
+        total = search_index.search(Query("*").paging(0, 0)).total
+        if not total:
+            return
+        request = AggregateRequest("*").load("@__key", "@filename", "@prompt", "@result").sort_by(Asc("@__key"), max=total).cursor(count=page_size, max_idle=300)
+        result = search_index.aggregate(request)
+        while True:
+            rows = []
+            for row in result.rows:
+                values = {self._decode(row[i]): self._decode(row[i + 1]) for i in range(0, len(row), 2)}
+                rows.append({
+                    "id": values.get("__key"),
+                    "filename": values.get("filename"),
+                    "prompt": values.get("prompt"),
+                    "result": (values.get("result") or "").translate(LINE_BREAKS),
+                })
+            if rows:
+                yield rows
+            if result.cursor is None or not result.cursor.cid:
+                return
+            result = search_index.aggregate(result.cursor)
+
     '''
     gets the prompt results depending on whatever prompt index you give and returns it 
-    as a pandas dataframe
-    '''
-    def get_prompt_results(self, prompt_index_name="prompt-index", number_of_results: int=3155):
-        base_query = f'*'
-        return_fields = ['id','result','filename','prompt']
-        query = Query(base_query)\
-            .paging(0, number_of_results)\
-            .return_fields(*return_fields)\
-            .dialect(2)
-        results = self.client.ft(prompt_index_name).search(query)
-        if results.docs:
-            return pd.DataFrame(list(map(lambda x: {'id' : x.id, 'filename': x.filename, 'prompt': x.prompt, 'result': x.result.replace('\n',' ').replace('\r',' '),}, results.docs))).sort_values(by='id')
-        else:
-            return pd.DataFrame()
+    as a pandas dataframe. Every result is returned unless number_of_results is given, use
+    iter_prompt_result_pages or LLMHelper.export_prompt_results for large exports
+    '''
+    def get_prompt_results(self, prompt_index_name="prompt-index", number_of_results: Optional[int] = None):
+        rows = []
+        for page in self.iter_prompt_result_pages(prompt_index_name):
+            rows.extend(page)
+            if number_of_results is not None and len(rows) >= number_of_results:
+                rows = rows[:number_of_results]
+                break
+        return pd.DataFrame(rows, columns=list(PROMPT_RESULT_FIELDS)) if rows else pd.DataFrame()
 
     '''
     deletes the results from the prompt
@@ -0,0 +1,439 @@
+"""In-process vector store backed by a NumPy matrix."""
+from __future__ import annotations
+
+import glob
+import json
+import logging
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple, Type
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores.base import VectorStore
+
+from utilities.quantization import QUANTIZERS, RERANK_FACTOR, get_quantizer, rerank
+
+try:
+    import fcntl
+except ImportError:
+    # No file locking on Windows, a single worker must write to the store
+    fcntl = None
+
+logger = logging.getLogger()
+
+# The documents file names the generation of the matrix files written with it
+DOCUMENTS_FILE = "documents.json"
+VECTORS_FILE = "vectors.{}.npy"
+CODES_FILE = "codes.{}.npy"
+QUANTIZER_FILE = "quantizer.{}.npz"
+LOCK_FILE = ".lock"
+
+# "int8" or "pq" to search compressed codes then re-rank the best candidates with the float vectors
+DEFAULT_QUANTIZATION = os.environ.get("NUMPY_STORE_QUANTIZATION") or None
+
+'''
+NumpyVectorStore keeps every chunk in the worker process, for knowledge bases small enough
+(tens of thousands of chunks) that a network hop per query costs more than the search.
+The embeddings live in one contiguous float32 matrix, normalized when they are added so the
+cosine similarity of a query with every chunk is a single matrix-vector product, and the
+top k is selected with argpartition. Keys, filenames, contents and metadata are kept in
+columns aligned with the rows of the matrix.
+
+When a path is given the store is persisted there after every change (or once at the end
+of a batch() block): the matrices are written to new files then the documents file naming
+them is renamed over the previous one, and the matrices are loaded memory-mapped so the
+workers of a host share their pages. Writers take a file lock, and a worker reloads the
+files when another one changed them.
+
+With a quantization ("int8" or "pq", see utilities/quantization.py) every row also gets a
+compressed code. A search scores the codes, keeps rerank_factor * k candidates (by default
+a factor suited to the quantizer) and orders them by their exact cosine with the float
+vectors, so only the rows of the candidates are read from the memory-mapped matrix and the
+codes are the only per chunk memory searched.
+The quantizer is trained on the stored vectors once there are enough of them (until then
+the search is exact), train_quantizer() trains it again after the corpus changed a lot.
+'''
+class NumpyVectorStore(VectorStore):
+    def __init__(
+        self,
+        embedding_function: Callable,
+        path: Optional[str] = None,
+        dims: Optional[int] = None,
+        quantization: Optional[str] = None,
+        rerank_factor: Optional[int] = RERANK_FACTOR,
+        **kwargs: Any,
+    ):
+        self.embedding_function = embedding_function
+        self.path = path
+        self.dims = dims
+        self.quantization = quantization or DEFAULT_QUANTIZATION
+        self.rerank_factor = rerank_factor
+        if self.quantization and self.quantization not in QUANTIZERS:
+            raise ValueError(f"Unknown vector quantization {self.quantization}, expected one of {', '.join(QUANTIZERS)}")
+        # _lock guards the in-memory columns, _write_lock serializes the writers of this process
+        self._lock = threading.RLock()
+        self._write_lock = threading.RLock()
+        self._batch_depth = 0
+        self._lock_file = None
+        self._version = None
+        self._clear()
+        if self.path:
+            os.makedirs(self.path, exist_ok=True)
+            self._refresh()
+
+    def _clear(self) -> None:
+        self._vectors = np.zeros((0, self.dims or 0), dtype=np.float32)
+        self._codes = None
+        self._quantizer = None
+        self._trained_rows = 0
+        self._count = 0
+        self._keys: List[str] = []
+        self._filenames: List[str] = []
+        self._contents: List[str] = []
+        self._metadatas: List[str] = []
+        self._rows = {}
+
+    # Persistence
+
+    def _files_version(self) -> Optional[int]:
+        try:
+            return os.stat(os.path.join(self.path, DOCUMENTS_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _refresh(self) -> None:
+        # Another worker may have changed the files since they were loaded
+        if not self.path:
+            return
+        while True:
+            version = self._files_version()
+            if version is None or version == self._version:
+                return
+            with open(os.path.join(self.path, DOCUMENTS_FILE), encoding="utf-8") as f:
+                columns = json.load(f)
+            generation = columns["generation"]
+            try:
+                vectors = np.load(os.path.join(self.path, VECTORS_FILE.format(generation)), mmap_mode="r")
+                codes, quantizer = self._load_codes(generation, vectors.shape[1], len(columns["keys"]))
+                break
+            except FileNotFoundError:
+                # A newer generation replaced this one while it was read
+                continue
+        with self._lock:
+            self._vectors = vectors
+            self._codes = codes
+            self._quantizer = quantizer
+            self._trained_rows = len(columns["keys"])
+            self._count = len(columns["keys"])
+            self._keys = columns["keys"]
+            self._filenames = columns["filenames"]
+            self._contents = columns["contents"]
+            self._metadatas = columns["metadatas"]
+            self._rows = {key: row for row, key in enumerate(self._keys)}
+            self.dims = vectors.shape[1] if vectors.ndim == 2 and vectors.shape[1] else self.dims
+            self._version = version
+            if self._quantizer is None:
+                # Written without codes or with another quantization, they are built in memory
+                self._encode_rows(range(self._count))
+
+    def _load_codes(self, generation: str, dims: int, count: int):
+        if not self.quantization or not dims:
+            return None, None
+        try:
+            with np.load(os.path.join(self.path, QUANTIZER_FILE.format(generation))) as state:
+                if str(state["kind"]) != self.quantization:
+                    return None, None
+                quantizer = get_quantizer(self.quantization, dims)
+                quantizer.load(state)
+        except FileNotFoundError:
+            if os.path.exists(os.path.join(self.path, VECTORS_FILE.format(generation))):
+                return None, None
+            raise
+        codes = np.load(os.path.join(self.path, CODES_FILE.format(generation)), mmap_mode="r")
+        return (codes, quantizer) if len(codes) == count else (None, None)
+
+    def persist(self) -> None:
+        if not self.path:
+            return
+        generation = uuid.uuid4().hex
+        with self._lock:
+            vectors = np.array(self._vectors[:self._count], dtype=np.float32)
+            codes = np.array(self._codes[:self._count]) if self._codes is not None else None
+            quantizer = self._quantizer
+            columns = {"generation": generation, "keys": list(self._keys), "filenames": list(self._filenames), "contents": list(self._contents), "metadatas": list(self._metadatas)}
+        np.save(os.path.join(self.path, VECTORS_FILE.format(generation)), vectors)
+        if codes is not None:
+            np.save(os.path.join(self.path, CODES_FILE.format(generation)), codes)
+            np.savez(os.path.join(self.path, QUANTIZER_FILE.format(generation)), kind=quantizer.kind, **quantizer.state())
+        documents_tmp = os.path.join(self.path, f".{generation}.{DOCUMENTS_FILE}")
+        with open(documents_tmp, "w", encoding="utf-8") as f:
+            json.dump(columns, f)
+        # Readers switch to the new generation when the documents file naming it is renamed in place
+        os.replace(documents_tmp, os.path.join(self.path, DOCUMENTS_FILE))
+        self._version = self._files_version()
+        with self._lock:
+            # Map the written matrices so the pages are shared with the other workers
+            if self._count == len(vectors):
+                self._vectors = np.load(os.path.join(self.path, VECTORS_FILE.format(generation)), mmap_mode="r")
+                if codes is not None and self._quantizer is quantizer:
+                    self._codes = np.load(os.path.join(self.path, CODES_FILE.format(generation)), mmap_mode="r")
+        for pattern in (VECTORS_FILE, CODES_FILE, QUANTIZER_FILE):
+            for previous in glob.glob(os.path.join(self.path, pattern.format("*"))):
+                if generation not in os.path.basename(previous):
+                    try:
+                        os.remove(previous)
+                    except OSError:
+                        # Still mapped by a worker on Windows, removed by a later write
+                        pass
+
+    '''
+    groups several writes: the store is locked for the other writers (threads and workers)
+    for the whole block and persisted once at its end
+    '''
+    @contextmanager
+    def batch(self):
+        with self._write_lock:
+            if self._batch_depth == 0 and self.path and fcntl is not None:
+                self._lock_file = open(os.path.join(self.path, LOCK_FILE), "w")
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._batch_depth += 1
+            try:
+                if self._batch_depth == 1:
+                    self._refresh()
+                yield self
+                if self._batch_depth == 1:
+                    self.persist()
+            finally:
+                self._batch_depth -= 1
+                if self._batch_depth == 0 and self._lock_file is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    # Writes
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    @staticmethod
+    def _grow(matrix: np.ndarray, count: int, rows: int) -> np.ndarray:
+        # The matrices grow by doubling, a memory-mapped matrix is copied to memory on the first write
+        capacity = matrix.shape[0]
+        if count + rows <= capacity and not isinstance(matrix, np.memmap):
+            return matrix
+        grown = np.zeros((max(count + rows, 2 * capacity, 1024), matrix.shape[1]), dtype=matrix.dtype)
+        if count:
+            grown[:count] = matrix[:count]
+        return grown
+
+    def _reserve(self, rows: int) -> None:
+        if self.dims is None:
+            return
+        if self._vectors.shape[1] != self.dims:
+            self._vectors = np.zeros((0, self.dims), dtype=np.float32)
+        self._vectors = self._grow(self._vectors, self._count, rows)
+        if self._codes is not None:
+            self._codes = self._grow(self._codes, self._count, rows)
+
+    def _encode_rows(self, rows: Iterable[int]) -> None:
+        # Codes of the rows just written. The quantizer is trained once there are enough rows, and
+        # again each time the corpus doubled until it is trained on a full sample
+        if not self.quantization or not self._count:
+            return
+        if self._quantizer is None:
+            self._quantizer = get_quantizer(self.quantization, self.dims)
+        if not self._quantizer.trained:
+            if self._count >= self._quantizer.min_train_rows:
+                self.train_quantizer()
+            return
+        if self._count >= 2 * self._trained_rows and self._trained_rows < self._quantizer.training_rows:
+            self.train_quantizer()
+            return
+        rows = np.fromiter(rows, dtype=np.int64)
+        if len(rows):
+            self._codes[rows] = self._quantizer.encode(self._vectors[rows])
+
+    '''
+    trains the quantizer on every stored vector and encodes them again
+    '''
+    def train_quantizer(self) -> None:
+        if not self.quantization or not self._count:
+            return
+        with self._lock:
+            quantizer = get_quantizer(self.quantization, self.dims)
+            vectors = np.asarray(self._vectors[:self._count])
+            quantizer.train(vectors)
+            codes = np.zeros((self._vectors.shape[0], quantizer.code_size), dtype=np.uint8)
+            codes[:self._count] = quantizer.encode(vectors)
+            self._quantizer = quantizer
+            self._codes = codes
+            self._trained_rows = self._count
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        embeddings: Optional[List[List[float]]] = None,
+        keys: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        vectors = np.asarray(embeddings if embeddings is not None else [self.embedding_function(text) for text in texts], dtype=np.float32)
+        vectors = self._normalize(vectors)
+        ids = []
+        rows = []
+        with self.batch(), self._lock:
+            self.dims = self.dims or vectors.shape[1]
+            self._reserve(len(texts))
+            for i, text in enumerate(texts):
+                key = keys[i] if keys else f"doc:{uuid.uuid4().hex}"
+                metadata = metadatas[i] if metadatas else {}
+                row = self._rows.get(key)
+                if row is None:
+                    row = self._count
+                    self._count += 1
+                    self._rows[key] = row
+                    self._keys.append(key)
+                    self._filenames.append(metadata.get("filename", ""))
+                    self._contents.append(text)
+                    self._metadatas.append(json.dumps(metadata))
+                else:
+                    self._filenames[row] = metadata.get("filename", "")
+                    self._contents[row] = text
+                    self._metadatas[row] = json.dumps(metadata)
+                self._vectors[row] = vectors[i]
+                rows.append(row)
+                ids.append(key)
+            self._encode_rows(rows)
+        return ids
+
+    def delete_keys(self, keys: Iterable[str]) -> int:
+        deleted = 0
+        with self.batch(), self._lock:
+            self._reserve(0)
+            columns = (self._keys, self._filenames, self._contents, self._metadatas)
+            for key in keys:
+                row = self._rows.pop(key, None)
+                if row is None:
+                    continue
+                # Move the last row into the freed one so the matrix stays contiguous
+                last = self._count - 1
+                if row != last:
+                    self._vectors[row] = self._vectors[last]
+                    if self._codes is not None:
+                        self._codes[row] = self._codes[last]
+                    for column in columns:
+                        column[row] = column[last]
+                    self._rows[self._keys[row]] = row
+                for column in columns:
+                    column.pop()
+                self._count -= 1
+                deleted += 1
+        return deleted
+
+    def get_file_keys(self, filename: str) -> List[str]:
+        self._refresh()
+        with self._lock:
+            return [key for key, name in zip(self._keys, self._filenames) if name == filename]
+
+    def get_vectors(self, keys: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Stored (normalized) vector of each chunk key, None for the keys not stored."""
+        self._refresh()
+        with self._lock:
+            rows = [self._rows.get(key) for key in keys]
+            return [np.array(self._vectors[row]) if row is not None else None for row in rows]
+
+    def delete_file(self, filename: str) -> int:
+        return self.delete_keys(self.get_file_keys(filename))
+
+    def delete_all(self) -> int:
+        self._refresh()
+        with self._lock:
+            keys = list(self._keys)
+        return self.delete_keys(keys)
+
+    def iter_document_pages(self, fields: Sequence[str] = ("key", "filename"), page_size: int = 1000, filenames: Optional[Iterable[str]] = None) -> Iterator[List[dict]]:
+        self._refresh()
+        filenames = set(filenames) if filenames is not None else None
+        with self._lock:
+            keys = [key for key, name in zip(self._keys, self._filenames) if filenames is None or name in filenames]
+        for start in range(0, len(keys), page_size):
+            page = []
+            with self._lock:
+                for key in keys[start:start + page_size]:
+                    row = self._rows.get(key)
+                    if row is None:
+                        continue
+                    metadata = json.loads(self._metadatas[row])
+                    document = {"key": key, "filename": self._filenames[row], "source": metadata.get("source"), "content": self._contents[row], "metadata": metadata}
+                    page.append({field: document[field] for field in fields})
+            if page:
+                yield page
+
+    # Search
+
+    def similarity_search_by_vectors(self, embeddings: List[List[float]], k: int = 4) -> List[List[Tuple[Document, float]]]:
+        """Top k documents and distances (1 - cosine similarity) of several query vectors at once."""
+        self._refresh()
+        queries = self._normalize(np.atleast_2d(np.asarray(embeddings, dtype=np.float32)))
+        # The rows move when chunks are deleted, the search runs under the lock
+        with self._lock:
+            if self._count == 0:
+                return [[] for _ in queries]
+            k = min(k, self._count)
+            quantized = self._quantizer is not None and self._quantizer.trained and self._codes is not None
+            candidates = min(self._count, k * (self.rerank_factor or self._quantizer.rerank_factor)) if quantized else k
+            if quantized:
+                scores = self._quantizer.similarities(queries, self._codes[:self._count])
+            else:
+                # (queries x dims) @ (dims x chunks): every similarity of every query in one product
+                scores = queries @ self._vectors[:self._count].T
+            top = np.argpartition(-scores, candidates - 1, axis=1)[:, :candidates]
+            results = []
+            for query, query_scores, rows in zip(queries, scores, top):
+                if quantized:
+                    # Exact order of the candidates, reading their rows in file order
+                    rows = np.sort(rows)
+                    order, similarities = rerank(query, self._vectors[rows], k)
+                    rows = rows[order]
+                else:
+                    rows = rows[np.argsort(-query_scores[rows])]
+                    similarities = query_scores[rows]
+                results.append([
+                    (Document(page_content=self._contents[row], metadata=json.loads(self._metadatas[row])), 1 - float(similarity))
+                    for row, similarity in zip(rows, similarities)
+                ])
+        return results
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vectors([embedding], k=k)[0]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k=k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self.embedding_function(query), k=k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k)]
+
+    @classmethod
+    def from_texts(
+        cls: Type[NumpyVectorStore],
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        path: Optional[str] = None,
+        **kwargs: Any,
+    ) -> NumpyVectorStore:
+        store = cls(embedding.embed_query, path=path)
+        store.add_texts(texts, metadatas, embeddings=embedding.embed_documents(texts), **kwargs)
+        return store
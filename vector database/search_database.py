@@ -7,21 +7,25 @@ logging: This is used for logging messages and information.
 uuid: Used for generating universally unique identifiers (UUIDs).
 pydantic: A data validation and parsing library.
 os: Allows access to operating system functionality, used for reading environment variables.
-numpy: A library for numerical computing, used for handling embeddings.
 azure: A Python SDK for Azure services.
 langchain: Custom modules related to language processing.
 '''
+import asyncio
 import json
 import logging
+import threading
+import time
 import uuid
-from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple, Type
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple, Type
 from pydantic import BaseModel, root_validator
 import os
 
-import numpy as np
-from azure.core.exceptions import ResourceNotFoundError
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents import SearchClient
+from azure.search.documents.aio import SearchClient as AsyncSearchClient
 from azure.search.documents.indexes import SearchIndexClient
 from azure.search.documents.models import Vector
 from azure.search.documents.indexes.models import (
@@ -46,10 +50,21 @@ from langchain.schema import BaseRetriever
 from langchain.utils import get_from_dict_or_env
 from langchain.vectorstores.base import VectorStore
 
+from utilities.serialization import json_vector_size, to_json_floats
+
 logger = logging.getLogger()
 
 AZURESEARCH_DIMENSIONS = int(os.environ.get("AZURESEARCH_DIMENSIONS", 1536)) # Default to OpenAI's ada-002 embedding model vector size
 
+# Named vector index profiles, selected per index when it is created (see get_search_client)
+INDEX_PROFILES = {
+    "low-latency": {"kind": "hnsw", "m": 4, "efConstruction": 200, "efSearch": 100},
+    "balanced": {"kind": "hnsw", "m": 8, "efConstruction": 400, "efSearch": 200},
+    "high-recall": {"kind": "hnsw", "m": 10, "efConstruction": 800, "efSearch": 800},
+    "flat": {"kind": "exhaustiveKnn"},
+}
+DEFAULT_INDEX_PROFILE = os.environ.get("VECTOR_INDEX_PROFILE", "balanced")
+
 # Allow overriding field names for Azure Search
 FIELDS_ID = os.environ.get("AZURESEARCH_FIELDS_ID", "id")
 FIELDS_TITLE = os.environ.get("AZURESEARCH_FIELDS_TITLE", "title")
@@ -61,13 +76,41 @@ FIELDS_METADATA = os.environ.get("AZURESEARCH_FIELDS_TAG", "metadata")
 
 MAX_UPLOAD_BATCH_SIZE = 1000
 MAX_DELETE_BATCH_SIZE = 1000
+MAX_LIST_PAGE_SIZE = 1000
+# Azure Cognitive Search rejects indexing requests above 16 MB
+MAX_UPLOAD_BATCH_BYTES = int(os.environ.get("AZURESEARCH_MAX_UPLOAD_BATCH_BYTES", 15 * 1024 * 1024))
+MAX_UPLOAD_BATCHES_IN_FLIGHT = int(os.environ.get("AZURESEARCH_MAX_UPLOAD_BATCHES_IN_FLIGHT", 4))
+MAX_DELETE_BATCHES_IN_FLIGHT = int(os.environ.get("AZURESEARCH_MAX_DELETE_BATCHES_IN_FLIGHT", 8))
+MAX_DELETE_PASSES = 5
+MAX_UPLOAD_RETRIES = int(os.environ.get("AZURESEARCH_MAX_UPLOAD_RETRIES", 3))
+# Per document status codes worth retrying (version conflict, index busy, throttled, unavailable)
+RETRYABLE_STATUS_CODES = (409, 422, 429, 503)
+
+'''
+wraps a blocking embedding function so it runs in a worker thread, used by the async store
+when no native async embedding function is given
+'''
+def to_async(function: Callable) -> Callable:
+    async def run(*args, **kwargs):
+        return await asyncio.to_thread(function, *args, **kwargs)
+    return run
+
+'''
+returns the vector index settings of a profile of INDEX_PROFILES (DEFAULT_INDEX_PROFILE when
+name is None)
+'''
+def get_index_profile(name: Optional[str] = None) -> dict:
+    name = name or DEFAULT_INDEX_PROFILE
+    if name not in INDEX_PROFILES:
+        raise ValueError(f"Unknown vector index profile {name}, expected one of {', '.join(INDEX_PROFILES)}")
+    return INDEX_PROFILES[name]
 
 '''
 initializes and returns a SearchClient for Azure Cognitive Search 
 based on provided credentials and settings. It also creates the 
 search index if it doesn't exist.
 '''
-def get_search_client(endpoint: str, key: str, index_name: str, semantic_configuration_name:str = None) -> SearchClient:
+def get_search_client(endpoint: str, key: str, index_name: str, semantic_configuration_name:str = None, index_profile: str = None) -> SearchClient:
     if key is None:
         credential = DefaultAzureCredential()
     else:
@@ -80,7 +123,7 @@ def get_search_client(endpoint: str, key: str, index_name: str, semantic_configu
         # Fields configuration
         fields = [
             SimpleField(name=FIELDS_ID, type=SearchFieldDataType.String,
-                        key=True, filterable=True),
+                        key=True, filterable=True, sortable=True),
             SearchableField(name=FIELDS_TITLE, type=SearchFieldDataType.String,
                             searchable=True, retrievable=True),
             SearchableField(name=FIELDS_CONTENT, type=SearchFieldDataType.String,
@@ -95,7 +138,9 @@ def get_search_client(endpoint: str, key: str, index_name: str, semantic_configu
         
         '''
         vector search algorithm - hierarchical navigable small world (for Azure Cognitive
-        search index)
+        search index), with the parameters of the index profile (the service accepts m in
+        4-10 and efConstruction/efSearch in 100-1000). The "flat" profile uses an exhaustive
+        KNN instead, which needs a service API version that supports it
         m: This parameter controls the degree of the graph in the HNSW algorithm. It determines how many connections 
         each node has in the graph. A higher value typically results in higher recall (finding more similar items), 
         but it can also increase computation time and memory usage.
@@ -108,17 +153,17 @@ def get_search_client(endpoint: str, key: str, index_name: str, semantic_configu
         Cosine similarity is commonly used for text and high-dimensional data because it measures the cosine of the 
         angle between vectors, which is a way to compare their directions in space.
         '''
+        parameters = dict(get_index_profile(index_profile))
+        kind = parameters.pop("kind")
         vector_search = VectorSearch(
             algorithm_configurations=[
                 VectorSearchAlgorithmConfiguration(
                     name="default",
-                    kind="hnsw",
+                    kind=kind,
                     hnsw_parameters={
-                        "m": 4,
-                        "efConstruction": 400,
-                        "efSearch": 500,
+                        **parameters,
                         "metric": "cosine"
-                    }
+                    } if kind == "hnsw" else None
                 )
             ]
         )
@@ -148,6 +193,173 @@ def get_search_client(endpoint: str, key: str, index_name: str, semantic_configu
     # Create the search client
     return SearchClient(endpoint=endpoint, index_name=index_name, credential=AzureKeyCredential(key))
 
+'''
+converts a search result to a (Document, score) tuple
+'''
+def to_document_and_score(result: dict) -> Tuple[Document, float]:
+    return (
+        Document(
+            page_content=result[FIELDS_CONTENT], metadata=json.loads(
+                result[FIELDS_METADATA])
+        ),
+        1 - float(result['@search.score']),
+    )
+
+def to_semantic_answers_dict(semantic_answers) -> dict:
+    semantic_answers_dict = {}
+    for semantic_answer in semantic_answers or []:
+        semantic_answers_dict[semantic_answer.key] = {
+            "text": semantic_answer.text,
+            "highlights": semantic_answer.highlights
+        }
+    return semantic_answers_dict
+
+'''
+converts a semantic search result to a (Document, score) tuple with its captions and answers
+'''
+def to_semantic_document_and_score(result: dict, semantic_answers_dict: dict) -> Tuple[Document, float]:
+    return (
+        Document(
+            page_content=result['content'],
+            metadata={**json.loads(result['metadata']), **{
+                'captions': {
+                    'text': result.get('@search.captions', [{}])[0].text,
+                    'highlights': result.get('@search.captions', [{}])[0].highlights
+                } if result.get("@search.captions") else {},
+                'answers': semantic_answers_dict.get(json.loads(result['metadata']).get('key'), '')
+            }
+            }
+        ),
+        1 - float(result['@search.score']),
+    )
+
+'''
+Uploads (or deletes, with action="delete") documents in batches bounded by a number of
+documents and by payload bytes. Up to max_in_flight batches are sent concurrently (the
+SearchClient is thread safe) while the caller keeps building the next ones; once that many
+are pending, add() waits for the oldest one. Only the documents that failed with a retryable
+status are sent again, with exponential backoff. The results of the documents that still
+failed are kept in failed, close() raises them unless raise_on_failure is False. The latency
+of every request is recorded for stats()
+'''
+class AzureSearchBulkIndexer:
+    def __init__(
+        self,
+        client: SearchClient,
+        max_batch_size: int = MAX_UPLOAD_BATCH_SIZE,
+        max_batch_bytes: int = MAX_UPLOAD_BATCH_BYTES,
+        max_in_flight: int = MAX_UPLOAD_BATCHES_IN_FLIGHT,
+        max_retries: int = MAX_UPLOAD_RETRIES,
+        retry_backoff: float = 0.5,
+        action: str = "upload",
+        raise_on_failure: bool = True,
+    ):
+        self.client = client
+        self.send_documents = getattr(client, f"{action}_documents")
+        self.raise_on_failure = raise_on_failure
+        self.max_batch_size = max_batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.executor = ThreadPoolExecutor(max_workers=self.max_in_flight)
+        self.pending = deque()
+        self.batch = []
+        self.batch_bytes = 0
+        self.failed = []
+        self.latencies = []
+        self.documents = 0
+        self.batches = 0
+        self.retried = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.executor.shutdown(wait=True)
+
+    '''
+    size is the JSON bytes of the document when the caller knows them without serializing it
+    '''
+    def add(self, document: dict, size: Optional[int] = None) -> None:
+        size = len(json.dumps(document)) if size is None else size
+        if self.batch and (len(self.batch) == self.max_batch_size or self.batch_bytes + size > self.max_batch_bytes):
+            self.flush()
+        self.batch.append(document)
+        self.batch_bytes += size
+
+    def flush(self) -> None:
+        if not self.batch:
+            return
+        # Back pressure: wait for the oldest batch before having more than max_in_flight pending
+        while len(self.pending) >= self.max_in_flight:
+            self.pending.popleft().result()
+        self.pending.append(self.executor.submit(self._upload, self.batch))
+        self.batches += 1
+        self.batch = []
+        self.batch_bytes = 0
+
+    def close(self) -> None:
+        self.flush()
+        while self.pending:
+            self.pending.popleft().result()
+        self.executor.shutdown(wait=True)
+        if self.failed and self.raise_on_failure:
+            raise Exception(self.failed)
+
+    def failed_keys(self) -> List[str]:
+        return [result.key for result in self.failed]
+
+    def _upload(self, batch: List[dict]) -> None:
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                response = self.send_documents(documents=batch)
+            except HttpResponseError as e:
+                # The whole request failed (throttled, unavailable...), send the batch again
+                if attempt == self.max_retries or e.status_code not in RETRYABLE_STATUS_CODES:
+                    raise
+                time.sleep(self.retry_backoff * 2 ** attempt)
+                continue
+            finally:
+                with self._lock:
+                    self.latencies.append(time.perf_counter() - start)
+            errors = {r.key: r for r in response if not r.succeeded}
+            retryable = {key for key, r in errors.items() if r.status_code in RETRYABLE_STATUS_CODES}
+            with self._lock:
+                self.documents += len(batch) - len(errors)
+                self.failed.extend(r for key, r in errors.items() if key not in retryable)
+            if not retryable:
+                return
+            if attempt == self.max_retries:
+                with self._lock:
+                    self.failed.extend(errors[key] for key in retryable)
+                return
+            # Only send the documents that failed again
+            batch = [document for document in batch if document[FIELDS_ID] in retryable]
+            with self._lock:
+                self.retried += len(batch)
+            time.sleep(self.retry_backoff * 2 ** attempt)
+
+    def stats(self) -> dict:
+        latencies = sorted(self.latencies)
+        percentile = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else 0.0
+        return {
+            "documents": self.documents,
+            "batches": self.batches,
+            "requests": len(latencies),
+            "retried": self.retried,
+            "failed": len(self.failed),
+            "latency_mean": sum(latencies) / len(latencies) if latencies else 0.0,
+            "latency_p50": percentile(0.5),
+            "latency_p95": percentile(0.95),
+            "latency_max": latencies[-1] if latencies else 0.0,
+        }
+
 '''
 This class represents an interface to Azure Cognitive Search. 
 It provides methods for adding texts to the search index, performing 
@@ -163,6 +375,8 @@ class AzureSearch(VectorStore):
         embedding_function: Callable,
         semantic_configuration_name: str = None,
         semantic_query_language: str = "en-us",
+        async_embedding_function: Callable = None,
+        index_profile: str = None,
         **kwargs: Any,
     ):
         """Initialize with necessary components."""
@@ -180,8 +394,22 @@ class AzureSearch(VectorStore):
         self.index_name = index_name
         self.semantic_configuration_name = semantic_configuration_name
         self.semantic_query_language = semantic_query_language
+        self.index_profile = index_profile
         self.client = get_search_client(
-            self.azure_cognitive_search_name, self.azure_cognitive_search_key, self.index_name, self.semantic_configuration_name)
+            self.azure_cognitive_search_name, self.azure_cognitive_search_key, self.index_name, self.semantic_configuration_name, self.index_profile)
+        self.async_embedding_function = async_embedding_function
+        self._async_store = None
+
+    @property
+    def async_store(self) -> AsyncAzureSearch:
+        """Async counterpart of this store, created on first use and reused afterwards."""
+        if self._async_store is None:
+            self._async_store = AsyncAzureSearch(
+                self.azure_cognitive_search_name, self.azure_cognitive_search_key, self.index_name,
+                self.async_embedding_function or to_async(self.embedding_function),
+                semantic_configuration_name=self.semantic_configuration_name,
+                semantic_query_language=self.semantic_query_language)
+        return self._async_store
 
     def add_texts(
         self,
@@ -192,41 +420,34 @@ class AzureSearch(VectorStore):
         """Add texts data to an existing index."""
         keys = kwargs.get("keys")
         keys = list(map(lambda x: x.replace(':','_'), keys)) if keys else None
+        # Precomputed (batched) embeddings, otherwise each text is embedded on its own
+        embeddings = kwargs.get("embeddings")
         ids = []
-        # Write data to index
-        data = []
-        for i, text in enumerate(texts):
-            # Use provided key otherwise use default key
-            key = keys[i] if keys else str(uuid.uuid4())
-            metadata = metadatas[i] if metadatas else {}
-            # Add data to index
-            data.append({
-                "@search.action": "upload",
-                FIELDS_ID: key,
-                FIELDS_TITLE : metadata.get(FIELDS_TITLE, metadata.get("source", "[]").split('[')[1].split(']')[0]),
-                FIELDS_TAG: metadata.get(FIELDS_TAG, ""),
-                FIELDS_CONTENT: text,
-                FIELDS_CONTENT_VECTOR: np.array(
-                    self.embedding_function(text), dtype=np.float32
-                ).tolist(),
-                FIELDS_METADATA: json.dumps(metadata)
-            })
-            ids.append(key)
-            # Upload data in batches
-            if len(data) == MAX_UPLOAD_BATCH_SIZE:
-                response = self.client.upload_documents(documents=data)
-                # Check if all documents were successfully uploaded
-                if not all([r.succeeded for r in response]):
-                    raise Exception(response)
-                # Reset data
-                data = []
-        # Upload data to index
-        response = self.client.upload_documents(documents=data)
-        # Check if all documents were successfully uploaded
-        if all([r.succeeded for r in response]):
-            return ids
-        else:
-            raise Exception(response)
+        # Write data to index, the batches are uploaded in the background while the next ones are built
+        with AzureSearchBulkIndexer(self.client) as indexer:
+            for i, text in enumerate(texts):
+                # Use provided key otherwise use default key
+                key = keys[i] if keys else str(uuid.uuid4())
+                metadata = metadatas[i] if metadatas else {}
+                document = {
+                    "@search.action": "upload",
+                    FIELDS_ID: key,
+                    FIELDS_TITLE : metadata.get(FIELDS_TITLE, metadata.get("source", "[]").split('[')[1].split(']')[0]),
+                    # The tag is filterable, it holds the filename so the chunks of a file can be listed
+                    FIELDS_TAG: metadata.get(FIELDS_TAG, metadata.get("filename", "")),
+                    FIELDS_CONTENT: text,
+                    FIELDS_METADATA: json.dumps(metadata)
+                }
+                # The batch size is measured without serializing the vector, its JSON length is bounded from its dimensions
+                size = len(json.dumps(document)) + len(FIELDS_CONTENT_VECTOR) + 4
+                vector = embeddings[i] if embeddings else self.embedding_function(text)
+                document[FIELDS_CONTENT_VECTOR] = to_json_floats(vector)
+                # Add data to index
+                indexer.add(document, size=size + json_vector_size(len(vector)))
+                ids.append(key)
+        self.upload_stats = indexer.stats()
+        logger.info(f"Uploaded {self.upload_stats['documents']} documents in {self.upload_stats['batches']} batches")
+        return ids
 
     def similarity_search(
         self, query: str, k: int = 4, **kwargs: Any
@@ -259,23 +480,12 @@ class AzureSearch(VectorStore):
         """
         results = self.client.search(
             search_text="",
-            vector=Vector(value=np.array(self.embedding_function(
-                query), dtype=np.float32).tolist(), k=k, fields=FIELDS_CONTENT_VECTOR),
+            vector=Vector(value=to_json_floats(self.embedding_function(query)), k=k, fields=FIELDS_CONTENT_VECTOR),
             select=[f"{FIELDS_TITLE},{FIELDS_CONTENT},{FIELDS_METADATA}"],
             filter=filters
         )
         # Convert results to Document objects
-        docs = [
-            (
-                Document(
-                    page_content=result[FIELDS_CONTENT], metadata=json.loads(
-                        result[FIELDS_METADATA]) 
-                ),
-                1 - float(result['@search.score']),
-            )
-            for result in results
-        ]
-        return docs
+        return [to_document_and_score(result) for result in results]
 
     def hybrid_search(
         self, query: str, k: int = 4, **kwargs: Any
@@ -308,24 +518,13 @@ class AzureSearch(VectorStore):
         """
         results = self.client.search(
             search_text=query,
-            vector=Vector(value=np.array(self.embedding_function(
-                query), dtype=np.float32).tolist(), k=k, fields=FIELDS_CONTENT_VECTOR),
+            vector=Vector(value=to_json_floats(self.embedding_function(query)), k=k, fields=FIELDS_CONTENT_VECTOR),
             select=[f"{FIELDS_TITLE},{FIELDS_CONTENT},{FIELDS_METADATA}"],
             filter=filters,
             top=k
         )
         # Convert results to Document objects
-        docs = [
-            (
-                Document(
-                    page_content=result[FIELDS_CONTENT], metadata=json.loads(
-                        result[FIELDS_METADATA])
-                ),
-                1 - float(result['@search.score']),
-            )
-            for result in results
-        ]
-        return docs
+        return [to_document_and_score(result) for result in results]
 
     def semantic_hybrid_search(
         self, query: str, k: int = 4, **kwargs: Any
@@ -358,8 +557,7 @@ class AzureSearch(VectorStore):
         """
         results = self.client.search(
             search_text=query,
-            vector=Vector(value=np.array(self.embedding_function(
-                query), dtype=np.float32).tolist(), k=k, fields=FIELDS_CONTENT_VECTOR),
+            vector=Vector(value=to_json_floats(self.embedding_function(query)), k=k, fields=FIELDS_CONTENT_VECTOR),
             select=[f"{FIELDS_TITLE},{FIELDS_CONTENT},{FIELDS_METADATA}"],
             filter=filters,
             query_type="semantic",
@@ -370,32 +568,9 @@ class AzureSearch(VectorStore):
             top=k
         )
         # Get Semantic Answers
-        semantic_answers = results.get_answers()
-        semantic_answers_dict = {}
-        for semantic_answer in semantic_answers:
-            semantic_answers_dict[semantic_answer.key] = {
-                "text": semantic_answer.text,
-                "highlights": semantic_answer.highlights
-            }
+        semantic_answers_dict = to_semantic_answers_dict(results.get_answers())
         # Convert results to Document objects
-        docs = [
-            (
-                Document(
-                    page_content=result['content'],
-                    metadata={**json.loads(result['metadata']), **{
-                        'captions': {
-                            'text': result.get('@search.captions', [{}])[0].text,
-                            'highlights': result.get('@search.captions', [{}])[0].highlights
-                        } if result.get("@search.captions") else {},
-                        'answers': semantic_answers_dict.get(json.loads(result['metadata']).get('key'), '')
-                    }
-                    }
-                ),
-                1 - float(result['@search.score']),
-            )
-            for result in results
-        ]
-        return docs
+        return [to_semantic_document_and_score(result, semantic_answers_dict) for result in results]
 
     @classmethod
     def from_texts(
@@ -427,20 +602,280 @@ class AzureSearch(VectorStore):
         return index_client.get_index(name=self.index_name)
 
 
-    def delete_keys(self, keys: List[str]):
-        documents = []
-        keys = list(map(lambda x: x.replace(':','_'), keys)) if keys else None
-        for i, key in enumerate(keys):
-            documents.append(
-                {
-                    "@search.action": "delete",
-                    FIELDS_ID: key
-                }
-            )
-            if i % MAX_DELETE_BATCH_SIZE == 0 and i != 0:
-                self.client.delete_documents(documents=documents)
-                documents = []
-        return self.client.delete_documents(documents=documents)
+    def get_file_keys(self, filename: str) -> List[str]:
+        """Return the keys of the chunks stored for a file (the tag field holds the filename)."""
+        # OData string literals escape single quotes by doubling them
+        escaped_filename = filename.replace("'", "''")
+        results = self.client.search(
+            search_text="*",
+            filter=f"{FIELDS_TAG} eq '{escaped_filename}'",
+            select=[f"{FIELDS_ID},{FIELDS_METADATA}"]
+        )
+        keys = [json.loads(result[FIELDS_METADATA]).get('key', result[FIELDS_ID]) for result in results]
+        if keys:
+            return keys
+        # Chunks stored before the tag held the filename, their tag is backfilled for the next lookups
+        return [row["key"] for row in self._find_untagged_file_rows(filename, backfill=True)]
+
+    def get_vectors(self, keys: Sequence[str]) -> List[Optional[List[float]]]:
+        """Stored vector of each chunk key, read with one filtered search on the document ids.
+
+        None for the keys not stored, and for every key of an index whose vector field is not
+        retrievable.
+        """
+        ids = [key.replace(':', '_') for key in keys]
+        if not ids:
+            return []
+        escaped_ids = "|".join(id.replace("'", "''") for id in ids)
+        results = self.client.search(
+            search_text="*",
+            filter=f"search.in({FIELDS_ID}, '{escaped_ids}', '|')",
+            select=[FIELDS_ID, FIELDS_CONTENT_VECTOR],
+            top=len(ids),
+        )
+        vectors = {result[FIELDS_ID]: result.get(FIELDS_CONTENT_VECTOR) for result in results}
+        return [vectors.get(id) or None for id in ids]
+
+    def delete_file(self, filename: str) -> int:
+        """Delete every chunk of a file, found with a filter on the tag (filename) field.
+
+        The chunks stored before the tag held the filename are found from the filename of
+        their metadata when no chunk has the tag.
+        """
+        escaped_filename = filename.replace("'", "''")
+        deleted = self.delete_by_filter(f"{FIELDS_TAG} eq '{escaped_filename}'")
+        if deleted:
+            return deleted
+        ids = [row["id"] for row in self._find_untagged_file_rows(filename)]
+        return len(ids) - len(self.delete_keys(ids, ids=True)) if ids else 0
+
+    def delete_all(self) -> int:
+        """Delete every chunk of the index, returns the number of documents deleted."""
+        return self.delete_by_filter()
+
+    def _find_untagged_file_rows(self, filename: str, backfill: bool = False) -> List[dict]:
+        """Chunks of a file without a tag, matched on the filename of their metadata.
+
+        The metadata field is not filterable, so every untagged chunk is listed. With
+        backfill, the tag of the chunks found is set to the filename (merge), so the tag
+        filter finds them from then on.
+        """
+        rows = [
+            row
+            for page in self.iter_document_pages(fields=("id", "key", "filename"), filter=f"{FIELDS_TAG} eq '' or {FIELDS_TAG} eq null")
+            for row in page
+            if row["filename"] == filename
+        ]
+        if rows and backfill:
+            with AzureSearchBulkIndexer(self.client, action="merge", raise_on_failure=False) as indexer:
+                for row in rows:
+                    indexer.add({FIELDS_ID: row["id"], FIELDS_TAG: filename})
+            if indexer.failed_keys():
+                logger.warning(f"Failed to tag {len(indexer.failed_keys())} documents of {filename} in {self.index_name}")
+        return rows
+
+    @staticmethod
+    def _to_listing_row(result: dict, fields: Sequence[str]) -> dict:
+        metadata = json.loads(result[FIELDS_METADATA]) if result.get(FIELDS_METADATA) else {}
+        document = {
+            "id": result[FIELDS_ID],
+            "key": metadata.get("key", result[FIELDS_ID]),
+            "filename": result.get(FIELDS_TAG) or metadata.get("filename"),
+            "source": metadata.get("source"),
+            "content": result.get(FIELDS_CONTENT),
+            "metadata": metadata,
+        }
+        return {field: document[field] for field in fields}
+
+    def iter_document_pages(self, fields: Sequence[str] = ("key", "filename"), page_size: int = MAX_LIST_PAGE_SIZE, filenames: Optional[Iterable[str]] = None, filter: Optional[str] = None) -> Iterator[List[dict]]:
+        """List the chunks of the index page by page, with only the requested columns.
+
+        Pages are read lazily and ordered by id, each page continues after the last id of
+        the previous one (keyset paging), so the listing is not limited by the 100k $skip
+        cap. Indexes created before the id field was sortable fall back to the service
+        continuation paging. filenames keeps only the chunks of these files (tag filter),
+        filter is any additional OData filter. The "id" column is the document key.
+        """
+        page_size = min(page_size, MAX_LIST_PAGE_SIZE)
+        select = [FIELDS_ID, FIELDS_TAG]
+        if {"key", "source", "metadata"} & set(fields):
+            select.append(FIELDS_METADATA)
+        if "content" in fields:
+            select.append(FIELDS_CONTENT)
+        filters = []
+        if filenames is not None:
+            escaped_filenames = "|".join(filename.replace("'", "''") for filename in filenames)
+            filters.append(f"search.in({FIELDS_TAG}, '{escaped_filenames}', '|')")
+        if filter:
+            filters.append(f"({filter})")
+        last_id = None
+        while True:
+            page_filters = filters + ([f"{FIELDS_ID} gt '{last_id.replace(chr(39), chr(39) * 2)}'"] if last_id is not None else [])
+            try:
+                results = list(self.client.search(
+                    search_text="*",
+                    filter=" and ".join(page_filters) or None,
+                    select=select,
+                    order_by=[f"{FIELDS_ID} asc"],
+                    top=page_size,
+                ))
+            except HttpResponseError as e:
+                if last_id is not None:
+                    raise
+                logger.warning(f"Keyset listing not available on {self.index_name}, using the service paging: {e.message}")
+                yield from self._iter_document_pages_by_skip(select, fields, filters)
+                return
+            if results:
+                yield [self._to_listing_row(result, fields) for result in results]
+            if len(results) < page_size:
+                return
+            last_id = results[-1][FIELDS_ID]
+
+    def _iter_document_pages_by_skip(self, select: List[str], fields: Sequence[str], filters: List[str]) -> Iterator[List[dict]]:
+        results = self.client.search(search_text="*", filter=" and ".join(filters) or None, select=select)
+        for page in results.by_page():
+            rows = [self._to_listing_row(result, fields) for result in page]
+            if rows:
+                yield rows
+
+    def delete_keys(self, keys: Iterable[str], ids: bool = False) -> List[str]:
+        """Delete documents by key (or by document id when ids is True).
+
+        The deletes are sent in batches of MAX_DELETE_BATCH_SIZE documents, several batches
+        concurrently, and the documents that failed with a retryable status are retried.
+        Returns the ids of the documents that could not be deleted, to retry them later
+        with ids=True.
+        """
+        with AzureSearchBulkIndexer(self.client, max_batch_size=MAX_DELETE_BATCH_SIZE, max_in_flight=MAX_DELETE_BATCHES_IN_FLIGHT,
+                                    action="delete", raise_on_failure=False) as indexer:
+            for key in keys:
+                indexer.add({FIELDS_ID: key if ids else key.replace(':', '_')})
+        self.delete_stats = indexer.stats()
+        failed_keys = indexer.failed_keys()
+        if failed_keys:
+            logger.warning(f"Failed to delete {len(failed_keys)} documents from {self.index_name}")
+        return failed_keys
+
+    def _iter_ids(self, filter: Optional[str]) -> Iterator[str]:
+        for page in self.iter_document_pages(fields=("id",), filter=filter):
+            for row in page:
+                yield row["id"]
+
+    def delete_by_filter(self, filter: Optional[str] = None) -> int:
+        """Delete every document matching an OData filter (the whole index when filter is None).
+
+        The matching ids are listed page by page and streamed to the concurrent bulk delete.
+        The listing is repeated for the indexes listed with $skip (deleting shifts their
+        pages), the documents still visible because of the index refresh delay and the
+        deletes that failed. The ids already deleted are skipped, so each document is only
+        counted once, and the passes stop when a listing finds no other id. Returns the
+        number of documents deleted.
+        """
+        deleted_ids = set()
+        for _ in range(MAX_DELETE_PASSES):
+            new_ids = []
+
+            def iter_new_ids():
+                for id in self._iter_ids(filter):
+                    if id not in deleted_ids:
+                        new_ids.append(id)
+                        yield id
+
+            failed = set(self.delete_keys(iter_new_ids(), ids=True))
+            deleted_ids.update(id for id in new_ids if id not in failed)
+            # Nothing left to delete, or no progress on the ids that keep failing
+            if len(failed) == len(new_ids):
+                break
+        logger.info(f"Deleted {len(deleted_ids)} documents from {self.index_name}" + (f" matching {filter}" if filter else ""))
+        return len(deleted_ids)
+
+'''
+Async counterpart of AzureSearch for the query path, backed by the async SearchClient and an
+async embedding function. The client (and its connection pool) is created once and reused by
+every search, so an instance must be used from a single event loop; close() releases it
+'''
+class AsyncAzureSearch:
+    def __init__(
+        self,
+        azure_cognitive_search_name: str,
+        azure_cognitive_search_key: str,
+        index_name: str,
+        embedding_function: Callable[[str], Awaitable[List[float]]],
+        semantic_configuration_name: str = None,
+        semantic_query_language: str = "en-us",
+    ):
+        self.embedding_function = embedding_function
+        self.index_name = index_name
+        self.semantic_configuration_name = semantic_configuration_name
+        self.semantic_query_language = semantic_query_language
+        self.client = AsyncSearchClient(
+            endpoint=azure_cognitive_search_name, index_name=index_name, credential=AzureKeyCredential(azure_cognitive_search_key))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self) -> None:
+        await self.client.close()
+
+    async def _vector(self, query: str, k: int) -> Vector:
+        embedding = await self.embedding_function(query)
+        return Vector(value=to_json_floats(embedding), k=k, fields=FIELDS_CONTENT_VECTOR)
+
+    async def asimilarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        docs_and_scores = await self.asimilarity_search_with_score(query, k=k, filters=kwargs.get("filters", None))
+        return [doc for doc, _ in docs_and_scores]
+
+    async def asimilarity_search_with_score(
+        self, query: str, k: int = 4, filters: str = None
+    ) -> List[Tuple[Document, float]]:
+        results = await self.client.search(
+            search_text="",
+            vector=await self._vector(query, k),
+            select=[f"{FIELDS_TITLE},{FIELDS_CONTENT},{FIELDS_METADATA}"],
+            filter=filters
+        )
+        return [to_document_and_score(result) async for result in results]
+
+    async def ahybrid_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        docs_and_scores = await self.ahybrid_search_with_score(query, k=k, filters=kwargs.get("filters", None))
+        return [doc for doc, _ in docs_and_scores]
+
+    async def ahybrid_search_with_score(
+        self, query: str, k: int = 4, filters: str = None
+    ) -> List[Tuple[Document, float]]:
+        results = await self.client.search(
+            search_text=query,
+            vector=await self._vector(query, k),
+            select=[f"{FIELDS_TITLE},{FIELDS_CONTENT},{FIELDS_METADATA}"],
+            filter=filters,
+            top=k
+        )
+        return [to_document_and_score(result) async for result in results]
+
+    async def asemantic_hybrid_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        docs_and_scores = await self.asemantic_hybrid_search_with_score(query, k=k, filters=kwargs.get("filters", None))
+        return [doc for doc, _ in docs_and_scores]
+
+    async def asemantic_hybrid_search_with_score(
+        self, query: str, k: int = 4, filters: str = None
+    ) -> List[Tuple[Document, float]]:
+        results = await self.client.search(
+            search_text=query,
+            vector=await self._vector(query, k),
+            select=[f"{FIELDS_TITLE},{FIELDS_CONTENT},{FIELDS_METADATA}"],
+            filter=filters,
+            query_type="semantic",
+            query_language=self.semantic_query_language,
+            semantic_configuration_name=self.semantic_configuration_name,
+            query_caption="extractive",
+            query_answer="extractive",
+            top=k
+        )
+        semantic_answers_dict = to_semantic_answers_dict(await results.get_answers())
+        return [to_semantic_document_and_score(result, semantic_answers_dict) async for result in results]
 
 '''
  Pydantic model that defines a retriever for using Azure Cognitive Search
@@ -479,5 +914,13 @@ class AzureSearchVectorStoreRetriever(BaseRetriever, BaseModel):
         return docs
 
     async def aget_relevant_documents(self, query: str) -> List[Document]:
-        raise NotImplementedError(
-            "AzureSearchVectorStoreRetriever does not support async")
\ No newline at end of file
+        async_store = self.vectorstore.async_store
+        if self.search_type == "similarity":
+            docs = await async_store.asimilarity_search(query, k=self.k)
+        elif self.search_type == "hybrid":
+            docs = await async_store.ahybrid_search(query, k=self.k)
+        elif self.search_type == "semantic_hybrid":
+            docs = await async_store.asemantic_hybrid_search(query, k=self.k)
+        else:
+            raise ValueError(f"search_type of {self.search_type} not allowed.")
+        return docs
\ No newline at end of file